@@ -1,13 +1,5 @@
-import argparse
-from tools.utils import *
-import subprocess
+from tools.ply import main
 
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Convert ARKit poses to g2o format')
-    parser.add_argument('--arposes', type=str, required=True, help='Path to ARKit data folder')
-    args = parser.parse_args()
-
-    arposes_filename = args.arposes
-    
-    convert_ARposes_to_ply(arposes_filename)
\ No newline at end of file
+    main()
@@ -39,6 +39,15 @@
 
 DEFINE_string(g2o_filename, "", "The absolute path of g2o file");
 
+// Binary g2o files (see ViewGraph::ReadG2OBinaryFile) use the ".g2ob"
+// extension; the output is then written in the same binary format.
+bool IsBinaryG2OFile(const std::string& filename) {
+  const std::string extension = ".g2ob";
+  return filename.size() >= extension.size() &&
+         filename.compare(filename.size() - extension.size(),
+                          extension.size(), extension) == 0;
+}
+
 int main(int argc, char* argv[]) {
   gflags::ParseCommandLineFlags(&argc, &argv, false);
 
@@ -54,8 +63,14 @@ int main(int argc, char* argv[]) {
   std::string g2o_filename = FLAGS_g2o_filename;
   std::string g2o_filename_out = g2o_filename + ".out";
 
+  const bool binary = IsBinaryG2OFile(g2o_filename);
+
   gopt::graph::ViewGraph view_graph;
-  view_graph.ReadG2OFile(g2o_filename);
+  if (binary) {
+    view_graph.ReadG2OBinaryFile(g2o_filename);
+  } else {
+    view_graph.ReadG2OFile(g2o_filename);
+  }
 
   // gopt::RotationEstimatorOptions options;
   // options.sdp_solver_options.verbose = true;
@@ -76,5 +91,9 @@ int main(int argc, char* argv[]) {
   std::unordered_map<gopt::image_t, Eigen::Vector3d> global_positions;
   view_graph.TranslationAveraging(options_r, &global_positions);
   LOG(INFO) << "saved data to: " << g2o_filename_out;
-  view_graph.WriteG2OFile(g2o_filename_out);
+  if (binary) {
+    view_graph.WriteG2OBinaryFile(g2o_filename_out);
+  } else {
+    view_graph.WriteG2OFile(g2o_filename_out);
+  }
 }
@@ -0,0 +1,201 @@
+// BSD 3-Clause License
+
+// Copyright (c) 2021, Chenyu
+// All rights reserved.
+
+// Redistribution and use in source and binary forms, with or without
+// modification, are permitted provided that the following conditions are met:
+
+// 1. Redistributions of source code must retain the above copyright notice, this
+//    list of conditions and the following disclaimer.
+
+// 2. Redistributions in binary form must reproduce the above copyright notice,
+//    this list of conditions and the following disclaimer in the documentation
+//    and/or other materials provided with the distribution.
+
+// 3. Neither the name of the copyright holder nor the names of its
+//    contributors may be used to endorse or promote products derived from
+//    this software without specific prior written permission.
+
+// THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+// AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+// IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+// DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+// FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+// DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+// SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+// CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+// OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+// OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+// Python bindings of the view graph solvers. Graphs are built directly from
+// NumPy arrays: C-contiguous float64 inputs are used in place, anything else
+// is converted once by pybind11.
+
+#include <algorithm>
+#include <stdexcept>
+#include <unordered_map>
+#include <vector>
+
+#include <pybind11/numpy.h>
+#include <pybind11/pybind11.h>
+
+#include "geometry/rotation.h"
+#include "graph/view_graph.h"
+
+namespace py = pybind11;
+
+namespace gopt {
+namespace {
+
+using graph::node_t;
+using graph::ViewGraph;
+
+using DoubleArray =
+    py::array_t<double, py::array::c_style | py::array::forcecast>;
+using IndexArray =
+    py::array_t<int64_t, py::array::c_style | py::array::forcecast>;
+
+void AddEdges(ViewGraph* view_graph, const DoubleArray& edges) {
+  if (edges.ndim() != 2 || edges.shape(1) != 9) {
+    throw std::invalid_argument(
+        "edges must be an (E, 9) array of src, dst, tx, ty, tz, qx, qy, qz, qw");
+  }
+
+  const double* data = edges.data();
+  const ssize_t num_edges = edges.shape(0);
+  py::gil_scoped_release release;
+  for (ssize_t k = 0; k < num_edges; k++) {
+    const double* row = data + 9 * k;
+    view_graph->AddG2OEdge(static_cast<node_t>(row[0]),
+                           static_cast<node_t>(row[1]), row + 2);
+  }
+}
+
+void SetPoses(ViewGraph* view_graph, const IndexArray& ids,
+              const DoubleArray& poses) {
+  if (poses.ndim() != 2 || poses.shape(1) != 7 ||
+      ids.ndim() != 1 || ids.shape(0) != poses.shape(0)) {
+    throw std::invalid_argument(
+        "ids must be (N,) and poses (N, 7) of tx, ty, tz, qx, qy, qz, qw");
+  }
+
+  const int64_t* id_data = ids.data();
+  const double* pose_data = poses.data();
+  const ssize_t num_poses = poses.shape(0);
+  py::gil_scoped_release release;
+  for (ssize_t k = 0; k < num_poses; k++) {
+    view_graph->SetNodePose(static_cast<node_t>(id_data[k]),
+                            pose_data + 7 * k);
+  }
+}
+
+// Returns the node ids in ascending order and their poses as an (N, 7) array
+// of tx, ty, tz, qx, qy, qz, qw.
+py::tuple GetPoses(const ViewGraph& view_graph) {
+  const auto& nodes = view_graph.GetNodes();
+  std::vector<node_t> node_ids;
+  node_ids.reserve(nodes.size());
+  for (const auto& node_iter : nodes) {
+    node_ids.push_back(node_iter.first);
+  }
+  std::sort(node_ids.begin(), node_ids.end());
+
+  const ssize_t num_nodes = static_cast<ssize_t>(node_ids.size());
+  py::array_t<int64_t> ids(num_nodes);
+  py::array_t<double> poses({num_nodes, static_cast<ssize_t>(7)});
+  int64_t* id_data = ids.mutable_data();
+  double* pose_data = poses.mutable_data();
+  for (ssize_t k = 0; k < num_nodes; k++) {
+    const graph::ViewNode& node = nodes.at(node_ids[k]);
+    const Eigen::Vector4d qvec = AngleAxisToQuaternion(node.rotation);
+    double* row = pose_data + 7 * k;
+    id_data[k] = static_cast<int64_t>(node.id);
+    row[0] = node.position[0];
+    row[1] = node.position[1];
+    row[2] = node.position[2];
+    row[3] = qvec[1];
+    row[4] = qvec[2];
+    row[5] = qvec[3];
+    row[6] = qvec[0];
+  }
+  return py::make_tuple(ids, poses);
+}
+
+}  // namespace
+}  // namespace gopt
+
+PYBIND11_MODULE(pygopt, m) {
+  using namespace gopt;
+
+  m.doc() = "Python bindings of the GraphOptim view graph solvers.";
+
+  py::enum_<GlobalRotationEstimatorType>(m, "GlobalRotationEstimatorType")
+      .value("LAGRANGIAN_DUAL", GlobalRotationEstimatorType::LAGRANGIAN_DUAL)
+      .value("HYBRID", GlobalRotationEstimatorType::HYBRID)
+      .value("ROBUST_L1L2", GlobalRotationEstimatorType::ROBUST_L1L2);
+
+  py::enum_<GlobalRotationEstimatorInitMethod>(
+      m, "GlobalRotationEstimatorInitMethod")
+      .value("RANDOM", GlobalRotationEstimatorInitMethod::RANDOM)
+      .value("MAXIMUM_SPANNING_TREE",
+             GlobalRotationEstimatorInitMethod::MAXIMUM_SPANNING_TREE);
+
+  py::enum_<PositionEstimatorType>(m, "PositionEstimatorType")
+      .value("LUD", PositionEstimatorType::LUD)
+      .value("BATA", PositionEstimatorType::BATA)
+      .value("LIGT", PositionEstimatorType::LIGT);
+
+  py::class_<RotationEstimatorOptions>(m, "RotationEstimatorOptions")
+      .def(py::init<>())
+      .def_readwrite("verbose", &RotationEstimatorOptions::verbose)
+      .def_readwrite("estimator_type",
+                     &RotationEstimatorOptions::estimator_type)
+      .def_readwrite("init_method", &RotationEstimatorOptions::init_method)
+      .def("setup", &RotationEstimatorOptions::Setup);
+
+  py::class_<PositionEstimatorOptions>(m, "PositionEstimatorOptions")
+      .def(py::init<>())
+      .def_readwrite("estimator_type",
+                     &PositionEstimatorOptions::estimator_type)
+      .def_readwrite("verbose", &PositionEstimatorOptions::verbose)
+      .def_readwrite("max_num_iterations",
+                     &PositionEstimatorOptions::max_num_iterations)
+      .def_readwrite("max_num_reweighted_iterations",
+                     &PositionEstimatorOptions::max_num_reweighted_iterations)
+      .def_readwrite("convergence_criterion",
+                     &PositionEstimatorOptions::convergence_criterion);
+
+  py::class_<graph::ViewGraph>(m, "ViewGraph")
+      .def(py::init<>())
+      .def("add_edges", &AddEdges, py::arg("edges"),
+           "Add (E, 9) g2o edges: src, dst, tx, ty, tz, qx, qy, qz, qw.")
+      .def("set_poses", &SetPoses, py::arg("ids"), py::arg("poses"),
+           "Set (N, 7) node poses: tx, ty, tz, qx, qy, qz, qw.")
+      .def("poses", &GetPoses,
+           "Return the sorted node ids and their (N, 7) poses.")
+      .def("num_nodes", &graph::ViewGraph::GetNodesNum)
+      .def("num_edges", &graph::ViewGraph::GetEdgesNum)
+      .def("read_g2o", &graph::ViewGraph::ReadG2OFile, py::arg("filename"))
+      .def("write_g2o", &graph::ViewGraph::WriteG2OFile, py::arg("filename"))
+      .def("read_g2o_binary", &graph::ViewGraph::ReadG2OBinaryFile,
+           py::arg("filename"))
+      .def("write_g2o_binary", &graph::ViewGraph::WriteG2OBinaryFile,
+           py::arg("filename"))
+      .def("rotation_averaging",
+           [](graph::ViewGraph& view_graph,
+              const RotationEstimatorOptions& options) {
+             std::unordered_map<image_t, Eigen::Vector3d> global_rotations;
+             py::gil_scoped_release release;
+             return view_graph.RotationAveraging(options, &global_rotations);
+           },
+           py::arg("options") = RotationEstimatorOptions())
+      .def("translation_averaging",
+           [](graph::ViewGraph& view_graph,
+              const PositionEstimatorOptions& options) {
+             std::unordered_map<image_t, Eigen::Vector3d> positions;
+             py::gil_scoped_release release;
+             return view_graph.TranslationAveraging(options, &positions);
+           },
+           py::arg("options") = PositionEstimatorOptions());
+}
@@ -30,6 +30,10 @@
 
 #include "graph/view_graph.h"
 
+#include <cstdint>
+#include <cstring>
+#include <fstream>
+
 #include <Eigen/Geometry>
 
 #include "geometry/rotation.h"
@@ -43,8 +47,56 @@
 namespace gopt {
 namespace graph {
 
+namespace {
+
+const char kG2OBinaryMagic[4] = {'G', '2', 'O', 'B'};
+const uint32_t kG2OBinaryVersion = 1;
+
+struct G2OBinaryVertex {
+  int64_t id;
+  double pose[7];
+};
+
+struct G2OBinaryEdge {
+  int64_t src;
+  int64_t dst;
+  double pose[7];
+  double information[21];
+};
+
+}  // namespace
+
 ViewGraph::ViewGraph() {}
 
+void ViewGraph::AddG2OEdge(const node_t i, const node_t j, const double* pose) {
+  ViewEdge edge;
+  edge.src = (i > j) ? j : i;
+  edge.dst = (i > j) ? i : j;
+
+  // Fill in elements of the measurement.
+  const Eigen::Quaterniond quat(pose[6], pose[3], pose[4], pose[5]);
+  const Eigen::AngleAxisd angle_axis =
+      (i < j) ? Eigen::AngleAxisd(quat) : Eigen::AngleAxisd(quat.conjugate());
+
+  edge.rel_translation = Eigen::Vector3d(pose[0], pose[1], pose[2]);
+  if (i > j) {
+    edge.rel_translation = -angle_axis.toRotationMatrix() * edge.rel_translation;
+  }
+  edge.rel_rotation = angle_axis.angle() * angle_axis.axis();
+  AddEdge(edge);
+}
+
+void ViewGraph::SetNodePose(const node_t id, const double* pose) {
+  if (!HasNode(id)) {
+    AddNode(ViewNode(id));
+  }
+
+  ViewNode& node = nodes_[id];
+  node.position = Eigen::Vector3d(pose[0], pose[1], pose[2]);
+  node.rotation = QuaternionToAngleAxis(
+      Eigen::Vector4d(pose[6], pose[3], pose[4], pose[5]));
+}
+
 bool ViewGraph::ReadG2OFile(const std::string& filename) {
   // A string used to contain the contents of a single line.
   std::string line;
@@ -58,7 +110,6 @@ bool ViewGraph::ReadG2OFile(const std::string& filename) {
          I33, I34, I35, I36, I44, I45, I46, I55, I56, I66;
 
   node_t i, j;
-  ViewEdge edge;
 
   std::ifstream infile(filename);
   if (!infile.is_open()) {
@@ -90,20 +141,8 @@ bool ViewGraph::ReadG2OFile(const std::string& filename) {
           I12 >> I13 >> I14 >> I15 >> I16 >> I22 >> I23 >> I24 >> I25 >> I26 >>
           I33 >> I34 >> I35 >> I36 >> I44 >> I45 >> I46 >> I55 >> I56 >> I66;
 
-      edge.src = (i > j) ? j : i;
-      edge.dst = (i > j) ? i : j;
-
-      // Fill in elements of the measurement.
-      const Eigen::Quaterniond quat(qw, qx, qy, qz);
-      const Eigen::AngleAxisd angle_axis =
-          (i < j) ? Eigen::AngleAxisd(quat) : Eigen::AngleAxisd(quat.conjugate());
-
-      edge.rel_translation = Eigen::Vector3d(tx, ty, tz);
-      if (i > j) {
-        edge.rel_translation = -angle_axis.toRotationMatrix() * edge.rel_translation;
-      }
-      edge.rel_rotation = angle_axis.angle() * angle_axis.axis();
-      AddEdge(edge);
+      const double pose[7] = {tx, ty, tz, qx, qy, qz, qw};
+      AddG2OEdge(i, j, pose);
     } else if (token == "VERTEX_SE3:QUAT") {
       // This is just initialization information, so do nothing.
       continue;
@@ -155,6 +194,111 @@ void ViewGraph::WriteG2OFile(const std::string& filename) {
   ofs.close();
 }
 
+bool ViewGraph::ReadG2OBinaryFile(const std::string& filename) {
+  std::ifstream infile(filename, std::ios::binary);
+  if (!infile.is_open()) {
+    LOG(ERROR) << "Cannot read binary g2o file: " << filename;
+    return false;
+  }
+
+  char magic[4];
+  uint32_t version = 0;
+  uint64_t num_vertices = 0, num_edges = 0;
+  infile.read(magic, sizeof(magic));
+  infile.read(reinterpret_cast<char*>(&version), sizeof(version));
+  infile.read(reinterpret_cast<char*>(&num_vertices), sizeof(num_vertices));
+  infile.read(reinterpret_cast<char*>(&num_edges), sizeof(num_edges));
+
+  if (!infile || std::memcmp(magic, kG2OBinaryMagic, sizeof(magic)) != 0) {
+    LOG(ERROR) << filename << " is not a binary g2o file!";
+    return false;
+  }
+  if (version != kG2OBinaryVersion) {
+    LOG(ERROR) << "Unsupported binary g2o version: " << version << "!";
+    return false;
+  }
+
+  // Vertices are just initialization information, so skip them.
+  infile.seekg(num_vertices * sizeof(G2OBinaryVertex), std::ios::cur);
+
+  std::vector<G2OBinaryEdge> records(num_edges);
+  infile.read(reinterpret_cast<char*>(records.data()),
+              num_edges * sizeof(G2OBinaryEdge));
+  if (!infile) {
+    LOG(ERROR) << "Truncated binary g2o file: " << filename;
+    return false;
+  }
+
+  for (const G2OBinaryEdge& record : records) {
+    AddG2OEdge(static_cast<node_t>(record.src),
+               static_cast<node_t>(record.dst), record.pose);
+  }
+
+  return true;
+}
+
+void ViewGraph::WriteG2OBinaryFile(const std::string& filename) {
+  std::ofstream ofs(filename, std::ios::binary);
+  if (!ofs.is_open()) {
+    LOG(ERROR) << filename << " cannot be opened!";
+    return;
+  }
+
+  std::vector<G2OBinaryVertex> vertices;
+  vertices.reserve(nodes_.size());
+  for (const auto& node_iter : nodes_) {
+    const Eigen::Vector3d& position = node_iter.second.position;
+    const Eigen::Vector4d qvec =
+        AngleAxisToQuaternion(node_iter.second.rotation);
+    G2OBinaryVertex vertex;
+    vertex.id = static_cast<int64_t>(node_iter.second.id);
+    vertex.pose[0] = position[0];
+    vertex.pose[1] = position[1];
+    vertex.pose[2] = position[2];
+    vertex.pose[3] = qvec[1];
+    vertex.pose[4] = qvec[2];
+    vertex.pose[5] = qvec[3];
+    vertex.pose[6] = qvec[0];
+    vertices.push_back(vertex);
+  }
+
+  std::vector<G2OBinaryEdge> edges;
+  for (const auto& edge_iter : edges_) {
+    for (const auto& em_iter : edge_iter.second) {
+      const ViewEdge& view_edge = em_iter.second;
+      const Eigen::Vector3d& tvec = view_edge.rel_translation;
+      const Eigen::Vector4d qvec =
+          AngleAxisToQuaternion(view_edge.rel_rotation);
+      G2OBinaryEdge edge;
+      std::memset(&edge, 0, sizeof(edge));
+      edge.src = static_cast<int64_t>(view_edge.src);
+      edge.dst = static_cast<int64_t>(view_edge.dst);
+      edge.pose[0] = tvec[0];
+      edge.pose[1] = tvec[1];
+      edge.pose[2] = tvec[2];
+      edge.pose[3] = qvec[1];
+      edge.pose[4] = qvec[2];
+      edge.pose[5] = qvec[3];
+      edge.pose[6] = qvec[0];
+      edges.push_back(edge);
+    }
+  }
+
+  const uint64_t num_vertices = vertices.size();
+  const uint64_t num_edges = edges.size();
+  ofs.write(kG2OBinaryMagic, sizeof(kG2OBinaryMagic));
+  ofs.write(reinterpret_cast<const char*>(&kG2OBinaryVersion),
+            sizeof(kG2OBinaryVersion));
+  ofs.write(reinterpret_cast<const char*>(&num_vertices), sizeof(num_vertices));
+  ofs.write(reinterpret_cast<const char*>(&num_edges), sizeof(num_edges));
+  ofs.write(reinterpret_cast<const char*>(vertices.data()),
+            num_vertices * sizeof(G2OBinaryVertex));
+  ofs.write(reinterpret_cast<const char*>(edges.data()),
+            num_edges * sizeof(G2OBinaryEdge));
+
+  ofs.close();
+}
+
 bool ViewGraph::MotionAveraging(
     const RotationEstimatorOptions& rotation_estimator_options,
     const PositionEstimatorOptions& position_estimator_options,
@@ -78,9 +78,27 @@ class ViewGraph : public Graph<ViewNode, ViewEdge> {
   void InitializeGlobalPositions(
       std::unordered_map<image_t, Eigen::Vector3d>* positions);
 
+  // Adds the g2o relative pose measurement between nodes i and j as an edge.
+  // pose points to tx, ty, tz, qx, qy, qz, qw.
+  void AddG2OEdge(const node_t i, const node_t j, const double* pose);
+
+  // Sets the absolute pose of a node, adding the node if it does not exist.
+  // pose points to tx, ty, tz, qx, qy, qz, qw.
+  void SetNodePose(const node_t id, const double* pose);
+
   bool ReadG2OFile(const std::string& filename);
   void WriteG2OFile(const std::string& filename);
 
+  // Compact little-endian binary counterpart of the g2o text format, written
+  // by tools/utils.py:write_g2o_binary. The layout is
+  //   header: char[4] "G2OB", uint32 version, uint64 num_vertices,
+  //           uint64 num_edges
+  //   vertex: int64 id, double tx ty tz qx qy qz qw
+  //   edge:   int64 src, int64 dst, double tx ty tz qx qy qz qw,
+  //           double I11 ... I66 (upper triangle of the information matrix)
+  bool ReadG2OBinaryFile(const std::string& filename);
+  void WriteG2OBinaryFile(const std::string& filename);
+
  private:
   void ViewEdgesToViewPairs(
     std::unordered_map<ImagePair, TwoViewGeometry>* view_pairs);
@@ -1,5 +1,7 @@
 #include "graph/view_graph.h"
 
+#include <cstdio>
+
 #include <gtest/gtest.h>
 
 #include "geometry/rotation_utils.h"
@@ -71,5 +73,39 @@ TEST(VIEW_GRAPH_TEST, TEST_INITIALIZE_GLOBAL_ROTATIONS_FROM_MST) {
   LOG(INFO) << "Min Angular Residual (deg): " << angular_errors[0];
 }
 
+TEST(VIEW_GRAPH_TEST, TEST_BINARY_G2O_ROUND_TRIP) {
+  const size_t num_nodes = 20;
+  const double completeness = 0.5;
+  const double sigma = 5;
+  const double outlier_ratio = 0;
+
+  ViewGraphGenerator::ViewGraphGeneratorOptions options;
+  ViewGraphGenerator generator(options);
+  std::unordered_map<gopt::image_t, Eigen::Vector3d> gt_rotations;
+
+  ViewGraph view_graph = generator.GenerateRandomGraph(
+    num_nodes, completeness, sigma, outlier_ratio, 0, 0,
+    &gt_rotations, nullptr);
+
+  const std::string filename = "view_graph_test.g2ob";
+  view_graph.WriteG2OBinaryFile(filename);
+
+  ViewGraph loaded_graph;
+  EXPECT_TRUE(loaded_graph.ReadG2OBinaryFile(filename));
+  EXPECT_EQ(loaded_graph.GetEdgesNum(), view_graph.GetEdgesNum());
+
+  for (const auto& edge_iter : view_graph.GetEdges()) {
+    for (const auto& em_iter : edge_iter.second) {
+      const ViewEdge& edge = em_iter.second;
+      const ViewEdge& loaded_edge = loaded_graph.GetEdge(edge.src, edge.dst);
+      EXPECT_LT((edge.rel_rotation - loaded_edge.rel_rotation).norm(), 1e-9);
+      EXPECT_LT(
+        (edge.rel_translation - loaded_edge.rel_translation).norm(), 1e-9);
+    }
+  }
+
+  std::remove(filename.c_str());
+}
+
 }  // namespace graph
 }  // namespace gopt
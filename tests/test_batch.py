@@ -0,0 +1,70 @@
+import json
+import os
+
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+
+from tools import batch
+from tools.trajectory import Trajectory
+
+
+def write_session(folder, num_poses=1200, laps=2):
+    """ARposes.txt of a drifting trajectory going around the same circle several times."""
+    os.makedirs(folder)
+    angles = np.linspace(0.0, 2.0 * np.pi * laps, num_poses)
+    positions = np.column_stack([2.0 * np.cos(angles), 2.0 * np.sin(angles), np.zeros(num_poses)])
+    positions += np.linspace(0.0, 0.1, num_poses)[:, None]
+    quats = R.from_euler('z', (angles + np.pi / 2)[:, None]).as_quat()
+    filename = os.path.join(folder, batch.ARPOSES_FILENAME)
+    Trajectory(1000.0 + np.arange(num_poses) / 30.0, positions, quats).to_arposes(filename)
+    return filename
+
+
+def test_read_manifest_without_pairs(tmp_path):
+    arposes = write_session(str(tmp_path / 'session'))
+    manifest = tmp_path / 'manifest.csv'
+    manifest.write_text("arposes,pairs\nsession/ARposes.txt,\nsession/ARposes.txt\n")
+
+    assert batch.read_manifest(str(tmp_path)) == [(arposes, None)]
+    assert [pairs for _, pairs in batch.read_manifest(str(manifest))] == [None, None]
+
+
+def test_batch_detects_loop_closures_without_pairs(tmp_path):
+    arposes = write_session(str(tmp_path / 'session'))
+    report = tmp_path / 'report.json'
+    args = [str(tmp_path), '--workers', '1', '--backend', 'numpy', '--no-cache', '--report', str(report)]
+
+    assert batch.main(args) == 0
+    with open(report) as f:
+        summary = json.load(f)
+    assert summary['counts'] == {'ok': 1, 'skipped': 0, 'failed': 0}
+    assert summary['sessions'][0]['pairs'] is None
+    assert len(Trajectory.from_arposes(arposes.replace('.txt', '.adj.txt'), cache=False)) == 1200
+
+    # the outputs are now newer than the inputs
+    assert batch.main(args) == 0
+    with open(report) as f:
+        assert json.load(f)['counts']['skipped'] == 1
+
+
+def test_batch_forwards_partition_options(tmp_path):
+    write_session(str(tmp_path / 'session'))
+    report = tmp_path / 'report.json'
+    args = [str(tmp_path), '--workers', '1', '--backend', 'subprocess', '--cluster-size', '400', '--no-cache',
+            '--report', str(report)]
+
+    # partitioned optimization needs the numpy backend
+    assert batch.main(args) == 1
+    with open(report) as f:
+        assert 'numpy backend' in json.load(f)['sessions'][0]['error']
+
+
+def test_batch_forwards_cycle_filter_options(tmp_path):
+    write_session(str(tmp_path / 'session'))
+    report = tmp_path / 'report.json'
+    args = [str(tmp_path), '--workers', '1', '--backend', 'numpy', '--cycle-filter', 'reject', '--no-cache',
+            '--report', str(report)]
+
+    assert batch.main(args) == 0
+    with open(report) as f:
+        assert 'cycle_filter' in json.load(f)['sessions'][0]['timings']
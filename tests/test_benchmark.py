@@ -0,0 +1,29 @@
+import json
+import os
+
+from tools import benchmark
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_default_benchmarks_on_synthetic_graph(tmp_path, monkeypatch):
+    # The stages run in child interpreters started from the repository root.
+    monkeypatch.chdir(ROOT)
+    output = tmp_path / 'benchmark.json'
+    status = benchmark.main(['--graphs', os.path.join('data', 'synthetic', '20_2.g2o'), '--repeat', '1',
+                             '--bin-dir', os.path.join(ROOT, 'bin'), '--output', str(output)])
+
+    with open(output) as f:
+        results = {result['benchmark']: result for result in json.load(f)['results']}
+    assert [result.get('error') for result in results.values()] == [None] * len(results)
+    assert set(benchmark.STAGES) | set(benchmark.PYTHON_SOLVERS) <= set(results)
+    assert status == 0
+
+    numpy_result = results['numpy_pose_graph']
+    assert numpy_result['rotation_error_deg'] < numpy_result['noise']
+    assert numpy_result['translation_error'] < 1e-6
+    # The C++ solvers run where they are built: the NumPy backend must be as accurate.
+    if 'rotation_estimator' in results:
+        assert numpy_result['rotation_error_deg'] <= 1.1 * results['rotation_estimator']['rotation_error_deg'] + 0.1
+    if 'position_estimator' in results:
+        assert numpy_result['translation_error'] <= 1.1 * results['position_estimator']['translation_error'] + 1e-3
@@ -0,0 +1,29 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Parse --help in a fresh interpreter and list the modules it imported.
+LIST_MODULES = """
+import json, sys
+from tools import cli
+try:
+    cli.main(sys.argv[1:])
+except SystemExit:
+    pass
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+@pytest.mark.parametrize('command', ['adjust', 'batch', 'arposes2ply'])
+def test_help_does_not_import_heavy_modules(command):
+    result = subprocess.run([sys.executable, '-c', LIST_MODULES, command, '--help'], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    modules = set(json.loads(result.stdout.splitlines()[-1]))
+
+    assert 'tools.cli' in modules
+    assert not modules & {'pandas', 'scipy.sparse', 'scipy.spatial', 'tools.pose_graph', 'tools.trajectory'}
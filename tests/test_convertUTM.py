@@ -0,0 +1,23 @@
+import numpy as np
+
+from tools.convertUTM import apply_transformation_to_obj
+
+
+def test_obj_vertices_with_irregular_spacing(tmp_path):
+    obj = tmp_path / 'mesh.obj'
+    # irregular spacing: the second and third lines have as many spaces as the
+    # first, which has an extra w coordinate
+    obj.write_text("v 1 2 3 0.5\nv  4 5 6\nv 7 8 9 \nvn 0 0 1\nvn  1 0 0\nf 1 2 3\n")
+    rotation = np.array([[0.0, -1.0, 0.0], [1.0, 0.0, 0.0], [0.0, 0.0, 1.0]])
+    translation = np.array([10.0, 20.0, 30.0])
+    output = tmp_path / 'mesh.utm.obj'
+
+    apply_transformation_to_obj(str(obj), rotation, translation, str(output), chunk_size=2)
+
+    lines = output.read_text().splitlines()
+    vertices = np.array([line.split()[1:4] for line in lines if line.startswith('v ')], dtype=float)
+    normals = np.array([line.split()[1:] for line in lines if line.startswith('vn ')], dtype=float)
+    np.testing.assert_allclose(vertices, np.arange(1.0, 10.0).reshape(3, 3) @ rotation.T + translation)
+    np.testing.assert_allclose(normals, np.array([[0.0, 0.0, 1.0], [1.0, 0.0, 0.0]]) @ rotation.T, atol=1e-12)
+    assert float(lines[0].split()[4]) == 0.5
+    assert lines[-1] == 'f 1 2 3'
@@ -0,0 +1,78 @@
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+
+from tools import cycle_consistency, pose_graph
+from tools.utils import DEFAULT_INFORMATION, read_g2o_edges, relative_pose_edges, write_g2o
+
+
+NUM_POSES = 200
+
+
+def spiral_graph():
+    """Two laps of a circle, with odometry edges and ten loop closures between the laps."""
+    angles = np.linspace(0.0, 4.0 * np.pi, NUM_POSES)
+    positions = np.column_stack([2.0 * np.cos(angles), 2.0 * np.sin(angles), np.zeros(NUM_POSES)])
+    rotations = R.from_euler('z', (angles + np.pi / 2)[:, None])
+    src = np.concatenate([np.arange(NUM_POSES - 1), np.arange(0, 100, 10)])
+    dst = np.concatenate([np.arange(1, NUM_POSES), np.arange(100, 200, 10)])
+    return positions, rotations, relative_pose_edges(positions, rotations, src, dst)
+
+
+def test_main_validates_against_the_vertex_poses(tmp_path, monkeypatch):
+    positions, rotations, edges = spiral_graph()
+    edges['tx'][-1] += 1.0  # a wrong loop closure
+    g2o = str(tmp_path / 'graph.g2o')
+    write_g2o(g2o, np.column_stack([positions, rotations.as_quat()]), edges)
+
+    validate_edges = cycle_consistency.validate_edges
+    calls = list()
+    monkeypatch.setattr(cycle_consistency, 'validate_edges',
+                        lambda *args, **kwargs: calls.append(args) or validate_edges(*args, **kwargs))
+    output = str(tmp_path / 'filtered.g2o')
+    cycle_consistency.main(['--g2o', g2o, '--output', output, '--cycle-filter', 'reject'])
+
+    _, _, ids, vertex_poses = calls[0]
+    np.testing.assert_array_equal(ids, np.arange(NUM_POSES))
+    np.testing.assert_allclose(vertex_poses[:, :3], positions)
+    filtered, _ = read_g2o_edges(output)
+    assert len(filtered) == len(edges) - 1
+
+
+def test_main_weights_the_information_by_support(tmp_path):
+    positions, rotations, edges = spiral_graph()
+    # two loop closures off in opposite directions: their common cycles fail, the others hold
+    edges['tx'][-5] += 0.2
+    edges['tx'][-4] -= 0.2
+    vertex_poses = np.column_stack([positions, rotations.as_quat()])
+    g2o = str(tmp_path / 'graph.g2o')
+    write_g2o(g2o, vertex_poses, edges)
+
+    output = str(tmp_path / 'weighted.g2o')
+    cycle_consistency.main(['--g2o', g2o, '--output', output, '--cycle-filter', 'weight'])
+
+    candidates = np.arange(len(edges)) >= NUM_POSES - 1
+    support, _ = cycle_consistency.validate_edges(edges, candidates, np.arange(NUM_POSES), vertex_poses)
+    assert 0.5 < support[-5] < 1.0 and 0.5 < support[-4] < 1.0
+    weighted, information = read_g2o_edges(output)
+    assert len(weighted) == len(edges)
+    upper = DEFAULT_INFORMATION[np.triu_indices(6)]
+    np.testing.assert_allclose(information, np.where(candidates, support, 1.0)[:, None] * upper)
+
+
+def test_main_chains_graphs_without_vertex_rotations_along_the_odometry(tmp_path, monkeypatch):
+    _, _, edges = spiral_graph()
+    edges['tx'][-1] += 1.0  # a wrong loop closure
+    g2o = str(tmp_path / 'graph.g2o')
+    # vertices as in data/synthetic: no positions and no rotations
+    write_g2o(g2o, np.zeros((NUM_POSES, 7)), edges)
+
+    initialize_from_tree = pose_graph.initialize_from_tree
+    calls = list()
+    monkeypatch.setattr(pose_graph, 'initialize_from_tree',
+                        lambda *args, **kwargs: calls.append(kwargs) or initialize_from_tree(*args, **kwargs))
+    output = str(tmp_path / 'filtered.g2o')
+    cycle_consistency.main(['--g2o', g2o, '--output', output, '--cycle-filter', 'reject'])
+
+    assert calls == [{'world_frame': True}]
+    filtered, _ = read_g2o_edges(output)
+    np.testing.assert_array_equal(filtered, edges[:-1])
@@ -0,0 +1,11 @@
+from tools import evaluate
+
+
+def test_evaluate_without_cache(tmp_path):
+    filename = tmp_path / 'ARposes.txt'
+    filename.write_text(''.join('{},{},0,0,1,0,0,0\n'.format(1000.0 + i, 0.1 * i) for i in range(5)))
+
+    evaluate.main(['--estimate', str(filename), '--reference', str(filename), '--json', str(tmp_path / 'metrics.json'),
+                   '--no-cache'])
+    # read-only inputs: nothing but the requested output is written
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['ARposes.txt', 'metrics.json']
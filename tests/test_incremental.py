@@ -0,0 +1,32 @@
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+
+from tools.incremental import SlidingWindowAdjuster
+from tools.loop_closure import find_loop_closures
+from tools.trajectory import Trajectory
+
+
+def revisiting_trajectory(num_poses=6000):
+    """A widening spiral, walked twice with a small offset."""
+    angles = np.linspace(0.0, 6.0 * np.pi, num_poses // 2)
+    radii = np.linspace(1.0, 4.0, num_poses // 2)
+    positions = np.column_stack([radii * np.cos(angles), radii * np.sin(angles), np.zeros(num_poses // 2)])
+    positions = np.concatenate([positions, positions + 0.05])
+    quats = R.from_euler('z', (np.concatenate([angles, angles]) + np.pi / 2)[:, None]).as_quat()
+    return Trajectory(1000.0 + np.arange(num_poses) / 30.0, positions, quats)
+
+
+def test_streamed_loop_closures_match_the_whole_trajectory():
+    trajectory = revisiting_trajectory()
+    adjuster = SlidingWindowAdjuster()
+    for start in range(0, len(trajectory), 30):
+        adjuster.append(trajectory[start:start + 30])
+    adjuster.flush()
+
+    edges = adjuster.edges[:adjuster.num_edges]
+    loop_closures = edges[edges['dst'] - edges['src'] > 1]
+    streamed = np.column_stack([loop_closures['src'], loop_closures['dst']])
+    streamed = streamed[np.lexsort((streamed[:, 1], streamed[:, 0]))]
+    expected = find_loop_closures(trajectory.positions, trajectory.quats, trajectory.timestamps)
+    assert len(expected) > 0
+    np.testing.assert_array_equal(streamed, expected)
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from scipy.spatial.transform import Rotation as R
+
+from tools import pose_graph
+from tools.utils import body_frame_edges, read_g2o_vertices, relative_pose_edges, write_g2o
+
+
+def random_graph(num_poses=60, seed=0):
+    """Poses along a random walk, with odometry and loop-closure edges in the frame of their source."""
+    rng = np.random.default_rng(seed)
+    positions = np.cumsum(rng.normal(size=(num_poses, 3)), axis=0)
+    rotations = R.random(num_poses, random_state=seed)
+    src = np.concatenate([np.arange(num_poses - 1), np.arange(0, num_poses - 20, 5)])
+    dst = np.concatenate([np.arange(1, num_poses), np.arange(20, num_poses, 5)])
+    edges = body_frame_edges(relative_pose_edges(positions, rotations, src, dst), rotations)
+    return positions, rotations, edges
+
+
+def aligned_errors(poses, positions, rotations):
+    """Largest position and rotation errors once the gauge of the first node is removed."""
+    solved = R.from_quat(poses[:, 3:])
+    # a rigid motion of the world: p -> G p + c and R -> R G^T
+    gauge = solved[0].inv() * rotations[0]
+    translation = poses[0, :3] - gauge.apply(positions[0])
+    position_errors = np.linalg.norm(poses[:, :3] - gauge.apply(positions) - translation, axis=1)
+    rotation_errors = (solved * (rotations * gauge.inv()).inv()).magnitude()
+    return position_errors.max(), rotation_errors.max()
+
+
+@pytest.mark.parametrize('init', ['tree', 'vertices'])
+def test_optimize_recovers_se3_poses(init):
+    positions, rotations, edges = random_graph()
+    rng = np.random.default_rng(1)
+    noisy = edges.copy()
+    for name in ('tx', 'ty', 'tz'):
+        noisy[name] += rng.normal(scale=0.01, size=len(edges))
+    noisy_rotations = R.from_rotvec(rng.normal(scale=0.005, size=(len(edges), 3))) * \
+        R.from_quat(np.column_stack([edges['qx'], edges['qy'], edges['qz'], edges['qw']]))
+    noisy['qx'], noisy['qy'], noisy['qz'], noisy['qw'] = noisy_rotations.as_quat().T
+
+    # start from poses drifting away from the first one, which is held fixed
+    drift = np.linspace(0.0, 1.0, len(positions))[:, None]
+    vertex_poses = np.column_stack([positions + drift, (R.from_rotvec(0.2 * drift * [0, 0, 1]) * rotations).as_quat()])
+    vertex_poses[0] = np.concatenate([positions[0], rotations[0].as_quat()])
+
+    ids, poses, summary = pose_graph.optimize_pose_graph(noisy, np.arange(len(positions)), vertex_poses, init=init)
+    np.testing.assert_array_equal(ids, np.arange(len(positions)))
+    assert summary['final_cost'] < summary['initial_cost']
+    position_error, rotation_error = aligned_errors(poses, positions, rotations)
+    assert position_error < 0.2
+    assert rotation_error < 0.05
+
+
+def test_optimize_command_accepts_g2o_without_vertices(tmp_path):
+    positions, rotations, edges = random_graph()
+    g2o = str(tmp_path / 'graph.g2o')
+    write_g2o(g2o, np.zeros((len(positions), 7)), edges)
+
+    pose_graph.main(['--g2o', g2o])
+    ids, poses = read_g2o_vertices(g2o + '.out')
+    position_error, rotation_error = aligned_errors(poses[np.argsort(ids)], positions, rotations)
+    assert position_error < 1e-6
+    assert rotation_error < 1e-6
@@ -0,0 +1,72 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from tools.incremental import follow_arposes
+from tools.trajectory import Trajectory
+
+ROWS = [[1000.0 + i / 30.0, 0.1 * i, 0.2 * i, 0.3 * i, 1.0, 0.0, 0.0, 0.0] for i in range(5)]
+
+
+def write_rows(filename, header=None):
+    with open(filename, 'w') as f:
+        if header:
+            f.write(header + '\n')
+        for row in ROWS:
+            f.write(','.join(repr(value) for value in row) + '\n')
+
+
+@pytest.mark.parametrize('cache', [False, True])
+@pytest.mark.parametrize('header', [None, 'Timestamp,X,Y,Z,QW,QX,QY,QZ'])
+def test_from_arposes_with_and_without_header(tmp_path, header, cache):
+    filename = str(tmp_path / 'ARposes.txt')
+    write_rows(filename, header)
+
+    trajectory = Trajectory.from_arposes(filename, cache=cache)
+    expected = np.array(ROWS)
+    # pandas' fast float parser may be off by one ulp
+    np.testing.assert_allclose(trajectory.timestamps, expected[:, 0], rtol=1e-15)
+    np.testing.assert_allclose(trajectory.positions, expected[:, 1:4], rtol=1e-15)
+    np.testing.assert_array_equal(trajectory.quats, expected[:, [5, 6, 7, 4]])
+    assert trajectory.tracking_status is None
+
+
+def test_follow_arposes_without_header(tmp_path):
+    filename = str(tmp_path / 'ARposes.txt')
+    write_rows(filename)
+
+    chunks = list(follow_arposes(filename, chunk_size=2))
+    np.testing.assert_allclose(np.concatenate([chunk.timestamps for chunk in chunks]), np.array(ROWS)[:, 0],
+                               rtol=1e-15)
+
+
+def test_arposes2ply_writes_ascii_unless_binary(tmp_path):
+    from tools import ply
+
+    filename = str(tmp_path / 'ARposes.txt')
+    write_rows(filename)
+    expected = np.array(ROWS)[:, 1:4]
+
+    for args, ply_format in [([], b'format ascii 1.0'), (['--binary'], b'format binary_little_endian 1.0')]:
+        ply.main(['--arposes', filename, '--double'] + args)
+        with open(str(tmp_path / 'ARposes.ply'), 'rb') as f:
+            assert f.read().split(b'\n')[1] == ply_format
+        vertices = ply.read_ply(str(tmp_path / 'ARposes.ply'))
+        np.testing.assert_allclose(np.column_stack([vertices['x'], vertices['y'], vertices['z']]), expected, rtol=1e-15)
+
+
+@pytest.mark.parametrize('cache', [False, True])
+def test_from_sfm_data_uses_the_gopt_cache(tmp_path, cache):
+    filename = str(tmp_path / 'sfm_data.json')
+    extrinsics = [{'key': key, 'value': {'rotation': np.eye(3).tolist(), 'center': [key, 2.0 * key, 0.5]}}
+                  for key in range(4)]
+    with open(filename, 'w') as f:
+        json.dump({'extrinsics': extrinsics}, f)
+
+    for _ in range(2):
+        trajectory = Trajectory.from_sfm_data(filename, cache=cache)
+        np.testing.assert_array_equal(trajectory.timestamps, np.arange(4))
+        np.testing.assert_array_equal(trajectory.positions[:, 1], 2.0 * np.arange(4))
+    assert sorted(os.listdir(str(tmp_path))) == (['.gopt_cache', 'sfm_data.json'] if cache else ['sfm_data.json'])
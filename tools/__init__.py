@@ -0,0 +1,8 @@
+"""
+Python tools around GraphOptim: ARKit drift correction, conversions,
+geo-registration, evaluation and plotting.
+
+Run `python -m tools --help` for the command line interface. Importing this
+package has no side effects; the modules import their heavy dependencies
+only when they are used.
+"""
@@ -1,81 +1,78 @@
+import argparse
 import json
-from scipy.spatial.transform import Rotation as R
+import logging
 
-def make_timestamp_frameIdx_dict(Frames_filepath: str):
+import numpy as np
 
-    with open(Frames_filepath, 'r') as f:
-        lines = f.readlines()
-        frames_idx_dict = {}
-        for ind, line in enumerate(lines):
-            line = line.split(',')
-            print(line)
-            timestamp = line[0]
-            frames_idx_dict[ind] = timestamp
+from tools.trajectory import Trajectory
 
-    return frames_idx_dict 
+logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
 
-def make_AR_poses_dict(ARposes_filepath: str):
 
-    with open(ARposes_filepath, 'r') as f:
-        lines = f.readlines()
-        arposes = {}
-        for ind, line in enumerate(lines):
-            print(line)
-            timestamp, x, y, z, qw, qx, qy, qz = line.split(',')
-            arposes[timestamp] = [timestamp, x, y, z, qw, qx, qy, qz]
+def _read_numeric_rows(file_path, usecols):
+    # Keep the rows that start with a number, skipping headers.
+    with open(file_path, 'r') as f:
+        lines = [line for line in f if line[:1].isdigit()]
+    return np.loadtxt(lines, delimiter=',', usecols=usecols, ndmin=2)
 
-    return arposes
-    
 
-def add_poses_to_sfm_data(Frames_filepath, ARposes_filepath, sfm_data_file, output_file):
+def read_frame_timestamps(Frames_filepath: str):
+    """Timestamps of the video frames, indexed by frame number (one Frames.txt line per frame)."""
+    return _read_numeric_rows(Frames_filepath, (0,))[:, 0]
+
+
+def read_AR_poses(ARposes_filepath: str, cache=True):
+    """
+    Read an ARposes file sorted by timestamp.
+
+    Returns:
+    Trajectory: the poses in timestamp order.
+    """
+    return Trajectory.from_arposes(ARposes_filepath, cache).sorted()
+
+
+def add_poses_to_sfm_data(Frames_filepath, ARposes_filepath, sfm_data_file, output_file, tolerance=0.01,
+                          interpolate=False, cache=True):
     # match frames to arposes by timestamp
-    frames = make_timestamp_frameIdx_dict(Frames_filepath)
-    arposes = make_AR_poses_dict(ARposes_filepath)
-    
+    frame_timestamps = read_frame_timestamps(Frames_filepath)
+    trajectory = read_AR_poses(ARposes_filepath, cache)
+
     # load sfm data generated from openMVG
     with open(sfm_data_file, 'r') as f:
         sfm_data = json.load(f)
-            
-    for ind, view in enumerate(sfm_data["views"]):
-        key = view["key"]
-        frame_id = view["value"]["ptr_wrapper"]["data"]["filename"].split(".")[0][len("frame"):]
-        id_view = view["value"]["ptr_wrapper"]["data"]["id_view"]
-        id_intrinsic = view["value"]["ptr_wrapper"]["data"]["id_intrinsic"]
-        id_pose = view["value"]["ptr_wrapper"]["data"]["id_pose"]
-
-        # get ARposes data according to frame_id
-        timestamp, x, y, z, qw, qx, qy, qz = arposes[frames[int(frame_id)]]
-        
-        r = R.from_quat([float(qx), float(qy), float(qz), float(qw)])  
-        r = r.as_matrix()
-        r = r.tolist()
-        pose_dict = {
-            "key": key,
-            "value": {
-                    "rotation": r,
-                    "center": [float(x), float(y), float(z)]
-            }
-                
-        }
-
-        sfm_data["extrinsics"].append(pose_dict)
-
-
-    with open(output_file, '+a') as f:
-        f.write(json.dumps(sfm_data, indent=4))
-        f.write("\n")
+
+    views = sfm_data["views"]
+    frame_ids = np.array([int(view["value"]["ptr_wrapper"]["data"]["filename"].split(".")[0][len("frame"):])
+                          for view in views], dtype=np.int64)
+    if len(frame_ids) and frame_ids.max() >= len(frame_timestamps):
+        raise ValueError("view frame {} is not listed in {}".format(frame_ids.max(), Frames_filepath))
+
+    # get ARposes data according to frame_id
+    frame_poses, matched = trajectory.interpolate(frame_timestamps[frame_ids], tolerance, interpolate)
+    if not matched.all():
+        logging.warning("{} of {} views have no pose within {}s".format((~matched).sum(), len(views), tolerance))
+
+    # The ARKit camera-to-world rotations are stored as they are.
+    keys = [view["key"] for ind, view in enumerate(views) if matched[ind]]
+    frame_poses[matched].to_sfm_data(output_file, sfm_data, keys, world_to_camera=False)
+
+    logging.info("Added {} poses to: {}".format(int(matched.sum()), output_file))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Add ARKit poses to an openMVG sfm_data.json as extrinsics')
+    parser.add_argument('--frames', type=str, required=True, help='Path to Frames.txt')
+    parser.add_argument('--arposes', type=str, required=True, help='Path to ARposes.txt')
+    parser.add_argument('--sfm-data', type=str, required=True, help='Path to the openMVG sfm_data.json')
+    parser.add_argument('--output', type=str, required=True, help='Path to the output sfm_data.json')
+    parser.add_argument('--tolerance', type=float, default=0.01, help='Maximum frame/pose time difference in seconds')
+    parser.add_argument('--interpolate', action='store_true', help='Interpolate poses at the frame times (linear + SLERP)')
+    parser.add_argument('--no-cache', action='store_true', help='Neither read nor write the .gopt_cache next to the inputs')
+    args = parser.parse_args(argv)
+
+    add_poses_to_sfm_data(args.frames, args.arposes, args.sfm_data, args.output, args.tolerance, args.interpolate,
+                          not args.no_cache)
+
 
 if __name__ == '__main__':
-    # create a dictionary of timestamps and frame indices
-    Frames_filepath = '/DATA/ITG/ios_logger_noDepth/2023-11-27T09-37-23/Frames.txt'
-    ARposes_filepath = '/DATA/ITG/ios_logger_noDepth/2023-11-27T09-37-23/ARposes.txt'
-
-    # SfM data file to add poses to
-    sfm_data_file = '/DATA/ITG/ios_logger_noDepth/2023-11-27T09-37-23/openMVG_out/matches/sfm_data.json'
-    output_file = '/DATA/ITG/ios_logger_noDepth/2023-11-27T09-37-23/openMVG_out/matches/sfm_data_test.json'
-
-    add_poses_to_sfm_data(Frames_filepath, ARposes_filepath, sfm_data_file, output_file)
-    
-        
-        
-    
\ No newline at end of file
+    main()
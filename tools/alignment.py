@@ -0,0 +1,161 @@
+import collections
+
+import numpy as np
+
+# rotation (3, 3), translation (3,), scale, boolean inlier mask (N,) and
+# residuals (N,) such that dst ~ scale * rotation @ src + translation.
+Alignment = collections.namedtuple('Alignment', ['rotation', 'translation', 'scale', 'inliers', 'residuals'])
+
+
+def umeyama_batch(src, dst, weights=None, with_scale=True):
+    """
+    Weighted Umeyama alignment of many point sets at once.
+
+    Follows gopt::AlignPointCloudsUmeyamaWithWeights in
+    src/geometry/align_point_clouds.cc, batched over the leading axis.
+
+    Parameters:
+    src, dst (np.ndarray): (H, N, 3) corresponding points.
+    weights (np.ndarray): optional non-negative (H, N) point weights.
+    with_scale (bool): estimate a similarity instead of a rigid transformation.
+
+    Returns:
+    tuple of np.ndarray: rotations (H, 3, 3), translations (H, 3), scales (H,).
+    """
+    src = np.asarray(src, dtype=np.float64)
+    dst = np.asarray(dst, dtype=np.float64)
+    if weights is None:
+        weights = np.ones(src.shape[:2])
+    weights = np.asarray(weights, dtype=np.float64)
+    if (weights < 0).any():
+        raise ValueError("point weights must be greater or equal to zero")
+
+    weights_sum = weights.sum(axis=1)
+    if (weights_sum <= 0).any():
+        raise ValueError("the sum of weights must be greater than zero")
+
+    src_centroid = np.einsum('hn,hni->hi', weights, src) / weights_sum[:, None]
+    dst_centroid = np.einsum('hn,hni->hi', weights, dst) / weights_sum[:, None]
+    src_centered = src - src_centroid[:, None, :]
+    dst_centered = dst - dst_centroid[:, None, :]
+
+    # Cross correlation of dst with src, i.e. the transpose of the C++ one.
+    cross_correlation = np.einsum('hn,hni,hnj->hij', weights, dst_centered, src_centered) / weights_sum[:, None, None]
+    u, singular_values, vt = np.linalg.svd(cross_correlation)
+
+    # Special reflection case
+    d = np.sign(np.linalg.det(u) * np.linalg.det(vt))
+    d[d == 0] = 1.0
+    u[:, :, 2] *= d[:, None]
+    rotations = u @ vt
+
+    if with_scale:
+        sigma = np.einsum('hn,hni,hni->h', weights, src_centered, src_centered) / weights_sum
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scales = (singular_values[:, 0] + singular_values[:, 1] + d * singular_values[:, 2]) / sigma
+    else:
+        scales = np.ones(len(src))
+
+    translations = dst_centroid - scales[:, None] * np.einsum('hij,hj->hi', rotations, src_centroid)
+    return rotations, translations, scales
+
+
+def umeyama(src, dst, weights=None, with_scale=True):
+    """
+    Weighted Umeyama alignment of two (N, 3) point sets.
+
+    Returns:
+    tuple: rotation (3, 3), translation (3,) and scale such that
+    dst ~ scale * rotation @ src + translation.
+    """
+    src = np.asarray(src, dtype=np.float64)
+    weights = None if weights is None else np.asarray(weights)[None]
+    rotations, translations, scales = umeyama_batch(src[None], np.asarray(dst)[None], weights, with_scale)
+    return rotations[0], translations[0], scales[0]
+
+
+def alignment_residuals(src, dst, rotation, translation, scale=1.0):
+    """Distances between the transformed src points and the dst points."""
+    transformed = scale * np.asarray(src) @ np.asarray(rotation).T + translation
+    return np.linalg.norm(transformed - dst, axis=-1)
+
+
+def ransac_umeyama(src, dst, weights=None, with_scale=True, threshold=0.5, num_hypotheses=500, rng=None):
+    """
+    Robust alignment with a vectorized RANSAC over minimal 3-point samples.
+
+    All hypotheses are estimated in one umeyama_batch call and scored against
+    every correspondence with broadcasting (truncated squared loss). The best
+    hypothesis is refined with a weighted Umeyama fit on its inliers.
+
+    Returns:
+    Alignment: the refined transformation with its inliers and residuals.
+    """
+    src = np.asarray(src, dtype=np.float64)
+    dst = np.asarray(dst, dtype=np.float64)
+    weights = np.ones(len(src)) if weights is None else np.asarray(weights, dtype=np.float64)
+    if len(src) < 3:
+        raise ValueError("at least 3 correspondences are required, got {}".format(len(src)))
+
+    rng = np.random.default_rng(rng)
+    if len(src) == 3:
+        samples = np.arange(3)[None]
+    else:
+        samples = rng.random((num_hypotheses, len(src))).argpartition(3, axis=1)[:, :3]
+
+    rotations, translations, scales = umeyama_batch(src[samples], dst[samples], weights[samples], with_scale)
+
+    # (H, N) residuals of every correspondence under every hypothesis.
+    transformed = scales[:, None, None] * np.einsum('hij,nj->hni', rotations, src) + translations[:, None, :]
+    residuals = np.linalg.norm(transformed - dst[None], axis=-1)
+    costs = (np.minimum(residuals, threshold) ** 2 * weights).sum(axis=1)
+    costs[~np.isfinite(costs)] = np.inf
+    best = np.argmin(costs)
+
+    inliers = residuals[best] < threshold
+    if inliers.sum() < 3:
+        inliers = np.ones(len(src), dtype=bool)
+    rotation, translation, scale = umeyama(src[inliers], dst[inliers], weights[inliers], with_scale)
+
+    residuals = alignment_residuals(src, dst, rotation, translation, scale)
+    return Alignment(rotation, translation, scale, residuals < threshold, residuals)
+
+
+def irls_umeyama(src, dst, weights=None, with_scale=True, threshold=0.5, max_iterations=20, tolerance=1e-9):
+    """
+    Robust alignment by iteratively reweighted Umeyama fits with Huber weights.
+
+    Returns:
+    Alignment: the transformation with its inliers (residual below the
+    Huber threshold) and residuals.
+    """
+    src = np.asarray(src, dtype=np.float64)
+    dst = np.asarray(dst, dtype=np.float64)
+    weights = np.ones(len(src)) if weights is None else np.asarray(weights, dtype=np.float64)
+
+    rotation, translation, scale = umeyama(src, dst, weights, with_scale)
+    for _ in range(max_iterations):
+        residuals = alignment_residuals(src, dst, rotation, translation, scale)
+        huber = np.where(residuals <= threshold, 1.0, threshold / np.maximum(residuals, 1e-12))
+        previous = translation
+        rotation, translation, scale = umeyama(src, dst, weights * huber, with_scale)
+        if np.linalg.norm(translation - previous) < tolerance:
+            break
+
+    residuals = alignment_residuals(src, dst, rotation, translation, scale)
+    return Alignment(rotation, translation, scale, residuals < threshold, residuals)
+
+
+def residual_report(alignment):
+    """Summary statistics of an Alignment's residuals, suitable for logging or JSON."""
+    residuals = alignment.residuals
+    inlier_residuals = residuals[alignment.inliers]
+    return {
+        'num_points': int(len(residuals)),
+        'num_inliers': int(alignment.inliers.sum()),
+        'scale': float(alignment.scale),
+        'rmse': float(np.sqrt(np.mean(residuals ** 2))),
+        'inlier_rmse': float(np.sqrt(np.mean(inlier_residuals ** 2))) if len(inlier_residuals) else float('nan'),
+        'median': float(np.median(residuals)),
+        'max': float(residuals.max()),
+    }
@@ -0,0 +1,139 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from tools.cycle_consistency import add_cycle_arguments, cycle_options
+from tools.loop_closure import add_loop_closure_arguments, loop_closure_options
+from tools.partition import add_partition_arguments, partition_options
+from tools.pipeline import BACKENDS, adjust_session, adjusted_ply_filename
+
+ARPOSES_FILENAME = 'ARposes.txt'
+PAIRS_FILENAME = 'pairs.txt'
+
+
+def read_manifest(manifest_path):
+    """
+    List the (arposes, pairs) sessions of a manifest or a data directory.
+
+    A manifest is a CSV file with one `arposes,pairs` row per session;
+    relative paths are resolved against the manifest's folder. A directory is
+    searched recursively for folders holding ARposes.txt, with their
+    pairs.txt when there is one. Sessions without pairs get None, their loop
+    closures are detected automatically (see tools.loop_closure).
+    """
+    sessions = list()
+    if os.path.isdir(manifest_path):
+        for root, _, files in os.walk(manifest_path):
+            if ARPOSES_FILENAME in files:
+                pairs = os.path.join(root, PAIRS_FILENAME) if PAIRS_FILENAME in files else None
+                sessions.append((os.path.join(root, ARPOSES_FILENAME), pairs))
+        return sorted(sessions, key=lambda session: session[0])
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, 'r') as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith('#') or row[0] == 'arposes':
+                continue
+            arposes = os.path.join(base_dir, row[0].strip())
+            pairs = row[1].strip() if len(row) > 1 else ''
+            sessions.append((arposes, os.path.join(base_dir, pairs) if pairs else None))
+    return sessions
+
+
+def is_up_to_date(arposes_filename, pairs_filename):
+    """True when the adjusted PLY of the session is newer than its inputs."""
+    output_filename = adjusted_ply_filename(arposes_filename)
+    if not os.path.exists(output_filename):
+        return False
+    output_mtime = os.path.getmtime(output_filename)
+    return all(os.path.getmtime(path) <= output_mtime for path in (arposes_filename, pairs_filename) if path)
+
+
+def run_session(arposes_filename, pairs_filename, options):
+    """Adjust one session; failures are reported instead of raised."""
+    result = {'arposes': arposes_filename, 'pairs': pairs_filename}
+    start = time.perf_counter()
+    try:
+        if not options.get('force') and is_up_to_date(arposes_filename, pairs_filename):
+            result['status'] = 'skipped'
+        else:
+            result['timings'] = adjust_session(arposes_filename, pairs_filename, options['window'], options['stride'],
+                                               options['binary'], options['backend'], options.get('metrics'),
+                                               options.get('cache', True), options.get('loop_closure'),
+                                               options.get('partition'), options.get('cycle_filter'))
+            result['status'] = 'ok'
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = "{}: {}".format(type(e).__name__, e)
+        result['traceback'] = traceback.format_exc()
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def run_batch(sessions, workers=None, **options):
+    """
+    Adjust many sessions across a process pool.
+
+    Returns:
+    dict: the per-session results and the summed stage timings.
+    """
+    results = list()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_session, arposes, pairs, options) for arposes, pairs in sessions]
+        for future in as_completed(futures):
+            result = future.result()
+            logging.info("{} {} ({:.2f}s)".format(result['status'], result['arposes'], result['seconds']))
+            if result['status'] == 'failed':
+                logging.error(result['error'])
+            results.append(result)
+
+    results.sort(key=lambda result: result['arposes'])
+    stage_totals = dict()
+    for result in results:
+        for stage, seconds in result.get('timings', {}).items():
+            stage_totals[stage] = stage_totals.get(stage, 0.0) + seconds
+
+    counts = {status: sum(result['status'] == status for result in results) for status in ('ok', 'skipped', 'failed')}
+    return {'counts': counts, 'stage_totals': stage_totals, 'sessions': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Correct the drift of many ARKit sessions in parallel')
+    parser.add_argument('sessions', type=str,
+                        help='Manifest CSV of arposes,pairs rows (pairs may be empty) or a folder of sessions')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: CPU count)')
+    parser.add_argument('--report', type=str, default='batch_report.json', help='Path to the JSON summary report')
+    parser.add_argument('--force', action='store_true', help='Adjust sessions whose outputs are up to date')
+    parser.add_argument('--window', type=int, default=1, help='Number of successive poses each pose is connected to by odometry edges')
+    parser.add_argument('--stride', type=int, default=1, help='Frame step between poses connected by odometry edges')
+    parser.add_argument('--binary', action='store_true', help='Exchange the graph with the solver through the binary g2o format')
+    parser.add_argument('--backend', type=str, default='auto', choices=BACKENDS,
+                        help='Solver backend, see adjust_ARkit_poses.py (default: auto)')
+    parser.add_argument('--metrics', type=str, default=None, help='Append per-stage timings and peak memory as JSON lines to this file')
+    parser.add_argument('--no-cache', action='store_true', help='Neither read nor write the .gopt_cache next to the inputs')
+    add_loop_closure_arguments(parser)
+    add_partition_arguments(parser)
+    add_cycle_arguments(parser)
+    args = parser.parse_args(argv)
+
+    sessions = read_manifest(args.sessions)
+    logging.info("Adjusting {} sessions".format(len(sessions)))
+    summary = run_batch(sessions, args.workers, force=args.force, window=args.window, stride=args.stride,
+                        binary=args.binary, backend=args.backend, metrics=args.metrics, cache=not args.no_cache,
+                        loop_closure=loop_closure_options(args), partition=partition_options(args),
+                        cycle_filter=cycle_options(args))
+
+    with open(args.report, 'w') as f:
+        json.dump(summary, f, indent=2)
+    logging.info("ok: {ok}, skipped: {skipped}, failed: {failed}".format(**summary['counts']))
+    logging.info("Saved batch report to: {}".format(args.report))
+    return 1 if summary['counts']['failed'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
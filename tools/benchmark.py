@@ -0,0 +1,349 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from tools.instrumentation import read_peak_rss_kb
+from tools.solver import POSITION_ESTIMATOR, ROTATION_ESTIMATOR, parse_solver_log
+
+logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+
+DEFAULT_GRAPHS = 'data/synthetic/*.g2o'
+SOLVERS = {
+    'rotation_estimator': ROTATION_ESTIMATOR,
+    'position_estimator': POSITION_ESTIMATOR,
+}
+# Python solvers, run with the same --g2o_filename flag as the executables.
+PYTHON_SOLVERS = {
+    'numpy_pose_graph': [sys.executable, '-m', 'tools.pose_graph'],
+}
+# data/synthetic/<num_nodes>_<noise>.g2o
+SYNTHETIC_GRAPH_NAME = re.compile(r'^(\d+)_(\d+)$')
+
+
+def _stage_arkittog2o(g2o_filename, workdir):
+    from tools import utils
+    ids, vertex_poses = utils.read_g2o_vertices(g2o_filename)
+    # The data/synthetic graphs leave the vertex rotations at zero.
+    vertex_poses[np.linalg.norm(vertex_poses[:, 3:], axis=1) == 0, 6] = 1.0
+    arposes_filename = os.path.join(workdir, 'ARposes.txt')
+    utils.write_arposes(arposes_filename, ids, vertex_poses)
+    start = time.perf_counter()
+    utils.arkittog2o(arposes_filename, cache=False)
+    return time.perf_counter() - start
+
+
+def _stage_read_g2o(g2o_filename, workdir):
+    from tools import utils
+    start = time.perf_counter()
+    utils.read_g2o_vertices(g2o_filename)
+    utils.read_g2o_edges(g2o_filename)
+    return time.perf_counter() - start
+
+
+def _stage_write_g2o(g2o_filename, workdir, binary=False):
+    from tools import utils
+    ids, vertex_poses = utils.read_g2o_vertices(g2o_filename)
+    edges, information = utils.read_g2o_edges(g2o_filename)
+    output_filename = os.path.join(workdir, 'graph.g2ob' if binary else 'graph.g2o')
+    write = utils.write_g2o_binary if binary else utils.write_g2o
+    start = time.perf_counter()
+    write(output_filename, vertex_poses[np.argsort(ids)], edges, information)
+    return time.perf_counter() - start
+
+
+def _stage_read_g2o_binary(g2o_filename, workdir):
+    from tools import utils
+    ids, vertex_poses = utils.read_g2o_vertices(g2o_filename)
+    edges, information = utils.read_g2o_edges(g2o_filename)
+    binary_filename = os.path.join(workdir, 'graph.g2ob')
+    utils.write_g2o_binary(binary_filename, vertex_poses[np.argsort(ids)], edges, information)
+    start = time.perf_counter()
+    utils.read_g2o_vertices(binary_filename)
+    utils.read_g2o_edges(binary_filename)
+    return time.perf_counter() - start
+
+
+def _stage_g2o_to_arposes(g2o_filename, workdir):
+    from tools import utils
+    start = time.perf_counter()
+    utils.convert_g2o_to_arposes(g2o_filename, os.path.join(workdir, 'ARposes.adj.txt'))
+    return time.perf_counter() - start
+
+
+# Python stages of tools/utils.py; each returns the seconds spent in the
+# measured call, excluding its setup.
+STAGES = {
+    'arkittog2o': _stage_arkittog2o,
+    'read_g2o': _stage_read_g2o,
+    'write_g2o': _stage_write_g2o,
+    'write_g2o_binary': lambda g2o_filename, workdir: _stage_write_g2o(g2o_filename, workdir, binary=True),
+    'read_g2o_binary': _stage_read_g2o_binary,
+    'g2o_to_arposes': _stage_g2o_to_arposes,
+}
+
+
+def graph_info(g2o_filename):
+    """Name, node count and noise level of a data/synthetic graph, from its file name."""
+    name = os.path.splitext(os.path.basename(g2o_filename))[0]
+    match = SYNTHETIC_GRAPH_NAME.match(name)
+    if match:
+        return {'graph': name, 'num_nodes': int(match.group(1)), 'noise': int(match.group(2))}
+    return {'graph': name, 'num_nodes': None, 'noise': None}
+
+
+def run_measured(command, poll_interval=0.01):
+    """
+    Run a command and measure it.
+
+    The peak RSS is sampled from /proc while the child runs: the rusage of a
+    child also counts the memory of this process at fork time. Without /proc
+    the rusage value is used instead.
+
+    Returns:
+    tuple: wall time in seconds, peak RSS of the child in KiB (None when the
+    child exited before it could be sampled), return code and the combined
+    stdout/stderr text.
+    """
+    peak_rss_kb = None
+    with tempfile.TemporaryFile() as output:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=output, stderr=subprocess.STDOUT)
+        while True:
+            pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                break
+            sample = read_peak_rss_kb(process.pid)
+            if sample is not None:
+                peak_rss_kb = max(peak_rss_kb or 0, sample)
+            time.sleep(poll_interval)
+        seconds = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        output.seek(0)
+        text = output.read().decode('utf-8', errors='replace')
+
+    if not os.path.isdir('/proc/self'):
+        # ru_maxrss is in KiB on Linux and in bytes on macOS.
+        peak_rss_kb = rusage.ru_maxrss // 1024 if sys.platform == 'darwin' else rusage.ru_maxrss
+    return seconds, peak_rss_kb, process.returncode, text
+
+
+def solution_errors(g2o_filename, solution_filename):
+    """
+    Accuracy of a solution: the median rotation error in degrees and the RMS
+    translation error of the graph edges at the solved vertex poses, with
+    the SE(3) residuals of tools.pose_graph. The C++ solvers leave the
+    rotations, or the positions, they do not estimate at identity and zero.
+    """
+    from scipy.spatial.transform import Rotation as R
+    from tools import utils
+    edges, _ = utils.read_g2o_edges(g2o_filename)
+    ids, poses = utils.read_g2o_vertices(solution_filename)
+    rows = utils.edges_to_array(edges)
+    order = np.argsort(ids)
+    src = order[np.searchsorted(ids, rows[:, 0].astype(np.int64), sorter=order)]
+    dst = order[np.searchsorted(ids, rows[:, 1].astype(np.int64), sorter=order)]
+    rotations = R.from_quat(poses[:, 3:])
+    edge_rotations = R.from_quat(rows[:, 5:9])
+    rotation_errors = (edge_rotations * rotations[src] * rotations[dst].inv()).magnitude()
+    translation_errors = rotations[src].apply(poses[dst, :3] - poses[src, :3]) - rows[:, 2:5]
+    return {'rotation_error_deg': float(np.degrees(np.median(rotation_errors))),
+            'translation_error': float(np.sqrt(np.mean(np.einsum('ei,ei->e', translation_errors,
+                                                                 translation_errors))))}
+
+
+def run_solver(executable, g2o_filename):
+    """
+    One measured run of a solver executable, or command list, on a copy of
+    the graph, with the solution_errors of its <graph>.out output.
+    """
+    workdir = tempfile.mkdtemp(prefix='gopt_bench_')
+    try:
+        input_filename = os.path.join(workdir, os.path.basename(g2o_filename))
+        shutil.copyfile(g2o_filename, input_filename)
+        command = list(executable) if isinstance(executable, (list, tuple)) else [executable]
+        seconds, peak_rss_kb, returncode, text = run_measured(
+            command + ["--g2o_filename={}".format(input_filename)])
+        if returncode != 0:
+            raise RuntimeError("{} exited with {}:\n{}".format(executable, returncode, text[-2000:]))
+        run = {'seconds': seconds, 'peak_rss_kb': peak_rss_kb}
+        run.update(parse_solver_log(text))
+        run.update(solution_errors(input_filename, input_filename + '.out'))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return run
+
+
+def run_stage(stage, g2o_filename, repeat=1):
+    """
+    Measured runs of a Python stage in a fresh interpreter, so the peak RSS
+    is not inflated by earlier benchmarks.
+    """
+    _, _, returncode, text = run_measured(
+        [sys.executable, '-m', 'tools.benchmark', '--run-stage', stage, g2o_filename, '--repeat', str(repeat)])
+    if returncode != 0:
+        raise RuntimeError("stage {} exited with {}:\n{}".format(stage, returncode, text[-2000:]))
+    # The child prints its measurements as JSON on its last line.
+    measured = json.loads(text.strip().splitlines()[-1])
+    return [{'seconds': seconds, 'peak_rss_kb': measured['peak_rss_kb']} for seconds in measured['seconds']]
+
+
+def summarize(runs):
+    """Aggregate the repetitions of one benchmark."""
+    seconds = np.array([run['seconds'] for run in runs])
+    summary = {
+        'repetitions': len(runs),
+        'seconds_median': float(np.median(seconds)),
+        'seconds_min': float(seconds.min()),
+        'seconds_max': float(seconds.max()),
+        'peak_rss_kb': max((run['peak_rss_kb'] for run in runs if run['peak_rss_kb'] is not None), default=None),
+        'runs': runs,
+    }
+    if 'iterations' in runs[0]:
+        summary['iterations'] = int(np.median([run['iterations'] for run in runs]))
+    for metric in ('rotation_error_deg', 'translation_error'):
+        if metric in runs[0]:
+            summary[metric] = float(np.median([run[metric] for run in runs]))
+    return summary
+
+
+def run_benchmarks(graphs, benchmarks, repeat=3, bin_dir='bin'):
+    """
+    Run every benchmark on every graph.
+
+    Returns:
+    list of dict: one result per (benchmark, graph) with its summary, or the
+    error when it failed.
+    """
+    results = list()
+    for g2o_filename in graphs:
+        for benchmark in benchmarks:
+            result = {'benchmark': benchmark}
+            result.update(graph_info(g2o_filename))
+            try:
+                if benchmark in SOLVERS:
+                    executable = os.path.join(bin_dir, os.path.basename(SOLVERS[benchmark]))
+                    runs = [run_solver(executable, g2o_filename) for _ in range(repeat)]
+                elif benchmark in PYTHON_SOLVERS:
+                    runs = [run_solver(PYTHON_SOLVERS[benchmark], g2o_filename) for _ in range(repeat)]
+                else:
+                    runs = run_stage(benchmark, g2o_filename, repeat)
+                result.update(summarize(runs))
+                logging.info("{} {}: {:.4f}s median, peak RSS {} KiB".format(
+                    benchmark, result['graph'], result['seconds_median'], result['peak_rss_kb']))
+            except Exception as e:
+                result['error'] = "{}: {}".format(type(e).__name__, e)
+                logging.error("{} {}: {}".format(benchmark, result['graph'], result['error']))
+            results.append(result)
+    return results
+
+
+def compare_to_baseline(results, baseline, threshold=0.1, min_seconds=0.01):
+    """
+    Flag the benchmarks slower, or using more memory, than the baseline by
+    more than the relative threshold. Timings below min_seconds in the
+    baseline are too noisy to compare and are ignored.
+
+    Returns:
+    list of dict: the regressions.
+    """
+    baseline_results = {(result['benchmark'], result['graph']): result
+                        for result in baseline['results'] if 'error' not in result}
+    regressions = list()
+    for result in results:
+        reference = baseline_results.get((result['benchmark'], result['graph']))
+        if reference is None or 'error' in result:
+            continue
+        for metric in ('seconds_median', 'peak_rss_kb'):
+            if not reference.get(metric) or result.get(metric) is None:
+                continue
+            if metric == 'seconds_median' and reference[metric] < min_seconds:
+                continue
+            if result[metric] > reference[metric] * (1.0 + threshold):
+                regressions.append({
+                    'benchmark': result['benchmark'],
+                    'graph': result['graph'],
+                    'metric': metric,
+                    'baseline': reference[metric],
+                    'current': result[metric],
+                    'ratio': result[metric] / reference[metric],
+                })
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the solvers and the Python stages on g2o graphs')
+    parser.add_argument('--graphs', type=str, nargs='+', default=[DEFAULT_GRAPHS],
+                        help='g2o files or glob patterns (default: {})'.format(DEFAULT_GRAPHS))
+    parser.add_argument('--benchmarks', type=str, nargs='+', default=None,
+                        choices=sorted(SOLVERS) + sorted(PYTHON_SOLVERS) + sorted(STAGES),
+                        help='Benchmarks to run (default: all)')
+    parser.add_argument('--max-nodes', type=int, default=None, help='Skip synthetic graphs with more nodes')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of repetitions of each benchmark')
+    parser.add_argument('--bin-dir', type=str, default='bin', help='Folder of the solver executables')
+    parser.add_argument('--output', type=str, default='benchmark.json', help='Path to the JSON results')
+    parser.add_argument('--baseline', type=str, default=None, help='JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Relative slowdown flagged as a regression')
+    parser.add_argument('--min-seconds', type=float, default=0.01, help='Ignore timing regressions of faster baselines')
+    parser.add_argument('--run-stage', type=str, nargs=2, metavar=('STAGE', 'G2O'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_stage:
+        stage, g2o_filename = args.run_stage
+        logging.disable(logging.INFO)
+        with tempfile.TemporaryDirectory(prefix='gopt_bench_') as workdir:
+            seconds = [STAGES[stage](g2o_filename, workdir) for _ in range(args.repeat)]
+        print(json.dumps({'seconds': seconds, 'peak_rss_kb': read_peak_rss_kb()}))
+        return 0
+
+    graphs = sorted({path for pattern in args.graphs for path in glob.glob(pattern)},
+                    key=lambda path: (graph_info(path)['num_nodes'] or 0, path))
+    if args.max_nodes is not None:
+        graphs = [path for path in graphs if (graph_info(path)['num_nodes'] or 0) <= args.max_nodes]
+
+    benchmarks = args.benchmarks
+    if benchmarks is None:
+        benchmarks = list(STAGES) + list(PYTHON_SOLVERS)
+        for solver, executable in SOLVERS.items():
+            if os.path.exists(os.path.join(args.bin_dir, os.path.basename(executable))):
+                benchmarks.append(solver)
+            else:
+                logging.warning("Skipping {}, not found in {}".format(solver, args.bin_dir))
+
+    logging.info("Running {} benchmarks on {} graphs".format(len(benchmarks), len(graphs)))
+    report = {
+        'platform': {'python': platform.python_version(), 'machine': platform.machine(),
+                     'system': platform.platform(), 'cpu_count': os.cpu_count()},
+        'repeat': args.repeat,
+        'results': run_benchmarks(graphs, benchmarks, args.repeat, args.bin_dir),
+    }
+
+    status = 1 if any('error' in result for result in report['results']) else 0
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        report['regressions'] = compare_to_baseline(report['results'], baseline, args.threshold, args.min_seconds)
+        for regression in report['regressions']:
+            logging.warning("Regression in {benchmark} {graph}: {metric} {baseline} -> {current} "
+                            "({ratio:.2f}x)".format(**regression))
+        if report['regressions']:
+            status = 1
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logging.info("Saved benchmark results to: {}".format(args.output))
+    return status
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
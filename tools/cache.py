@@ -0,0 +1,103 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+
+# Bumped whenever the layout or the content of the cached columns changes.
+CACHE_VERSION = 1
+CACHE_DIRNAME = '.gopt_cache'
+# Set GOPT_CACHE=0 to disable the cache everywhere.
+CACHE_ENABLED = os.environ.get('GOPT_CACHE', '1') != '0'
+
+
+def content_digest(filename, chunk_size=1 << 20):
+    """blake2b digest of the content of a file."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(*parts):
+    """Digest of the cache version and the given JSON-serializable key parts."""
+    return hashlib.blake2b(json.dumps([CACHE_VERSION] + list(parts)).encode('utf-8'),
+                           digest_size=20).hexdigest()
+
+
+def save_columns(directory, columns):
+    """
+    Store named arrays as one .npy file each. The entry is written to a
+    temporary folder and renamed, so it appears complete or not at all.
+    """
+    tmp_directory = "{}.tmp-{}".format(directory, os.getpid())
+    os.makedirs(tmp_directory, exist_ok=True)
+    for name, column in columns.items():
+        np.save(os.path.join(tmp_directory, name + '.npy'), np.ascontiguousarray(column))
+    try:
+        os.rename(tmp_directory, directory)
+    except OSError:
+        # Another process stored the same entry first.
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+
+
+def load_columns(directory, mmap=True):
+    """Load the arrays stored by save_columns, as read-only memory maps when mmap=True."""
+    return {os.path.splitext(name)[0]: np.load(os.path.join(directory, name), mmap_mode='r' if mmap else None)
+            for name in sorted(os.listdir(directory)) if name.endswith('.npy')}
+
+
+def _entry(anchor_filename, kind, key):
+    # Entries live in a .gopt_cache folder next to the file they derive from.
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(anchor_filename)), CACHE_DIRNAME)
+    prefix = "{}.{}.".format(os.path.basename(anchor_filename), kind)
+    return cache_dir, prefix, os.path.join(cache_dir, prefix + key)
+
+
+def lookup_columns(anchor_filename, kind, key, mmap=True):
+    """
+    Columns of a cache entry, or None when it is not cached.
+
+    Parameters:
+    anchor_filename (str): File the cached data is derived from.
+    kind (str): Kind of data, e.g. 'arposes' or 'session'.
+    key (str): Content key of the entry, see content_digest and cache_key.
+    """
+    _, _, directory = _entry(anchor_filename, kind, key)
+    if not CACHE_ENABLED or not os.path.isdir(directory):
+        return None
+    logging.info("Loading cached {} of {}".format(kind, anchor_filename))
+    return load_columns(directory, mmap)
+
+
+def store_columns(anchor_filename, kind, key, columns):
+    """Store a cache entry, replacing the older entries of the same file and kind."""
+    if not CACHE_ENABLED:
+        return
+    cache_dir, prefix, directory = _entry(anchor_filename, kind, key)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        for name in os.listdir(cache_dir):
+            if name.startswith(prefix) and '.tmp-' not in name and name != os.path.basename(directory):
+                shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+        if not os.path.isdir(directory):
+            save_columns(directory, columns)
+    except OSError as e:
+        logging.warning("Could not cache {} of {}: {}".format(kind, anchor_filename, e))
+
+
+def cached_columns(anchor_filename, kind, key, build, mmap=True):
+    """
+    Columns of a cache entry, built with build() and stored on a miss.
+
+    Returns:
+    dict of np.ndarray: the cached columns.
+    """
+    columns = lookup_columns(anchor_filename, kind, key, mmap)
+    if columns is None:
+        columns = build()
+        store_columns(anchor_filename, kind, key, columns)
+    return columns
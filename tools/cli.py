@@ -0,0 +1,59 @@
+import argparse
+import importlib
+import sys
+
+# command -> (module with a main(argv) function, help). Modules are imported
+# only when their command runs, so startup only pays for what is used.
+COMMANDS = {
+    'adjust': ('tools.pipeline', 'Correct the drift of an ARKit session'),
+    'batch': ('tools.batch', 'Correct the drift of many ARKit sessions in parallel'),
+    'arposes2ply': ('tools.ply', 'Export the positions of an ARposes file to PLY'),
+    'arposes2g2o': ('tools.utils', 'Convert ARKit poses and pairs to a g2o graph'),
+    'stream': ('tools.incremental', 'Correct the drift of an ARKit session incrementally, while it is recorded'),
+    'optimize': ('tools.pose_graph', 'Optimize a g2o pose graph with the NumPy/SciPy backend'),
+    'partition': ('tools.partition', 'Optimize a large g2o pose graph by overlapping clusters in parallel'),
+    'pairs': ('tools.loop_closure', 'Generate pairs.txt from the loop closures of a trajectory'),
+    'validate': ('tools.cycle_consistency', 'Reject or down-weight the loop closures of a g2o graph inconsistent on cycles'),
+    'add-poses': ('tools.add_poses', 'Add ARKit poses to an openMVG sfm_data.json'),
+    'frames': ('tools.video2frames', 'Extract the frames of a video'),
+    'geo': ('tools.convertUTM', 'Geo-register ARKit anchors and meshes to UTM'),
+    'evaluate': ('tools.evaluate', 'Evaluate a trajectory against a reference (ATE/RPE)'),
+    'plot': ('tools.plotting', 'Render ARKit trajectories to PNG'),
+    'plot-ar': ('tools.plotAR', 'Plot ARKit poses and export them to PLY'),
+    'plot-anchors': ('tools.plotAnchors', 'Plot ARKit anchors and export them to PLY'),
+    'plot-poses': ('tools.plot_poses', 'Overlay reconstructed and ground-truth camera centers'),
+    'benchmark': ('tools.benchmark', 'Benchmark the solvers and the Python stages'),
+    'worker': ('tools.worker', 'Keep the tools loaded and run commands from stdin or a socket'),
+}
+
+
+def run_command(command, argv):
+    """
+    Run a command with its arguments in this process.
+
+    Returns:
+    int: the exit code of the command.
+    """
+    if command not in COMMANDS:
+        raise ValueError("unknown command {}".format(command))
+    module = importlib.import_module(COMMANDS[command][0])
+
+    # argparse names the program after sys.argv[0].
+    prog = sys.argv[0]
+    sys.argv[0] = 'python -m tools {}'.format(command)
+    try:
+        return module.main(argv) or 0
+    finally:
+        sys.argv[0] = prog
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m tools', description='GraphOptim Python tools',
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog='commands:\n' + '\n'.join('  {:<14}{}'.format(command, help)
+                                                                      for command, (_, help) in COMMANDS.items()))
+    parser.add_argument('command', choices=COMMANDS, metavar='command', help='Command to run, see below')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='Arguments of the command (see <command> --help)')
+    args = parser.parse_args(argv)
+
+    return run_command(args.command, args.args)
@@ -1,168 +1,201 @@
-import csv
-from pyproj import Proj, transform
+import functools
+import logging
+import os
+
+from pyproj import Transformer
 import numpy as np
-from scipy.spatial.transform import Rotation as R
 import argparse
 
-def convert_utm_to_lat_lon(utm_coords):
+from tools.alignment import umeyama, ransac_umeyama, residual_report
+
+logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+
+
+@functools.lru_cache(maxsize=None)
+def utm_to_lat_lon_transformer(zone, south=False):
+    """Cached pyproj transformer from a WGS84 UTM zone to WGS84 longitude/latitude."""
+    utm_epsg = (32700 if south else 32600) + zone
+    return Transformer.from_crs("EPSG:{}".format(utm_epsg), "EPSG:4326", always_xy=True)
+
+
+def convert_utm_to_lat_lon(utm_coords, zone=36, south=False):
     """
     Convert UTM coordinates to latitude and longitude.
 
     Parameters:
-    utm_coords (list of tuples): List of tuples containing UTM coordinates in the format (Easting, Northing, Elevation).
+    utm_coords (np.ndarray): (N, 2) or (N, 3) UTM coordinates (Easting, Northing[, Elevation]).
+    zone (int): UTM zone number.
+    south (bool): True for a southern hemisphere zone.
 
     Returns:
-    list of tuples: List of tuples containing latitude and longitude.
+    np.ndarray: (N, 2) array of latitude and longitude.
     """
-    # Define the UTM zone 36N coordinate system
-    utm_proj = Proj(proj='utm', zone=36, ellps='WGS84', south=False)
+    utm_coords = np.asarray(utm_coords, dtype=np.float64).reshape(len(utm_coords), -1)
+    transformer = utm_to_lat_lon_transformer(zone, south)
+    lon, lat = transformer.transform(utm_coords[:, 0], utm_coords[:, 1])
+    return np.column_stack([lat, lon])
 
-    # Define the WGS84 latitude/longitude coordinate system
-    wgs84_proj = Proj(proj='latlong', datum='WGS84')
-
-    # Convert UTM coordinates to WGS84 latitude/longitude
-    lat_lon_coords = [transform(utm_proj, wgs84_proj, easting, northing) for easting, northing, _ in utm_coords]
-
-    return lat_lon_coords
 
+def _read_numeric_rows(file_path, usecols):
+    # Keep the rows that start with a number, skipping headers and comments.
+    with open(file_path, 'r') as file:
+        lines = [line for line in file if line[:1].isdigit() or line[:1] in '-+.']
+    return np.loadtxt(lines, delimiter=',', usecols=usecols, ndmin=2)
 
-def find_transformation(src_points, dst_points):
-    # Calculate centroids
-    src_centroid = np.mean(src_points, axis=0)
-    dst_centroid = np.mean(dst_points, axis=0)
 
-    # Center the points around the centroid
-    src_centered = src_points - src_centroid
-    dst_centered = dst_points - dst_centroid
+def read_waypoints(file_path):
+    """
+    Read surveyed waypoints from a CSV file of anchor_index,easting,northing,elevation rows.
 
-    # Compute the covariance matrix
-    H = np.dot(src_centered.T, dst_centered)
+    Returns:
+    tuple of np.ndarray: (N,) anchor indices and (N, 3) UTM coordinates.
+    """
+    rows = _read_numeric_rows(file_path, (0, 1, 2, 3))
+    return rows[:, 0].astype(np.int64), rows[:, 1:]
 
-    # Singular Value Decomposition
-    U, _, Vt = np.linalg.svd(H)
 
-    # Calculate rotation
-    rotation = np.dot(Vt.T, U.T)
+def read_anchors(file_path):
+    """
+    Read the anchor positions of an ARKit Anchors.txt file.
 
-    # Special reflection case
-    if np.linalg.det(rotation) < 0:
-       Vt[2, :] *= -1
-       rotation = np.dot(Vt.T, U.T)
+    Returns:
+    np.ndarray: (N, 3) anchor positions in the ARKit frame.
+    """
+    return _read_numeric_rows(file_path, (2, 3, 4))
 
-    # Calculate translation
-    translation = dst_centroid - np.dot(rotation, src_centroid)
 
+def find_transformation(src_points, dst_points, weights=None):
+    """Rigid (Kabsch) transformation mapping src_points onto dst_points, see tools.alignment.umeyama."""
+    rotation, translation, _ = umeyama(src_points, dst_points, weights, with_scale=False)
     return rotation, translation
 
-def apply_transformation_to_obj(file_path, rotation, translation, output_path):
-    transformed_lines = []
-
-    with open(file_path, 'r') as file:
-        for line in file:
-            if line.startswith('v '):  # Vertex line
-                vertex = np.array(list(map(float, line.strip().split()[1:])))
-                # Apply rotation and translation
-                transformed_vertex = np.dot(rotation, vertex) + translation
-                transformed_line = 'v ' + ' '.join(map(str, transformed_vertex)) + '\n'
-                transformed_lines.append(transformed_line)
-            elif line.startswith('f '):  # Face line
-                # Keep face line unchanged
-                transformed_lines.append(line)
-            else:
-                # You can add handling for other line types (like texture coordinates or normals) if needed
-                pass
-
-    with open(output_path, 'w') as file:
-        file.writelines(transformed_lines)
+def _transform_obj_block(output, tag, lines, rotation, translation, float_format):
+    # Apply the transformation to a block of consecutive v/vn lines with the
+    # same layout; extra columns (w, vertex colors) are written back unchanged.
+    values = np.loadtxt(lines, usecols=range(1, len(lines[0].split())), ndmin=2)
+    values[:, :3] = values[:, :3] @ rotation.T
+    if tag == 'v':
+        values[:, :3] += translation
+    else:
+        # Normals only turn; undo a uniform scale folded into the rotation.
+        values[:, :3] /= np.cbrt(np.linalg.det(rotation))
+    line_format = tag + (' ' + float_format) * values.shape[1] + '\n'
+    output.write((line_format * len(values)) % tuple(values.ravel().tolist()))
+
+
+def apply_transformation_to_obj(file_path, rotation, translation, output_path, chunk_size=100000,
+                                float_format='%.12g'):
+    """
+    Stream an OBJ file through a rigid or similarity transformation with
+    bounded memory.
 
-def apply_transformation_to_anchors(file_path, rotation, translation, output_path):
-    transformed_lines = []
+    Vertices (v) are transformed, normals (vn) are only rotated; all other
+    lines (vt, f, groups, materials, ...) are passed through unchanged.
+    Vertex blocks of up to chunk_size lines are transformed as one matrix
+    product. A uniform scale may be folded into the rotation.
+    """
+    rotation = np.asarray(rotation, dtype=np.float64)
+    translation = np.asarray(translation, dtype=np.float64)
 
-    with open(file_path, 'r') as file:
+    with open(file_path, 'r') as file, open(output_path, 'w', buffering=1 << 20) as output:
+        block = list()
+        block_key = None
         for line in file:
-            if not line[0].isdigit():
-                continue
-
-            vertex = np.array(list(map(float, line.strip().split(",")[2:5])))
-            # Apply rotation and translation
-            transformed_vertex = np.dot(rotation, vertex) + translation
-            transformed_lines.append(transformed_vertex)
-
-    with open(output_path, 'w') as file:
-        file.write("X,Y,Z,\n")
-        for line in transformed_lines:
-            for item in line:
-                file.write(str(item))
-                file.write(",")
-            file.write("\n")
-
-
-# UTM coordinates (Easting, Northing, Elevation) for each waypoint
-utm = [
-    (658908.576, 3508150.229, 90.612),  # Waypoint 1
-    (658900.122, 3508144.225, 90.416), # Waypoint 2
-    (658893.982, 3508154.062, 90.518) # Waypoint 3
-]
-
-
-# these xyz values are only for scan AaronScan_3Points_2023-12-05T11-09-58/Anchors.txt 
-# for a different scan, you need to read in the anchors
-xyz = [
-    (0,0.276004,0.592119,-0.508760), # Anchor 1
-    (1,0.706804,0.510343,9.811332), # Anchor 2
-    (2,-11.117970,0.537205,9.370130) # Anchor 3
-]
-
-src_origin = xyz[0]
-dst_origin = utm[0]
-
-# Convert UTM and XYZ lists to numpy arrays for the transformation function
-# Assuming the first element in each xyz tuple is an identifier and not a coordinate
-src_points = np.array([np.subtract(point[1:], src_origin[1:]) for point in xyz])
-dst_points = np.array([np.subtract(point, dst_origin) for point in utm])
-
-
-# Convert and print the latitude/longitude coordinates
-lat_lon_coordinates = convert_utm_to_lat_lon(utm)
-for idx, (lat, lon) in enumerate(lat_lon_coordinates, start=1):
-    print(f"Waypoint {idx}: Latitude {lat}, Longitude {lon}")
-
-rotation, translation = find_transformation(src_points, dst_points)
-
-# input_obj = 'AaronScan_3Points_2023-12-05T11-09-58/combined_mesh.obj'
-# output_obj = 'AaronScan_3Points_2023-12-05T11-09-58/world oriented_mesh.obj' 
-# apply_transformation_to_obj(input_obj, rotation, translation, output_obj)
-
-input_obj = '/DATA/AaronScan_3Points_2023-12-05T11-09-58/Anchors.txt'
-output_obj = '/DATA/AaronScan_3Points_2023-12-05T11-09-58/Anchors_world_oriented.txt' 
-apply_transformation_to_anchors(input_obj, rotation, translation, output_obj)
+            if line.startswith('v '):
+                key = ('v', len(line.split()))
+            elif line.startswith('vn '):
+                key = ('vn', len(line.split()))
+            else:
+                key = None
 
-# def main(input_obj, output_obj, utm_coords, xyz_coords):
-#     # Convert UTM and XYZ lists to numpy arrays for the transformation function
-#     src_points = np.array([point[1:] for point in xyz_coords])
-#     dst_points = np.array(utm_coords)
+            if block and (key != block_key or len(block) >= chunk_size):
+                _transform_obj_block(output, block_key[0], block, rotation, translation, float_format)
+                block = list()
 
-#     # Convert and print the latitude/longitude coordinates
-#     lat_lon_coordinates = convert_utm_to_lat_lon(utm_coords)
-#     for idx, (lat, lon) in enumerate(lat_lon_coordinates, start=1):
-#         print(f"Waypoint {idx}: Latitude {lat}, Longitude {lon}")
+            if key is None:
+                output.write(line)
+            else:
+                block.append(line)
+                block_key = key
 
-#     rotation, translation = find_transformation(src_points, dst_points)
-#     apply_transformation_to_obj(input_obj, rotation, translation, output_obj)
+        if block:
+            _transform_obj_block(output, block_key[0], block, rotation, translation, float_format)
 
-# if __name__ == "__main__":
-#     parser = argparse.ArgumentParser(description='Apply geometric transformation to OBJ file.')
-#     parser.add_argument('input_obj', type=str, help='Input OBJ file path')
-#     parser.add_argument('output_obj', type=str, help='Output OBJ file path')
-#     parser.add_argument('--utm', nargs='+', type=float, help='UTM coordinates (Easting, Northing, Elevation) for each waypoint', required=True)
-#     parser.add_argument('--xyz', nargs='+', type=float, help='XYZ coordinates for each waypoint', required=True)
+def apply_transformation_to_anchors(file_path, rotation, translation, output_path):
+    anchors = read_anchors(file_path)
+    transformed = anchors @ np.asarray(rotation).T + translation
+    np.savetxt(output_path, transformed, fmt='%.12g', delimiter=',', header='X,Y,Z', comments='')
+    return transformed
 
-#     args = parser.parse_args()
 
-#     # Processing UTM and XYZ coordinates
-#     utm_coords = list(zip(args.utm[::3], args.utm[1::3], args.utm[2::3]))
-#     xyz_coords = list(zip(args.xyz[::4], args.xyz[1::4], args.xyz[2::4], args.xyz[3::4]))
+def register_anchors(anchors, anchor_indices, waypoints, with_scale=False, threshold=0.5):
+    """
+    Find the transformation from the ARKit frame to UTM.
 
-#     main(args.input_obj, args.output_obj, utm_coords, xyz_coords)
+    With more than three waypoints the registration is robust to bad
+    waypoints (RANSAC, see tools.alignment.ransac_umeyama); with three it is
+    a plain fit.
 
+    Parameters:
+    anchors (np.ndarray): (N, 3) anchor positions in the ARKit frame.
+    anchor_indices (np.ndarray): (M,) anchors that were surveyed.
+    waypoints (np.ndarray): (M, 3) UTM coordinates of those anchors.
+    with_scale (bool): also estimate a scale factor (Umeyama).
+    threshold (float): inlier distance in meters.
 
+    Returns:
+    Alignment: rotation (3, 3), translation (3,) and scale such that
+    scale * rotation @ anchor + translation is in UTM, with the waypoint
+    inliers and residuals.
+    """
+    anchor_indices = np.asarray(anchor_indices, dtype=np.int64)
+    if anchor_indices.min() < 0 or anchor_indices.max() >= len(anchors):
+        raise ValueError("waypoint anchor indices must be in [0, {})".format(len(anchors)))
+
+    # Solve around the first correspondence to keep the UTM magnitudes out of the SVD.
+    src_points = anchors[anchor_indices]
+    dst_points = np.asarray(waypoints, dtype=np.float64)
+    src_origin = src_points[0]
+    dst_origin = dst_points[0]
+    alignment = ransac_umeyama(src_points - src_origin, dst_points - dst_origin, with_scale=with_scale,
+                               threshold=threshold, rng=0)
+    translation = alignment.translation + dst_origin - alignment.scale * alignment.rotation @ src_origin
+    return alignment._replace(translation=translation)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Geo-register ARKit anchors and meshes to UTM from surveyed waypoints')
+    parser.add_argument('--waypoints', type=str, required=True, help='CSV of anchor_index,easting,northing,elevation rows')
+    parser.add_argument('--anchors', type=str, required=True, help='Path to the ARKit Anchors.txt file')
+    parser.add_argument('--output', type=str, help='Path to the geo-registered anchors (default: <anchors>_world_oriented.txt)')
+    parser.add_argument('--obj', type=str, help='Optional OBJ mesh to transform with the same registration')
+    parser.add_argument('--obj-output', type=str, help='Path to the transformed OBJ (default: <obj>_world_oriented.obj)')
+    parser.add_argument('--zone', type=int, default=36, help='UTM zone of the waypoints')
+    parser.add_argument('--south', action='store_true', help='The UTM zone is on the southern hemisphere')
+    parser.add_argument('--scale', action='store_true', help='Also estimate a scale factor between ARKit and UTM')
+    parser.add_argument('--threshold', type=float, default=0.5, help='Waypoint inlier distance in meters')
+    args = parser.parse_args(argv)
+
+    anchor_indices, waypoints = read_waypoints(args.waypoints)
+    anchors = read_anchors(args.anchors)
+
+    for idx, (lat, lon) in enumerate(convert_utm_to_lat_lon(waypoints, args.zone, args.south), start=1):
+        logging.info("Waypoint {}: Latitude {}, Longitude {}".format(idx, lat, lon))
+
+    alignment = register_anchors(anchors, anchor_indices, waypoints, args.scale, args.threshold)
+    logging.info("Registration residuals: {}".format(residual_report(alignment)))
+    rotation = alignment.scale * alignment.rotation
+    translation = alignment.translation
+
+    output_path = args.output or os.path.splitext(args.anchors)[0] + '_world_oriented.txt'
+    apply_transformation_to_anchors(args.anchors, rotation, translation, output_path)
+    logging.info("Saved {} geo-registered anchors to: {}".format(len(anchors), output_path))
+
+    if args.obj:
+        obj_output_path = args.obj_output or os.path.splitext(args.obj)[0] + '_world_oriented.obj'
+        apply_transformation_to_obj(args.obj, rotation, translation, obj_output_path)
+        logging.info("Saved geo-registered mesh to: {}".format(obj_output_path))
+
+
+if __name__ == "__main__":
+    main()
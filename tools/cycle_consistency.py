@@ -0,0 +1,349 @@
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from tools.instrumentation import emit
+from tools.utils import (DEFAULT_INFORMATION, edges_to_array, information_upper_triangle, read_g2o_edges,
+                         read_g2o_vertices, write_g2o)
+
+logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+
+MODES = ['reject', 'weight']
+
+
+def _ranges(starts, stops):
+    # (owner, index) pairs enumerating range(starts[k], stops[k]) for every k.
+    counts = stops - starts
+    owners = np.repeat(np.arange(len(starts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owners, np.repeat(starts, counts) + offsets
+
+
+def _contains(sorted_values, values):
+    # np.isin for an already sorted array
+    positions = np.minimum(np.searchsorted(sorted_values, values), len(sorted_values) - 1)
+    return sorted_values[positions] == values if len(sorted_values) else np.zeros(len(values), dtype=bool)
+
+
+def odometry_levels(num_nodes, src, dst, max_hops):
+    """
+    Position of every node along the odometry graph, as a scalar key.
+
+    The key is the breadth-first depth of the node from the first node of its
+    connected component, offset per component so that nodes of different
+    components are always more than max_hops apart.
+
+    Returns:
+    tuple: (N,) keys, (N,) component labels and the roots of the components.
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components, shortest_path
+
+    adjacency = coo_matrix((np.ones(len(src)), (src, dst)), shape=(num_nodes, num_nodes))
+    num_components, labels = connected_components(adjacency, directed=False)
+    _, roots = np.unique(labels, return_index=True)
+
+    # one search from a virtual node linked to every root
+    virtual = coo_matrix((np.ones(len(src) + num_components),
+                          (np.concatenate([src, np.full(num_components, num_nodes)]), np.concatenate([dst, roots]))),
+                         shape=(num_nodes + 1, num_nodes + 1))
+    depths = shortest_path(virtual, directed=False, unweighted=True, indices=num_nodes)[:num_nodes] - 1
+    spacing = depths.max() + 2 * max_hops + 2
+    return labels * spacing + depths, labels, roots
+
+
+def iter_cycles(edge_index, a_keys, b_keys, max_hops, triangles=True, max_successors=64, chunk_size=1 << 20):
+    """
+    Short cycles through the candidate edges, closed by odometry.
+
+    Candidates are given as half-edges (each edge in both directions) going
+    from a node at a_keys to a node at b_keys. A half-edge h may be followed
+    by g when the end of h is within max_hops of odometry from the start of
+    g. The successors are found with one sorted range search and only the
+    max_successors closest are kept, which bounds the number of cycles where
+    loop closures are dense. The cycles of one, two and three half-edges are
+    joined from them in bulk, the triangles by chunks of about chunk_size.
+    Every cycle is listed once, starting with the forward half of its lowest
+    edge.
+
+    Parameters:
+    edge_index (np.ndarray): (H,) edge of every half-edge.
+    a_keys, b_keys (np.ndarray): (H,) odometry_levels keys of the start and end nodes.
+
+    Yields:
+    np.ndarray: (M, L) cycles of L half-edges.
+    """
+    num_half_edges = len(edge_index)
+    order = np.argsort(a_keys, kind='stable')
+    sorted_keys = a_keys[order]
+    starts = np.searchsorted(sorted_keys, b_keys - max_hops, 'left')
+    stops = np.searchsorted(sorted_keys, b_keys + max_hops, 'right')
+    h, position = _ranges(starts, stops)
+    g = order[position]
+    valid = edge_index[h] != edge_index[g]
+    h, g = h[valid], g[valid]
+    closest = np.lexsort([np.abs(a_keys[g] - b_keys[h]), h])
+    h, g = h[closest], g[closest]
+    counts = np.bincount(h, minlength=num_half_edges)
+    rank = np.arange(len(h)) - np.repeat(np.cumsum(counts) - counts, counts)
+    h, g = h[rank < max_successors], g[rank < max_successors]
+    # successor lists: h -> g, sorted by h
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(h, minlength=num_half_edges))])
+    links = np.sort(h * num_half_edges + g)
+
+    forward = h % 2 == 0
+    single = np.flatnonzero((np.arange(num_half_edges) % 2 == 0) & (np.abs(a_keys - b_keys) <= max_hops))
+    loops = single[:, None]
+
+    first = forward & (edge_index[h] < edge_index[g])
+    closed = _contains(links, g * num_half_edges + h)
+    pairs = np.column_stack([h[first & closed], g[first & closed]])
+
+    yield loops
+    yield pairs
+    if not triangles:
+        return
+    h1, h2 = h[first], g[first]
+    expansions = np.cumsum(indptr[h2 + 1] - indptr[h2])
+    bounds = np.searchsorted(expansions, np.arange(chunk_size, expansions[-1] if len(h1) else 0, chunk_size))
+    for chunk_h1, chunk_h2 in zip(np.split(h1, bounds), np.split(h2, bounds)):
+        owner, position = _ranges(indptr[chunk_h2], indptr[chunk_h2 + 1])
+        h3 = g[position]
+        chunk_h1, chunk_h2 = chunk_h1[owner], chunk_h2[owner]
+        keep = ((np.abs(b_keys[h3] - a_keys[chunk_h1]) <= max_hops) & (edge_index[h3] > edge_index[chunk_h1])
+                & (edge_index[h3] != edge_index[chunk_h2]))
+        keep[keep] = _contains(links, h3[keep] * num_half_edges + chunk_h1[keep])
+        yield np.column_stack([chunk_h1[keep], chunk_h2[keep], h3[keep]])
+
+
+def cycle_errors(cycles, half_drift, half_offsets):
+    """
+    Rotation (degrees) and translation errors of half-edge cycles.
+
+    Around a cycle closed by odometry, the composed rotation is the product of
+    the drift rotations of its half-edges and the translation error is the
+    sum of their offsets, see validate_edges.
+    """
+    from scipy.spatial.transform import Rotation as R
+
+    composed = half_drift[cycles[:, 0]]
+    for column in range(1, cycles.shape[1]):
+        composed = half_drift[cycles[:, column]] @ composed
+    rotation_errors = np.degrees(R.from_matrix(composed).magnitude())
+    translation_errors = np.linalg.norm(half_offsets[cycles].sum(axis=1), axis=1)
+    return rotation_errors, translation_errors
+
+
+def validate_edges(edges, candidates, ids=None, vertex_poses=None, max_hops=150, rotation_threshold=5.0,
+                   translation_threshold=0.3, triangles=True, max_successors=64, min_support=0.5, max_rounds=10):
+    """
+    Cycle-consistency support of candidate (loop-closure) edges.
+
+    The other edges form the odometry. Node poses consistent with the
+    odometry are the vertex poses when given, as for graphs built from an
+    ARKit session, and otherwise chained along its spanning tree. The drift
+    an edge observes is then E = R_dst^T R_edge R_src and
+    d = t_edge - (p_dst - p_src), so all cycles of iter_cycles are
+    evaluated with batched products by cycle_errors. A cycle is consistent
+    when both errors are below their thresholds.
+
+    The support of an edge is the share of consistent cycles among its
+    cycles. Wrong edges may support each other, so the least supported
+    edges below min_support are rejected by rounds, and the cycles of the
+    remaining edges evaluated again.
+
+    Parameters:
+    edges (np.ndarray): edges of EDGE_DTYPE or (E, 9) rows.
+    candidates (np.ndarray): (E,) mask of the edges to validate.
+    max_hops (int): odometry hops allowed between the ends of successive candidates.
+    rotation_threshold (float): rotation error of a consistent cycle, in degrees.
+    translation_threshold (float): translation error of a consistent cycle.
+    triangles (bool): also use the cycles of three candidate edges.
+    max_successors (int): candidates each candidate may be followed by in a cycle.
+
+    Returns:
+    tuple: (E,) support of the edges (1 for the odometry, 0 once rejected,
+    NaN on no cycle) and a summary dict.
+    """
+    from scipy.spatial.transform import Rotation as R
+    from tools.pose_graph import initialize_from_tree
+
+    start = time.perf_counter()
+    rows = edges_to_array(edges)
+    candidates = np.asarray(candidates, dtype=bool)
+    edge_ids = rows[:, :2].astype(np.int64)
+    vertex_ids = np.empty(0, dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+    node_ids = np.unique(np.concatenate([vertex_ids, edge_ids.ravel()]))
+    num_nodes = len(node_ids)
+    src = np.searchsorted(node_ids, edge_ids[:, 0])
+    dst = np.searchsorted(node_ids, edge_ids[:, 1])
+    rotations = R.from_quat(rows[:, 5:9]).as_matrix()
+    translations = rows[:, 2:5]
+
+    odometry = ~candidates
+    keys, _, roots = odometry_levels(num_nodes, src[odometry], dst[odometry], max_hops)
+    if vertex_poses is not None and len(vertex_ids) == num_nodes:
+        poses = np.asarray(vertex_poses, dtype=np.float64)[np.argsort(vertex_ids)]
+        node_rotations = R.from_quat(poses[:, 3:]).as_matrix()
+        node_positions = poses[:, :3]
+    else:
+        node_rotations, node_positions = initialize_from_tree(num_nodes, src[odometry], dst[odometry],
+                                                              rotations[odometry], translations[odometry], roots,
+                                                              world_frame=True)
+
+    # half-edges 2k and 2k + 1: candidate k forward and backward
+    candidate_edges = np.flatnonzero(candidates)
+    num_candidates = len(candidate_edges)
+    c_src, c_dst = src[candidate_edges], dst[candidate_edges]
+    drift = np.swapaxes(node_rotations[c_dst], 1, 2) @ rotations[candidate_edges] @ node_rotations[c_src]
+    offsets = translations[candidate_edges] - (node_positions[c_dst] - node_positions[c_src])
+    half_drift = np.stack([drift, np.swapaxes(drift, 1, 2)], axis=1).reshape(-1, 3, 3)
+    half_offsets = np.stack([offsets, -offsets], axis=1).reshape(-1, 3)
+    edge_index = np.repeat(np.arange(num_candidates), 2)
+    a_keys = np.column_stack([keys[c_src], keys[c_dst]]).ravel()
+    b_keys = np.column_stack([keys[c_dst], keys[c_src]]).ravel()
+
+    active = np.ones(num_candidates, dtype=bool)
+    for rounds in range(1, max_rounds + 1):
+        half_edges = np.flatnonzero(np.repeat(active, 2))
+        cycles = iter_cycles(edge_index[half_edges], a_keys[half_edges], b_keys[half_edges], max_hops, triangles,
+                             max_successors)
+        consistent = np.zeros(num_candidates)
+        total = np.zeros(num_candidates)
+        # number of cycles of one, two and three candidates
+        num_cycles = [0, 0, 0]
+        for cycle in cycles:
+            num_cycles[cycle.shape[1] - 1] += len(cycle)
+            if not len(cycle):
+                continue
+            cycle = half_edges[cycle]
+            rotation_errors, translation_errors = cycle_errors(cycle, half_drift, half_offsets)
+            ok = (rotation_errors <= rotation_threshold) & (translation_errors <= translation_threshold)
+            members = edge_index[cycle]
+            total += np.bincount(members.ravel(), minlength=num_candidates)
+            consistent += np.bincount(members[ok].ravel(), minlength=num_candidates)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            support = np.where(active, consistent / total, 0.0)
+        weak = active & (support < min_support)
+        if not weak.any():
+            break
+        # reject the least supported edges first, their cycles may be all
+        # that supports other wrong edges
+        active &= ~(weak & (support <= support[weak].min() + 0.1))
+    support[~active] = 0.0
+
+    edge_support = np.ones(len(rows))
+    edge_support[candidate_edges] = support
+    summary = {'num_candidates': num_candidates, 'num_cycles': num_cycles, 'rounds': rounds,
+               'num_supported': int((support >= min_support).sum()),
+               'num_rejected': int((support < min_support).sum()),
+               'num_unverified': int(np.isnan(support).sum()), 'seconds': time.perf_counter() - start}
+    logging.info("Validated {} candidate edges on {} cycles in {} rounds: {} supported, {} rejected, "
+                 "{} on no cycle".format(num_candidates, sum(summary['num_cycles']), rounds,
+                                         summary['num_supported'], summary['num_rejected'],
+                                         summary['num_unverified']))
+    emit(dict(summary, event='cycle_consistency'))
+    return edge_support, summary
+
+
+def edge_weights(support, mode='weight', min_support=0.5, unverified_weight=1.0):
+    """
+    Weights of the edges from their validate_edges support.
+
+    'reject' keeps (1) the edges supported by at least min_support of their
+    cycles and drops (0) the others; 'weight' also drops those and scales
+    the others by their support. Edges on no cycle get unverified_weight.
+    """
+    support = np.asarray(support, dtype=np.float64)
+    kept = support >= min_support
+    if mode == 'reject':
+        weights = kept.astype(np.float64)
+    elif mode == 'weight':
+        weights = np.where(kept, support, 0.0)
+    else:
+        raise ValueError("unknown mode {}, expected one of {}".format(mode, MODES))
+    weights[np.isnan(support)] = unverified_weight
+    return weights
+
+
+def weight_edges(edges, information, weights):
+    """
+    Drop the edges of zero weight and scale the information of the others.
+
+    Returns:
+    tuple: the kept edges and their (E, 21) information, as taken by write_g2o.
+    """
+    upper = information_upper_triangle(information, len(edges)).copy()
+    # all-zero information stands for unit information, see pose_graph.whitening
+    upper[~upper.any(axis=1)] = np.eye(6)[np.triu_indices(6)]
+    keep = weights > 0
+    return edges[keep], upper[keep] * weights[keep, None]
+
+
+def filter_edges(edges, candidates, information=DEFAULT_INFORMATION, ids=None, vertex_poses=None, mode='weight',
+                 min_support=0.5, unverified_weight=1.0, **options):
+    """
+    Validate the candidate edges and write their weights into the information matrices.
+
+    Runs validate_edges with the options, then drops or scales the edges by
+    edge_weights and weight_edges.
+
+    Returns:
+    tuple: the kept edges, their (E, 21) information and the validate_edges summary.
+    """
+    support, summary = validate_edges(edges, candidates, ids, vertex_poses, min_support=min_support, **options)
+    edges, information = weight_edges(edges, information, edge_weights(support, mode, min_support, unverified_weight))
+    return edges, information, summary
+
+
+def add_cycle_arguments(parser):
+    parser.add_argument('--cycle-filter', type=str, default=None, choices=MODES,
+                        help='Reject or down-weight the loop-closure edges inconsistent on short cycles (default: off)')
+    parser.add_argument('--cycle-max-hops', type=int, default=150,
+                        help='Odometry hops allowed between the ends of successive loop closures of a cycle')
+    parser.add_argument('--cycle-max-angle', type=float, default=5.0,
+                        help='Rotation error of a consistent cycle in degrees')
+    parser.add_argument('--cycle-max-distance', type=float, default=0.3, help='Translation error of a consistent cycle')
+    parser.add_argument('--cycle-min-support', type=float, default=0.5,
+                        help='Share of consistent cycles below which a loop closure is rejected')
+    parser.add_argument('--cycle-unverified-weight', type=float, default=1.0,
+                        help='Weight of the loop closures on no cycle (0: reject them)')
+
+
+def cycle_options(args):
+    if args.cycle_filter is None:
+        return None
+    return {'mode': args.cycle_filter, 'max_hops': args.cycle_max_hops, 'rotation_threshold': args.cycle_max_angle,
+            'translation_threshold': args.cycle_max_distance, 'min_support': args.cycle_min_support,
+            'unverified_weight': args.cycle_unverified_weight}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Reject or down-weight the loop-closure edges of a g2o graph '
+                                                 'that are inconsistent on short cycles')
+    parser.add_argument('--g2o_filename', '--g2o', dest='g2o', type=str, required=True,
+                        help='Path to the text or binary g2o graph')
+    parser.add_argument('--output', type=str, required=True, help='Path to the filtered g2o graph')
+    parser.add_argument('--odometry-gap', type=int, default=1,
+                        help='Edges between vertices at most this many ids apart are odometry, the others are validated')
+    parser.add_argument('--no-triangles', action='store_true', help='Only use cycles of one or two loop closures')
+    add_cycle_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.cycle_filter is None:
+        args.cycle_filter = 'weight'
+
+    vertex_ids, vertex_poses = read_g2o_vertices(args.g2o)
+    edges, information = read_g2o_edges(args.g2o)
+    candidates = np.abs(edges['dst'] - edges['src']) > args.odometry_gap
+    # Graphs without vertex rotations, as data/synthetic, are chained along the odometry instead.
+    has_poses = np.linalg.norm(vertex_poses[:, 3:], axis=1).all()
+    edges, information, _ = filter_edges(edges, candidates, information, vertex_ids,
+                                         vertex_poses if has_poses else None, triangles=not args.no_triangles,
+                                         **cycle_options(args))
+    write_g2o(args.output, vertex_poses, edges, information, ids=vertex_ids)
+
+
+if __name__ == '__main__':
+    main()
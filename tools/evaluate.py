@@ -0,0 +1,220 @@
+import argparse
+import json
+import logging
+
+import numpy as np
+
+from tools.alignment import umeyama
+from tools.trajectory import Trajectory, match_timestamps
+
+logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+
+
+def load_poses(filename, cache=True):
+    """
+    Load camera poses from an sfm_data.json or an ARposes file.
+
+    sfm_data.json poses are keyed by pose id (see Trajectory.from_sfm_data),
+    ARposes poses by timestamp, in timestamp order. With cache=False the
+    .gopt_cache next to the file is neither read nor written.
+    """
+    if filename.endswith('.json'):
+        return Trajectory.from_sfm_data(filename, cache)
+    return Trajectory.from_arposes(filename, cache).sorted()
+
+
+def associate_poses(estimate, reference, by='id', tolerance=0.01):
+    """
+    Pair the poses of two trajectories.
+
+    Parameters:
+    estimate, reference (Trajectory): Trajectories to associate, keyed by
+    their timestamps.
+    by (str): 'id' for exact key matches, 'timestamp' for the nearest
+    reference timestamp within the tolerance.
+    tolerance (float): Maximum time difference in seconds for 'timestamp'.
+
+    Returns:
+    tuple of np.ndarray: indices into estimate and reference, ordered by the
+    estimate keys.
+    """
+    if by == 'id':
+        _, est_idx, ref_idx = np.intersect1d(estimate.timestamps, reference.timestamps, assume_unique=True,
+                                             return_indices=True)
+        return est_idx, ref_idx
+    if by != 'timestamp':
+        raise ValueError("unknown association {}".format(by))
+
+    order = np.argsort(reference.timestamps, kind='stable')
+    nearest, matched = match_timestamps(reference.timestamps[order], estimate.timestamps, tolerance)
+    est_idx = np.flatnonzero(matched)
+    est_idx = est_idx[np.argsort(estimate.timestamps[est_idx], kind='stable')]
+    return est_idx, order[nearest[est_idx]]
+
+
+def error_stats(errors):
+    """Summary statistics of an error vector, suitable for JSON."""
+    if len(errors) == 0:
+        return {'count': 0}
+    return {
+        'count': int(len(errors)),
+        'rmse': float(np.sqrt(np.mean(errors ** 2))),
+        'mean': float(np.mean(errors)),
+        'median': float(np.median(errors)),
+        'std': float(np.std(errors)),
+        'min': float(errors.min()),
+        'max': float(errors.max()),
+    }
+
+
+def absolute_trajectory_error(est_positions, ref_positions, with_scale=False):
+    """
+    Align the estimated positions to the reference and measure the residuals.
+
+    Returns:
+    tuple: (rotation, translation, scale) of the alignment and the (N,)
+    per-pose position errors.
+    """
+    rotation, translation, scale = umeyama(est_positions, ref_positions, with_scale=with_scale)
+    aligned = scale * est_positions @ rotation.T + translation
+    return (rotation, translation, scale), np.linalg.norm(aligned - ref_positions, axis=1)
+
+
+def relative_pose_error(estimate, reference, delta, scale=1.0):
+    """
+    Relative pose errors between poses delta frames apart.
+
+    Parameters:
+    estimate, reference (Trajectory): associated poses.
+    delta (int): Frame offset of the compared pose pairs.
+    scale (float): Scale applied to the estimated translations.
+
+    Returns:
+    tuple of np.ndarray: (N - delta,) translation errors and rotation errors in degrees.
+    """
+    if delta <= 0 or delta >= len(estimate):
+        return np.empty(0), np.empty(0)
+
+    src = np.arange(len(estimate) - delta)
+    est_rel = estimate.transform(scale=scale).relative(src, src + delta)
+    ref_rel = reference.relative(src, src + delta)
+
+    # error = inv(ref_rel) * est_rel
+    error = ref_rel.inverse().compose(est_rel)
+    return np.linalg.norm(error.positions, axis=1), np.degrees(error.rotations.magnitude())
+
+
+def evaluate(estimate, reference, by='id', tolerance=0.01, deltas=(1,), with_scale=False):
+    """
+    ATE and RPE of an estimated trajectory against a reference.
+
+    Returns:
+    tuple: metrics dict and per-pose table dict of np.ndarray.
+    """
+    est_idx, ref_idx = associate_poses(estimate, reference, by, tolerance)
+    if len(est_idx) < 3:
+        raise ValueError("only {} poses could be associated".format(len(est_idx)))
+
+    associated = estimate[est_idx]
+    associated_reference = reference[ref_idx]
+    est_positions = associated.positions
+    ref_positions = associated_reference.positions
+
+    (rotation, translation, scale), ate = absolute_trajectory_error(est_positions, ref_positions, with_scale)
+
+    metrics = {
+        'num_estimate': int(len(estimate)),
+        'num_reference': int(len(reference)),
+        'num_associated': int(len(est_idx)),
+        'alignment': {
+            'rotation': rotation.tolist(),
+            'translation': translation.tolist(),
+            'scale': float(scale),
+        },
+        'ate': error_stats(ate),
+        'rpe': {},
+    }
+    for delta in deltas:
+        trans_errors, rot_errors = relative_pose_error(associated, associated_reference, delta, scale)
+        metrics['rpe'][str(delta)] = {
+            'translation': error_stats(trans_errors),
+            'rotation_deg': error_stats(rot_errors),
+        }
+
+    table = {
+        'key': associated.timestamps,
+        'reference_key': associated_reference.timestamps,
+        'ate': ate,
+        'aligned': associated.transform(rotation, translation, scale).positions,
+        'reference': ref_positions,
+    }
+    return metrics, table
+
+
+def write_errors_csv(filename, table):
+    """Write the per-pose ATE table as CSV."""
+    rows = np.column_stack([table['key'], table['reference_key'], table['ate'], table['aligned'], table['reference']])
+    np.savetxt(filename, rows, delimiter=',', fmt='%.9g', comments='',
+               header='key,reference_key,ate,x,y,z,reference_x,reference_y,reference_z')
+
+
+def plot_errors(filename, table):
+    """Save a top-down trajectory overlay and the ATE per pose as a PNG."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, (ax_xy, ax_err) = plt.subplots(1, 2, figsize=(14, 6))
+    ax_xy.plot(table['reference'][:, 0], table['reference'][:, 1], 'r-', linewidth=1, label='reference')
+    ax_xy.plot(table['aligned'][:, 0], table['aligned'][:, 1], 'b-', linewidth=1, label='estimate (aligned)')
+    ax_xy.set_aspect('equal', adjustable='datalim')
+    ax_xy.set_xlabel('X Coordinate')
+    ax_xy.set_ylabel('Y Coordinate')
+    ax_xy.legend()
+
+    ax_err.plot(table['ate'], 'k-', linewidth=1)
+    ax_err.set_xlabel('Pose')
+    ax_err.set_ylabel('ATE')
+
+    fig.tight_layout()
+    fig.savefig(filename, dpi=100)
+    plt.close(fig)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Evaluate a trajectory against a reference (ATE/RPE)')
+    parser.add_argument('--estimate', type=str, required=True, help='Estimated poses (sfm_data.json or ARposes)')
+    parser.add_argument('--reference', type=str, required=True, help='Reference poses (sfm_data.json or ARposes)')
+    parser.add_argument('--associate', choices=['id', 'timestamp'], default=None,
+                        help='Associate poses by view id or timestamp (default: id for sfm_data.json, else timestamp)')
+    parser.add_argument('--tolerance', type=float, default=0.01, help='Maximum timestamp difference in seconds')
+    parser.add_argument('--deltas', type=int, nargs='+', default=[1], help='Frame offsets for the RPE')
+    parser.add_argument('--scale', action='store_true', help='Estimate a scale in the alignment')
+    parser.add_argument('--json', type=str, default=None, help='Output metrics JSON (default: print to stdout)')
+    parser.add_argument('--csv', type=str, default=None, help='Output per-pose ATE CSV')
+    parser.add_argument('--plot', type=str, default=None, help='Output PNG plot')
+    parser.add_argument('--no-cache', action='store_true', help='Neither read nor write the .gopt_cache next to the inputs')
+    args = parser.parse_args(argv)
+
+    by = args.associate
+    if by is None:
+        by = 'id' if args.estimate.endswith('.json') and args.reference.endswith('.json') else 'timestamp'
+
+    estimate = load_poses(args.estimate, not args.no_cache)
+    reference = load_poses(args.reference, not args.no_cache)
+    metrics, table = evaluate(estimate, reference, by, args.tolerance, args.deltas, args.scale)
+    logging.info("ATE rmse: {:.6f} over {} poses".format(metrics['ate']['rmse'], metrics['num_associated']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(metrics, f, indent=2)
+    else:
+        print(json.dumps(metrics, indent=2))
+    if args.csv:
+        write_errors_csv(args.csv, table)
+    if args.plot:
+        plot_errors(args.plot, table)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,451 @@
+import argparse
+import logging
+import time
+
+import numpy as np
+from scipy.sparse import coo_matrix, identity
+from scipy.sparse.linalg import splu
+from scipy.spatial.transform import Rotation as R
+
+from tools.instrumentation import Instrumentation
+from tools.loop_closure import (add_loop_closure_arguments, filter_loop_closures, loop_closure_neighbours,
+                                loop_closure_options, nearest_loop_closures, suppress_loop_closures)
+from tools.pipeline import adjusted_arposes_filename
+from tools.trajectory import Trajectory, has_arposes_header
+from tools.utils import EDGE_DTYPE, relative_pose_edges
+
+logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+
+
+def parse_arposes_lines(lines):
+    """
+    Parse data lines of an ARposes file.
+
+    Returns:
+    Trajectory: the poses of the lines, as Trajectory.from_arposes.
+    """
+    rows = [line.rstrip('\r\n').split(',') for line in lines]
+    values = np.array([row[:8] for row in rows], dtype=np.float64).reshape(-1, 8)
+    status = np.array([row[8].strip() if len(row) > 8 else '' for row in rows])
+    return Trajectory(values[:, 0], values[:, 1:4], values[:, [5, 6, 7, 4]], status)
+
+
+def follow_arposes(filename, chunk_size=30, follow=False, poll_interval=0.5, idle_timeout=10.0):
+    """
+    Read the rows of an ARposes file in chunks, optionally while it is written.
+
+    A chunk is yielded every chunk_size rows, and with whatever rows are there
+    when the end of the file is reached. With follow=True the file is then
+    polled every poll_interval seconds for new rows, until none arrived for
+    idle_timeout seconds (None: forever). A last line without a newline is
+    only read once the file stops growing. The header line is optional, see
+    has_arposes_header.
+
+    Yields:
+    Trajectory: the poses of the new rows.
+    """
+    header = None
+    lines = list()
+    partial = ''
+    idle = 0.0
+    with open(filename, 'r') as f:
+        while True:
+            line = f.readline()
+            if line:
+                partial += line
+                if not partial.endswith('\n'):
+                    continue
+                if header is None:
+                    header = partial
+                    if not has_arposes_header(header):
+                        lines.append(partial)
+                elif partial.strip():
+                    lines.append(partial)
+                partial = ''
+                idle = 0.0
+                if len(lines) >= chunk_size:
+                    yield parse_arposes_lines(lines)
+                    lines = list()
+                continue
+
+            # end of file
+            if lines:
+                yield parse_arposes_lines(lines)
+                lines = list()
+            if not follow or (idle_timeout is not None and idle >= idle_timeout):
+                break
+            time.sleep(poll_interval)
+            idle += poll_interval
+
+    if partial.strip() and (header is not None or not has_arposes_header(partial)):
+        yield parse_arposes_lines([partial])
+
+
+# a cell of the keyframe hash and its 26 neighbours
+NEIGHBOUR_CELLS = np.stack(np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1], indexing='ij'), axis=-1).reshape(-1, 3)
+
+
+class SlidingWindowAdjuster:
+    """
+    Correct the drift of a growing ARKit trajectory over a sliding window.
+
+    Frames are appended as they arrive, with odometry edges to the previous
+    poses as arkittog2o builds them, and loop-closure edges from new
+    keyframes to earlier ones as tools.loop_closure finds them. An update
+    re-optimizes only the positions of the last active_window poses: older
+    poses are held fixed at their corrected positions, and the window is
+    updated from the previous solution, with the new poses predicted by
+    their odometry. The cost of an update is therefore bounded by the
+    window, not by the length of the trajectory.
+
+    Like bin/position_estimator, only the positions are optimized; the
+    orientations are kept as tracked by ARKit.
+    """
+
+    def __init__(self, active_window=600, window=1, stride=1, loop_closure=None, damping=1e-9, capacity=4096):
+        if active_window < 1:
+            raise ValueError("active_window must be positive, got {}".format(active_window))
+        if window < 1 or stride < 1:
+            raise ValueError("window and stride must be positive, got window={} stride={}".format(window, stride))
+        self.active_window = active_window
+        self.window = window
+        self.stride = stride
+        self.damping = damping
+        self.loop_closure = dict(radius=0.3, min_gap=10.0, max_angle=30.0, nms=2.0, keyframe_spacing=None)
+        self.loop_closure.update(loop_closure or {})
+
+        self.count = 0
+        self.timestamps = np.empty(capacity)
+        self.positions = np.empty((capacity, 3))
+        self.quats = np.empty((capacity, 4))
+        self.status = np.empty(capacity, dtype=object)
+        self.corrected = np.empty((capacity, 3))
+
+        self.num_edges = 0
+        self.edges = np.empty(capacity, dtype=EDGE_DTYPE)
+        self.num_loop_closures = 0
+
+        self.num_keyframes = 0
+        self.keyframes = np.empty(capacity, dtype=np.int64)
+        # spatial hash of the keyframes: cell -> keyframe indices, in cells of side radius
+        self._keyframe_cells = dict()
+        self._cell_size = self.loop_closure['radius'] if self.loop_closure['radius'] > 0 else 1.0
+        self._travelled = 0.0
+        self._keyframe_cell = -1
+        self._pending_loop_closures = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        self._accepted_loop_closures = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+
+        # poses before `first_active` are fixed, those before `num_final` were returned as final
+        self.first_active = 0
+        self.num_final = 0
+
+    def _reserve(self, count):
+        if count <= len(self.timestamps):
+            return
+        capacity = max(count, 2 * len(self.timestamps))
+        self.timestamps = np.resize(self.timestamps, capacity)
+        self.positions = np.resize(self.positions, (capacity, 3))
+        self.quats = np.resize(self.quats, (capacity, 4))
+        self.status = np.resize(self.status, capacity)
+        self.corrected = np.resize(self.corrected, (capacity, 3))
+
+    def _add_edges(self, edges):
+        end = self.num_edges + len(edges)
+        if end > len(self.edges):
+            self.edges = np.resize(self.edges, max(end, 2 * len(self.edges)))
+        self.edges[self.num_edges:end] = edges
+        self.num_edges = end
+
+    def _add_keyframes(self, indices):
+        end = self.num_keyframes + len(indices)
+        if end > len(self.keyframes):
+            self.keyframes = np.resize(self.keyframes, max(end, 2 * len(self.keyframes)))
+        self.keyframes[self.num_keyframes:end] = indices
+        self.num_keyframes = end
+        cells = np.floor(self.positions[indices] / self._cell_size).astype(np.int64).tolist()
+        for index, cell in zip(indices.tolist(), cells):
+            self._keyframe_cells.setdefault(tuple(cell), []).append(index)
+
+    def _nearby_keyframes(self, indices, radius):
+        # Pairs of earlier keyframes and keyframes of the indices within the
+        # radius. Only the cells around each keyframe are looked up, so the cost
+        # does not grow with the length of the trajectory.
+        i, j = list(), list()
+        cells = np.floor(self.positions[indices] / self._cell_size).astype(np.int64)
+        for index, cell in zip(indices.tolist(), cells):
+            for neighbour in (cell + NEIGHBOUR_CELLS).tolist():
+                found = self._keyframe_cells.get(tuple(neighbour))
+                if found:
+                    i.extend(found)
+                    j.extend([index] * len(found))
+        i = np.array(i, dtype=np.int64)
+        j = np.array(j, dtype=np.int64)
+        differences = self.positions[j] - self.positions[i]
+        keep = (i < j) & (np.einsum('ij,ij->i', differences, differences) <= radius ** 2)
+        order = np.lexsort((i[keep], j[keep]))
+        return i[keep][order], j[keep][order]
+
+    def append(self, trajectory):
+        """
+        Append the frames of a Trajectory with their odometry and loop-closure edges.
+
+        Returns:
+        int: number of new loop-closure edges.
+        """
+        start = self.count
+        end = start + len(trajectory)
+        if end == start:
+            return 0
+        self._reserve(end)
+        self.timestamps[start:end] = trajectory.timestamps
+        self.positions[start:end] = trajectory.positions
+        self.quats[start:end] = trajectory.quats
+        self.status[start:end] = '' if trajectory.tracking_status is None else trajectory.tracking_status
+        self.count = end
+
+        # Warm start: the new poses follow their odometry from the last corrected pose.
+        offset = self.corrected[start - 1] - self.positions[start - 1] if start else 0.0
+        self.corrected[start:end] = self.positions[start:end] + offset
+
+        # odometry edges, as odometry_edge_indices builds them for the whole trajectory
+        new = np.arange(start, end, dtype=np.int64)
+        steps = self.stride * np.arange(1, self.window + 1, dtype=np.int64)
+        src = (new[None, :] - steps[:, None]).ravel()
+        dst = np.broadcast_to(new, (self.window, len(new))).ravel()
+        valid = src >= 0
+        src, dst = src[valid], dst[valid]
+        if len(src):
+            low = src.min()
+            rotations = R.from_quat(self.quats[low:end])
+            edges = relative_pose_edges(self.positions[low:end], rotations, src - low, dst - low)
+            edges['src'] += low
+            edges['dst'] += low
+            self._add_edges(edges)
+
+        return self._add_loop_closures(start, end)
+
+    def _add_loop_closures(self, start, end):
+        options = self.loop_closure
+        radius = options['radius']
+        spacing = options['keyframe_spacing']
+        if spacing is None:
+            spacing = radius / 4.0
+
+        # keyframes every `spacing` of travelled distance, as keyframe_indices
+        previous = self.positions[start - 1:start] if start else self.positions[start:start + 1]
+        steps = np.linalg.norm(np.diff(np.concatenate([previous, self.positions[start:end]]), axis=0), axis=1)
+        travelled = self._travelled + np.cumsum(steps)
+        cells = np.floor(travelled / spacing) if spacing > 0 else np.arange(start, end, dtype=np.float64)
+        is_keyframe = cells > np.concatenate([[self._keyframe_cell], cells[:-1]])
+        self._travelled = travelled[-1]
+        self._keyframe_cell = cells[-1]
+        new_keyframes = np.flatnonzero(is_keyframe) + start
+        self._add_keyframes(new_keyframes)
+
+        # new keyframes within the radius of any earlier keyframe
+        i, j = self._nearby_keyframes(new_keyframes, radius)
+        i, j = filter_loop_closures(i, j, self.quats, self.timestamps, options['min_gap'], options['max_angle'])
+        keep = nearest_loop_closures(i, j, self.positions)
+        i, j = i[keep], j[keep]
+
+        if options['nms'] > 0:
+            i, j = self._suppress_loop_closures(i, j, options['nms'])
+        return self._add_loop_closure_edges(i, j)
+
+    def _suppress_loop_closures(self, i, j, nms, flush=False):
+        # A candidate is decided once no later frame can be within nms seconds of
+        # it or of the closer candidates it depends on, so the stream keeps the
+        # same pairs as find_loop_closures on the whole trajectory.
+        pending_i, pending_j = self._pending_loop_closures
+        i = np.concatenate([pending_i, i])
+        j = np.concatenate([pending_j, j])
+        if len(i) == 0:
+            return i, j
+
+        accepted_i, accepted_j = self._accepted_loop_closures
+        recent = self.timestamps[accepted_j] >= self.timestamps[j].min() - nms
+        accepted_i, accepted_j = accepted_i[recent], accepted_j[recent]
+        all_i = np.concatenate([accepted_i, i])
+        all_j = np.concatenate([accepted_j, j])
+        accepted = np.zeros(len(all_i), dtype=bool)
+        accepted[:len(accepted_i)] = True
+
+        kept = np.zeros(len(all_i), dtype=bool)
+        kept[suppress_loop_closures(all_i, all_j, self.positions, self.timestamps, nms, accepted)] = True
+        decided = accepted.copy()
+        if flush:
+            decided[:] = True
+        else:
+            decided |= self.timestamps[all_j] < self.timestamps[self.count - 1] - nms
+            better, worse = loop_closure_neighbours(all_i, all_j, self.positions, self.timestamps, nms)
+            while True:
+                undecided = worse[decided[worse] & ~decided[better]]
+                if len(undecided) == 0:
+                    break
+                decided[undecided] = False
+        kept, decided = kept[len(accepted_i):], decided[len(accepted_i):]
+
+        self._pending_loop_closures = (i[~decided], j[~decided])
+        i, j = i[kept & decided], j[kept & decided]
+        self._accepted_loop_closures = (np.concatenate([accepted_i, i]), np.concatenate([accepted_j, j]))
+        return i, j
+
+    def _add_loop_closure_edges(self, i, j):
+        if len(i) == 0:
+            return 0
+        # loop-closure edges as pair_edges builds them: zero relative translation
+        indices, inverse = np.unique(np.concatenate([i, j]), return_inverse=True)
+        edges = relative_pose_edges(np.zeros((len(indices), 3)), R.from_quat(self.quats[indices]),
+                                    inverse[:len(i)], inverse[len(i):])
+        edges['src'] = i
+        edges['dst'] = j
+        self._add_edges(edges)
+        self.num_loop_closures += len(i)
+        return len(i)
+
+    def flush(self):
+        """
+        Decide the loop-closure candidates still waiting for the end of their revisit.
+
+        Returns:
+        int: number of new loop-closure edges.
+        """
+        if self.loop_closure['nms'] <= 0:
+            return 0
+        empty = np.empty(0, dtype=np.int64)
+        return self._add_loop_closure_edges(*self._suppress_loop_closures(empty, empty, self.loop_closure['nms'], True))
+
+    def optimize(self):
+        """
+        Re-optimize the positions of the active window.
+
+        The window problem is linear in the positions, so the update of the
+        previous solution is solved directly with one sparse factorization.
+        A tiny damping towards the previous solution keeps the poses that are
+        not connected to a fixed pose (e.g. with stride > 1) where they are.
+
+        Returns:
+        float: largest position update in the window.
+        """
+        # The first pose anchors the trajectory, as the ARKit origin.
+        first = max(1, self.count - self.active_window, self.first_active)
+        self.first_active = first
+        num_active = self.count - first
+        if num_active <= 0:
+            return 0.0
+
+        edges = self.edges[:self.num_edges]
+        active = np.maximum(edges['src'], edges['dst']) >= first
+        src = edges['src'][active]
+        dst = edges['dst'][active]
+        translations = np.column_stack([edges['tx'][active], edges['ty'][active], edges['tz'][active]])
+
+        # Residual of an edge: x_dst - x_src - t, the fixed endpoints are held at their corrected positions.
+        residuals = self.corrected[dst] - self.corrected[src] - translations
+        src_free = src >= first
+        dst_free = dst >= first
+        rows = np.arange(len(src))
+        jacobian = coo_matrix((np.concatenate([np.ones(dst_free.sum()), -np.ones(src_free.sum())]),
+                               (np.concatenate([rows[dst_free], rows[src_free]]),
+                                np.concatenate([dst[dst_free], src[src_free]]) - first)),
+                              shape=(len(src), num_active)).tocsc()
+        normal = (jacobian.T @ jacobian + self.damping * identity(num_active)).tocsc()
+        update = -splu(normal).solve(np.asarray(jacobian.T @ residuals))
+
+        self.corrected[first:self.count] += update
+        return float(np.linalg.norm(update, axis=1).max())
+
+    def finalize(self, all_poses=False):
+        """
+        Mark the poses that left the active window, or all poses, as final.
+
+        Returns:
+        np.ndarray: ids of the poses that became final.
+        """
+        end = self.count if all_poses else self.first_active
+        ids = np.arange(self.num_final, end, dtype=np.int64)
+        self.num_final = max(self.num_final, end)
+        return ids
+
+    def vertex_poses(self, ids):
+        """(N, 7) corrected poses of the ids as tx ty tz qx qy qz qw, see Trajectory.poses."""
+        return np.column_stack([self.corrected[ids], self.quats[ids]])
+
+    def trajectory(self, ids):
+        """Trajectory of the corrected poses of the ids."""
+        return Trajectory(self.timestamps[ids], self.corrected[ids], self.quats[ids], self.status[ids])
+
+    def write(self, arposes_filename, ids, append=True):
+        self.trajectory(ids).to_arposes(arposes_filename, append=append)
+
+
+def adjust_stream(arposes_filename, output_filename=None, update_every=30, follow=False, poll_interval=0.5,
+                  idle_timeout=10.0, metrics_filename=None, **options):
+    """
+    Correct the drift of an ARposes file incrementally, as its frames arrive.
+
+    Every update_every frames (or whenever the end of a followed file is
+    reached) the frames are appended to a SlidingWindowAdjuster and the
+    active window is re-optimized. Poses are appended to the output ARposes
+    file once they leave the active window, the remaining ones when the
+    stream ends. The frames, edges, largest correction and seconds of every update
+    are emitted to metrics_filename as 'update' records.
+
+    Returns:
+    SlidingWindowAdjuster: the adjuster holding the whole corrected trajectory.
+    """
+    output_filename = output_filename or adjusted_arposes_filename(arposes_filename)
+    timer = Instrumentation(metrics_filename, session=arposes_filename)
+    adjuster = SlidingWindowAdjuster(**options)
+    adjuster.write(output_filename, np.empty(0, dtype=np.int64), append=False)
+
+    latencies = list()
+    for frames in follow_arposes(arposes_filename, update_every, follow, poll_interval, idle_timeout):
+        start = time.perf_counter()
+        loop_closures = adjuster.append(frames)
+        correction = adjuster.optimize()
+        final = adjuster.finalize()
+        adjuster.write(output_filename, final)
+        seconds = time.perf_counter() - start
+        latencies.append(seconds)
+        timer.emit({'event': 'update', 'frames': adjuster.count, 'new_frames': len(frames),
+                    'active': adjuster.count - adjuster.first_active, 'edges': adjuster.num_edges,
+                    'loop_closures': loop_closures, 'correction': correction, 'final': len(final),
+                    'seconds': seconds})
+
+    if adjuster.flush():
+        adjuster.optimize()
+    adjuster.write(output_filename, adjuster.finalize(all_poses=True))
+    if latencies:
+        timer.emit({'event': 'stream', 'frames': adjuster.count, 'updates': len(latencies),
+                    'loop_closures': adjuster.num_loop_closures, 'seconds': sum(latencies),
+                    'max_update_seconds': max(latencies)})
+        logging.info("Adjusted {} frames with {} loop closures in {} updates, {:.1f}ms on average, {:.1f}ms at most".format(
+            adjuster.count, adjuster.num_loop_closures, len(latencies), 1000 * np.mean(latencies), 1000 * max(latencies)))
+    logging.info("Saved adjusted poses to: {}".format(output_filename))
+    return adjuster
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Correct the drift of an ARKit session incrementally, while it is recorded')
+    parser.add_argument('--arposes', type=str, required=True, help='Path to the ARposes txt file, possibly still being written')
+    parser.add_argument('--output', type=str, default=None, help='Path to the adjusted ARposes file (default: ARposes.adj.txt)')
+    parser.add_argument('--follow', action='store_true', help='Keep reading frames appended to the ARposes file')
+    parser.add_argument('--idle-timeout', type=float, default=10.0,
+                        help='With --follow, stop after this many seconds without new frames (0: never)')
+    parser.add_argument('--poll-interval', type=float, default=0.5, help='With --follow, seconds between checks for new frames')
+    parser.add_argument('--update-every', type=int, default=30, help='Number of new frames between updates')
+    parser.add_argument('--active-window', type=int, default=600, help='Number of most recent poses re-optimized at every update')
+    parser.add_argument('--window', type=int, default=1, help='Number of successive poses each pose is connected to by odometry edges')
+    parser.add_argument('--stride', type=int, default=1, help='Frame step between poses connected by odometry edges')
+    parser.add_argument('--metrics', type=str, default=None, help='Append per-update timings as JSON lines to this file')
+    add_loop_closure_arguments(parser)
+    args = parser.parse_args(argv)
+
+    adjust_stream(args.arposes, args.output, args.update_every, args.follow, args.poll_interval,
+                  args.idle_timeout or None, args.metrics, active_window=args.active_window, window=args.window,
+                  stride=args.stride, loop_closure=loop_closure_options(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import resource
+import sys
+import time
+
+# The Instrumentation collecting stages in the current context; stage() is a
+# no-op without one, so library functions can be instrumented unconditionally.
+_active = contextvars.ContextVar('instrumentation', default=None)
+
+
+def read_peak_rss_kb(pid='self'):
+    """
+    Peak resident set size (VmHWM) of a process in KiB, for this process
+    since the last reset_peak_rss. Without /proc it is the lifetime peak of
+    this process, and None for other processes.
+    """
+    try:
+        with open('/proc/{}/status'.format(pid), 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    if pid != 'self':
+        return None
+    # ru_maxrss is the lifetime peak, in KiB on Linux and in bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def reset_peak_rss():
+    """Reset the peak RSS to the current RSS where Linux allows it; returns whether it did."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class Instrumentation:
+    """
+    Record the wall time, CPU time and peak memory of named stages.
+
+    Stages nest; nested stages are recorded as "outer/inner". Each finished
+    stage is kept in `records` and, when a metrics file is given, appended to
+    it as one JSON line. `timings` holds the seconds of the top-level stages.
+
+    The peak RSS of a stage is exact on Linux, where the kernel high-water
+    mark is reset when a stage starts; elsewhere it is the process peak.
+    """
+
+    def __init__(self, metrics_filename=None, **context):
+        self.metrics_filename = metrics_filename
+        self.context = context
+        self.records = list()
+        self.timings = dict()
+        self._stack = list()
+
+    def emit(self, record):
+        record = dict(self.context, **record)
+        self.records.append(record)
+        if self.metrics_filename:
+            with open(self.metrics_filename, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self._stack:
+            # Fold the peak so far into the enclosing stage before the reset.
+            self._stack[-1]['peak_rss_kb'] = max(self._stack[-1]['peak_rss_kb'], read_peak_rss_kb())
+        reset_peak_rss()
+        frame = {'name': '/'.join([frame['name'] for frame in self._stack[-1:]] + [name]),
+                 'peak_rss_kb': read_peak_rss_kb()}
+        self._stack.append(frame)
+        token = _active.set(self)
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            cpu_seconds = time.process_time() - cpu_start
+            _active.reset(token)
+            self._stack.pop()
+            peak_rss_kb = max(frame['peak_rss_kb'], read_peak_rss_kb())
+            if self._stack:
+                self._stack[-1]['peak_rss_kb'] = max(self._stack[-1]['peak_rss_kb'], peak_rss_kb)
+            else:
+                self.timings[name] = self.timings.get(name, 0.0) + seconds
+            self.emit({'event': 'stage', 'stage': frame['name'], 'seconds': seconds,
+                       'cpu_seconds': cpu_seconds, 'peak_rss_kb': peak_rss_kb})
+
+    @contextlib.contextmanager
+    def activate(self):
+        """Make this the instrumentation of module-level stage() calls."""
+        token = _active.set(self)
+        try:
+            yield self
+        finally:
+            _active.reset(token)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Record a stage in the active Instrumentation, if any."""
+    instrumentation = _active.get()
+    if instrumentation is None:
+        yield
+        return
+    with instrumentation.stage(name):
+        yield
+
+
+def emit(record):
+    """Emit a record to the active Instrumentation, if any."""
+    instrumentation = _active.get()
+    if instrumentation is not None:
+        instrumentation.emit(record)
+
+
+@contextlib.contextmanager
+def profile(output_filename, profiler='cprofile'):
+    """
+    Profile the enclosed code.
+
+    profiler='cprofile' writes pstats data (open with `python -m pstats` or
+    snakeviz); profiler='pyinstrument' writes an HTML report and requires
+    pyinstrument to be installed.
+    """
+    if profiler == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise ImportError("pyinstrument is not installed, use profiler='cprofile' or pip install pyinstrument")
+        session = Profiler()
+        session.start()
+        try:
+            yield
+        finally:
+            session.stop()
+            with open(output_filename, 'w') as f:
+                f.write(session.output_html())
+            logging.info("Saved pyinstrument profile to: {}".format(output_filename))
+    elif profiler == 'cprofile':
+        import cProfile
+        session = cProfile.Profile()
+        session.enable()
+        try:
+            yield
+        finally:
+            session.disable()
+            session.dump_stats(output_filename)
+            logging.info("Saved cProfile stats to: {}".format(output_filename))
+    else:
+        raise ValueError("unknown profiler {}".format(profiler))
@@ -0,0 +1,192 @@
+import argparse
+import logging
+
+import numpy as np
+
+logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+
+# Header of the pairs files written here, set_pairs_as_edges reads the first
+# line of a pairs file as its header.
+PAIRS_HEADER = 'pose1,pose2'
+
+
+def keyframe_indices(positions, spacing):
+    """Indices of the first pose after every `spacing` of travelled distance."""
+    steps = np.linalg.norm(np.diff(positions, axis=0), axis=1)
+    travelled = np.concatenate([[0.0], np.cumsum(steps)])
+    _, first = np.unique(np.floor(travelled / spacing), return_index=True)
+    return first
+
+
+def find_loop_closures(positions, quats, timestamps, radius=0.3, min_gap=10.0, max_angle=30.0, nms=2.0,
+                       keyframe_spacing=None):
+    """
+    Find loop-closure pairs: poses that are close in space but far apart in time.
+
+    The trajectory is first reduced to keyframes every keyframe_spacing of
+    travelled distance, otherwise the query is dominated by the neighbours of
+    each pose along its own track. All keyframe pairs within the radius come
+    from one cKDTree query, so no distance matrix is formed. They are then
+    filtered by time gap and orientation difference, reduced to the closest
+    earlier keyframe of every keyframe, and thinned by suppress_loop_closures.
+
+    Parameters:
+    positions (np.ndarray): (N, 3) pose positions.
+    quats (np.ndarray): (N, 4) pose quaternions, in any consistent component order.
+    timestamps (np.ndarray): (N,) pose timestamps in seconds.
+    radius (float): Maximum distance between the paired positions.
+    min_gap (float): Minimum time between the paired poses in seconds.
+    max_angle (float): Maximum orientation difference in degrees.
+    nms (float): Time window of the non-maximum suppression in seconds (0 to disable).
+    keyframe_spacing (float): Travelled distance between keyframes (default:
+        radius / 4, 0 to use every pose).
+
+    Returns:
+    np.ndarray: (M, 2) pose index pairs (i < j), ordered by i.
+    """
+    from scipy.spatial import cKDTree
+
+    positions = np.ascontiguousarray(positions, dtype=np.float64)
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    if keyframe_spacing is None:
+        keyframe_spacing = radius / 4.0
+    keyframes = keyframe_indices(positions, keyframe_spacing) if keyframe_spacing > 0 else np.arange(len(positions))
+
+    pairs = cKDTree(positions[keyframes]).query_pairs(radius, output_type='ndarray')
+    if len(pairs) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    i, j = np.sort(keyframes[pairs], axis=1).T
+    i, j = filter_loop_closures(i, j, quats, timestamps, min_gap, max_angle)
+    keep = nearest_loop_closures(i, j, positions)
+    i, j = i[keep], j[keep]
+
+    if nms > 0 and len(i):
+        keep = suppress_loop_closures(i, j, positions, timestamps, nms)
+        i, j = i[keep], j[keep]
+
+    order = np.lexsort((j, i))
+    return np.column_stack([i[order], j[order]])
+
+
+def filter_loop_closures(i, j, quats, timestamps, min_gap=10.0, max_angle=30.0):
+    """Keep the candidate pairs (i, j) that are min_gap seconds apart and within max_angle degrees."""
+    # temporally distant
+    keep = np.abs(timestamps[j] - timestamps[i]) >= min_gap
+    i, j = i[keep], j[keep]
+
+    # similar orientation: angle = 2 acos(|<q_i, q_j>|) for unit quaternions
+    quats = np.asarray(quats, dtype=np.float64)
+    qi = quats[i] / np.linalg.norm(quats[i], axis=1, keepdims=True)
+    qj = quats[j] / np.linalg.norm(quats[j], axis=1, keepdims=True)
+    dots = np.abs(np.einsum('ij,ij->i', qi, qj))
+    keep = dots >= np.cos(np.radians(max_angle) / 2.0)
+    return i[keep], j[keep]
+
+
+def nearest_loop_closures(i, j, positions):
+    """Indices of the pairs (i, j) whose i is the closest to j, one per j."""
+    distances = np.linalg.norm(positions[i] - positions[j], axis=1)
+    order = np.lexsort((distances, j))
+    _, first = np.unique(j[order], return_index=True)
+    return order[first]
+
+
+def loop_closure_neighbours(i, j, positions, timestamps, nms):
+    """
+    Pairs of loop-closure pairs within nms seconds of each other in both i and j.
+
+    Returns:
+    tuple of np.ndarray: the indices of the closer and of the farther pair of
+    every neighbourhood, ties broken by index.
+    """
+    from scipy.spatial import cKDTree
+
+    distances = np.linalg.norm(positions[i] - positions[j], axis=1)
+    rank = np.empty(len(distances), dtype=np.int64)
+    rank[np.argsort(distances, kind='stable')] = np.arange(len(distances))
+
+    neighbours = cKDTree(np.column_stack([timestamps[i], timestamps[j]])).query_pairs(nms, p=np.inf,
+                                                                                      output_type='ndarray')
+    if len(neighbours) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    a, b = neighbours.T
+    closer = rank[a] < rank[b]
+    return np.where(closer, a, b), np.where(closer, b, a)
+
+
+def suppress_loop_closures(i, j, positions, timestamps, nms, accepted=None):
+    """
+    Greedy non-maximum suppression of loop-closure pairs.
+
+    Pairs are accepted closest first, each suppressing the other pairs within
+    nms seconds of it in both i and j, so a revisit keeps its closest pair
+    and then one pair every nms seconds.
+
+    Parameters:
+    accepted (np.ndarray): optional (M,) boolean mask of pairs accepted
+        beforehand, which only suppress their neighbours.
+
+    Returns:
+    np.ndarray: indices of the kept pairs.
+    """
+    better, worse = loop_closure_neighbours(i, j, positions, timestamps, nms)
+
+    # Accepting every pair that is the closest of its undecided neighbours at
+    # once gives the same result as accepting them one by one.
+    kept = np.zeros(len(i), dtype=bool) if accepted is None else np.asarray(accepted, dtype=bool).copy()
+    undecided = ~kept
+    undecided[worse[kept[better]]] = False
+    undecided[better[kept[worse]]] = False
+    while undecided.any():
+        blocked = np.zeros(len(kept), dtype=bool)
+        blocked[worse[undecided[better] & undecided[worse]]] = True
+        best = undecided & ~blocked
+        kept[best] = True
+        undecided[best] = False
+        undecided[worse[best[better]]] = False
+        undecided[better[best[worse]]] = False
+    if accepted is not None:
+        kept &= ~np.asarray(accepted, dtype=bool)
+    return np.flatnonzero(kept)
+
+
+def write_pairs(filename, pairs):
+    """Write (M, 2) pose index pairs in the pairs.txt format read by set_pairs_as_edges."""
+    np.savetxt(filename, np.asarray(pairs, dtype=np.int64), fmt='%d', delimiter=',', header=PAIRS_HEADER,
+               comments='')
+    logging.info("Saved {} pairs to: {}".format(len(pairs), filename))
+
+
+def arposes_loop_closures(arposes_filename, **options):
+    """Loop-closure pairs of an ARposes file, see find_loop_closures for the options."""
+    from tools.trajectory import Trajectory
+
+    trajectory = Trajectory.from_arposes(arposes_filename)
+    pairs = find_loop_closures(trajectory.positions, trajectory.quats, trajectory.timestamps, **options)
+    logging.info("Found {} loop-closure pairs in {}".format(len(pairs), arposes_filename))
+    return pairs
+
+
+def add_loop_closure_arguments(parser):
+    parser.add_argument('--lc-radius', type=float, default=0.3, help='Maximum distance of loop-closure pairs')
+    parser.add_argument('--lc-min-gap', type=float, default=10.0, help='Minimum time between loop-closure pairs in seconds')
+    parser.add_argument('--lc-max-angle', type=float, default=30.0, help='Maximum orientation difference of loop-closure pairs in degrees')
+    parser.add_argument('--lc-nms', type=float, default=2.0, help='Keep the closest loop-closure pair within this many seconds (0: all)')
+
+
+def loop_closure_options(args):
+    return {'radius': args.lc_radius, 'min_gap': args.lc_min_gap, 'max_angle': args.lc_max_angle, 'nms': args.lc_nms}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate pairs.txt from the loop closures of an ARKit trajectory')
+    parser.add_argument('--arposes', type=str, required=True, help='Path to the ARposes txt file')
+    parser.add_argument('--output', type=str, required=True, help='Path to the output pairs.txt file')
+    add_loop_closure_arguments(parser)
+    args = parser.parse_args(argv)
+
+    write_pairs(args.output, arposes_loop_closures(args.arposes, **loop_closure_options(args)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+import argparse
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from tools.alignment import umeyama
+from tools.instrumentation import emit
+from tools.utils import (DEFAULT_INFORMATION, edges_to_array, information_upper_triangle, read_g2o_edges,
+                         read_g2o_vertices, write_g2o)
+
+logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+
+
+def partition_graph(num_nodes, src, dst, cluster_size=2000, overlap=2):
+    """
+    Split a pose graph into connected, overlapping clusters.
+
+    A Python-side equivalent of the Graclus cut of src/graph/graph_cut: the
+    nodes are ordered by reverse Cuthill-McKee, which follows the trajectory
+    and brings the nodes of a loop closure together, and cut into blocks of
+    cluster_size nodes. Every block is split into its connected pieces, small
+    pieces are merged into a neighbour, and the resulting cores are grown by
+    overlap hops into the neighbouring cores.
+
+    Parameters:
+    num_nodes (int): number of nodes, indexed 0..num_nodes-1 by src and dst.
+    cluster_size (int): number of nodes per block.
+    overlap (int): number of hops each core is grown by; with overlap >= 1
+        every edge lies inside at least one cluster.
+
+    Returns:
+    tuple: (N,) core cluster of every node and the (N, K) sparse membership
+    matrix of the grown clusters.
+    """
+    from scipy.sparse import coo_matrix, csr_matrix, identity
+    from scipy.sparse.csgraph import connected_components, reverse_cuthill_mckee
+
+    adjacency = coo_matrix((np.ones(len(src), dtype=bool), (src, dst)), shape=(num_nodes, num_nodes)).tocsr()
+    adjacency = adjacency + adjacency.T
+    order = reverse_cuthill_mckee(adjacency, symmetric_mode=True)
+    blocks = np.empty(num_nodes, dtype=np.int64)
+    blocks[order] = np.arange(num_nodes) // max(cluster_size, 1)
+
+    same = blocks[src] == blocks[dst]
+    inside = coo_matrix((np.ones(same.sum()), (src[same], dst[same])), shape=(num_nodes, num_nodes))
+    num_clusters, cores = connected_components(inside, directed=False)
+
+    # merge the pieces smaller than a quarter block into their most linked neighbour
+    while True:
+        sizes = np.bincount(cores)
+        cut = cores[src] != cores[dst]
+        a = np.concatenate([cores[src][cut], cores[dst][cut]])
+        b = np.concatenate([cores[dst][cut], cores[src][cut]])
+        small = sizes[a] < max(cluster_size // 4, 1)
+        if not small.any():
+            break
+        links = coo_matrix((np.ones(small.sum()), (a[small], b[small])), shape=(num_clusters, num_clusters)).tocsr()
+        fragments = np.unique(a[small])
+        targets = np.asarray(links[fragments].argmax(axis=1)).ravel()
+        merges = coo_matrix((np.ones(len(fragments)), (fragments, targets)), shape=(num_clusters, num_clusters))
+        num_clusters, groups = connected_components(merges, directed=False)
+        cores = groups[cores]
+
+    membership = csr_matrix((np.ones(num_nodes, dtype=bool), (np.arange(num_nodes), cores)),
+                            shape=(num_nodes, num_clusters))
+    hops = adjacency + identity(num_nodes, dtype=bool, format='csr')
+    for _ in range(overlap):
+        membership = (hops @ membership).astype(bool)
+    return cores, membership
+
+
+def align_cluster(rotations, positions, target_rotations, target_positions):
+    """
+    Rigid transformation of a cluster onto poses already in the merged frame.
+
+    The gauge of a cluster is a rigid motion of the world: a rotation G
+    applied to the right of its node rotations and to its positions, and a
+    translation of its positions, which leaves the relative poses seen from
+    each node unchanged. G is the Kabsch fit (tools.alignment.umeyama, as in
+    convertUTM.find_transformation) of the rows of the rotation matrices,
+    taken with both signs so that no translation is fitted.
+
+    Returns:
+    tuple of np.ndarray: (3, 3) rotation G and (3,) translation, such that
+    the cluster maps to node_rotations @ G.T and positions @ G.T + translation.
+    """
+    src = rotations.reshape(-1, 3)
+    dst = target_rotations.reshape(-1, 3)
+    gauge, _, _ = umeyama(np.concatenate([src, -src]), np.concatenate([dst, -dst]), with_scale=False)
+    return gauge, (target_positions - positions @ gauge.T).mean(axis=0)
+
+
+def _optimize_cluster(rows, ids, vertex_poses, information, options):
+    # Worker: only the edges and vertices of one cluster are sent and solved.
+    from tools.pose_graph import optimize_pose_graph
+    node_ids, poses, summary = optimize_pose_graph(rows, ids, vertex_poses, information, **options)
+    return node_ids, poses, summary
+
+
+def optimize_partitioned(edges, ids=None, vertex_poses=None, information=DEFAULT_INFORMATION, cluster_size=2000,
+                         overlap=2, workers=None, refine=False, **options):
+    """
+    Optimize a large pose graph by parts, as overlapping clusters in parallel.
+
+    The graph is split by partition_graph, every cluster is optimized with
+    optimize_pose_graph in a worker process, and the clusters are merged in
+    breadth-first order of the cluster graph: each is aligned by
+    align_cluster on its overlap with the clusters already merged, and
+    contributes the poses of its core nodes. The solver memory thus scales
+    with cluster_size rather than with the length of the scan. With refine,
+    the whole graph is optimized once more, warm-started from the merged poses.
+
+    Parameters:
+    edges (np.ndarray): edges of EDGE_DTYPE or (E, 9) rows.
+    ids (np.ndarray): (N,) ids of the vertex_poses.
+    vertex_poses (np.ndarray): (N, 7) initial poses as tx ty tz qx qy qz qw.
+    information: (6, 6), (E, 6, 6) or (E, 21) edge information, see information_upper_triangle.
+    cluster_size (int): number of nodes per cluster, before the overlap.
+    overlap (int): number of hops shared by neighbouring clusters.
+    workers (int): number of worker processes; 1 optimizes the clusters in this process.
+    refine (bool): optimize the whole graph from the merged poses.
+    options: further arguments of optimize_pose_graph, e.g. loss or method.
+
+    Returns:
+    tuple: sorted (N,) node ids, (N, 7) optimized poses as tx ty tz qx qy qz
+    qw and a summary dict.
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import breadth_first_order, connected_components
+    from scipy.spatial.transform import Rotation as R
+    from tools.pose_graph import optimize_pose_graph
+
+    start = time.perf_counter()
+    rows = edges_to_array(edges)
+    if np.shape(information) != (6, 6):
+        information = information_upper_triangle(information, len(rows))
+    keep = rows[:, 0] != rows[:, 1]
+    rows = rows[keep]
+    if np.shape(information) != (6, 6):
+        information = information[keep]
+
+    edge_ids = rows[:, :2].astype(np.int64)
+    vertex_ids = np.empty(0, dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+    node_ids = np.unique(np.concatenate([vertex_ids, edge_ids.ravel()]))
+    num_nodes = len(node_ids)
+    src = np.searchsorted(node_ids, edge_ids[:, 0])
+    dst = np.searchsorted(node_ids, edge_ids[:, 1])
+    if vertex_poses is not None and len(vertex_ids) == num_nodes:
+        vertex_poses = np.asarray(vertex_poses, dtype=np.float64)[np.argsort(vertex_ids)]
+    else:
+        vertex_poses = None
+
+    cores, membership = partition_graph(num_nodes, src, dst, cluster_size, overlap)
+    num_clusters = membership.shape[1]
+    columns = membership.tocsc()
+    cluster_nodes = np.split(columns.indices, columns.indptr[1:-1])
+    # (E, K) clusters holding both ends of every edge
+    incidence = membership[src].multiply(membership[dst]).tocsc()
+    cluster_edges = np.split(incidence.indices, incidence.indptr[1:-1])
+    logging.info("Partitioned {} nodes, {} edges into {} clusters of at most {} nodes".format(
+        num_nodes, len(rows), num_clusters, max(len(nodes) for nodes in cluster_nodes)))
+
+    def cluster_arguments(k):
+        nodes, selected = cluster_nodes[k], cluster_edges[k]
+        cluster_information = information if np.shape(information) == (6, 6) else information[selected]
+        cluster_poses = None if vertex_poses is None else vertex_poses[nodes]
+        return rows[selected], node_ids[nodes], cluster_poses, cluster_information, options
+
+    if workers == 1 or num_clusters == 1:
+        results = [_optimize_cluster(*cluster_arguments(k)) for k in range(num_clusters)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_optimize_cluster, *zip(*(cluster_arguments(k) for k in range(num_clusters)))))
+
+    # merge in breadth-first order over the clusters linked by cut edges
+    cut = cores[src] != cores[dst]
+    links = coo_matrix((np.ones(cut.sum()), (cores[src][cut], cores[dst][cut])), shape=(num_clusters, num_clusters))
+    _, cluster_labels = connected_components(links, directed=False)
+    _, roots = np.unique(cluster_labels, return_index=True)
+    order = np.concatenate([breadth_first_order(links, root, directed=False, return_predecessors=False)
+                            for root in roots])
+
+    node_rotations = np.broadcast_to(np.eye(3), (num_nodes, 3, 3)).copy()
+    node_positions = np.zeros((num_nodes, 3))
+    merged = np.zeros(num_nodes, dtype=bool)
+    for k in order:
+        result_ids, poses, _ = results[k]
+        nodes = np.searchsorted(node_ids, result_ids)
+        rotations = R.from_quat(poses[:, 3:]).as_matrix()
+        positions = poses[:, :3]
+        shared = merged[nodes]
+        if shared.any():
+            gauge, translation = align_cluster(rotations[shared], positions[shared],
+                                               node_rotations[nodes[shared]], node_positions[nodes[shared]])
+            rotations = rotations @ gauge.T
+            positions = positions @ gauge.T + translation
+        core = cores[nodes] == k
+        node_rotations[nodes[core]] = rotations[core]
+        node_positions[nodes[core]] = positions[core]
+        merged[nodes[core]] = True
+
+    poses = np.column_stack([node_positions, R.from_matrix(node_rotations).as_quat()])
+    summary = {'num_nodes': num_nodes, 'num_edges': len(rows), 'num_clusters': num_clusters,
+               'max_cluster_nodes': max(len(nodes) for nodes in cluster_nodes),
+               'max_cluster_edges': max(len(selected) for selected in cluster_edges),
+               'cluster_iterations': sum(summary['iterations'] for _, _, summary in results),
+               'merge_seconds': time.perf_counter() - start}
+    if refine:
+        _, poses, refined = optimize_pose_graph(rows, node_ids, poses, information, init='vertices', **options)
+        summary.update(refine_iterations=refined['iterations'], final_cost=refined['final_cost'])
+    summary['seconds'] = time.perf_counter() - start
+    logging.info("Optimized {} clusters in {:.2f}s".format(num_clusters, summary['seconds']))
+    emit(dict(summary, event='partition', cluster_size=cluster_size, overlap=overlap, refine=refine))
+    return node_ids, poses, summary
+
+
+def add_partition_arguments(parser):
+    parser.add_argument('--cluster-size', type=int, default=None,
+                        help='Optimize the graph by overlapping clusters of this many nodes (default: as one graph)')
+    parser.add_argument('--overlap', type=int, default=2, help='Number of hops shared by neighbouring clusters')
+    parser.add_argument('--partition-workers', type=int, default=None,
+                        help='Number of processes optimizing the clusters (default: one per CPU)')
+    parser.add_argument('--refine', action='store_true', help='Optimize the whole graph from the merged clusters')
+
+
+def partition_options(args):
+    if args.cluster_size is None:
+        return None
+    return {'cluster_size': args.cluster_size, 'overlap': args.overlap, 'workers': args.partition_workers,
+            'refine': args.refine}
+
+
+def main(argv=None):
+    from tools.pose_graph import LINEAR_SOLVERS, LOSSES, METHODS
+
+    parser = argparse.ArgumentParser(description='Optimize a large g2o pose graph by overlapping clusters in parallel')
+    parser.add_argument('--g2o_filename', '--g2o', dest='g2o', type=str, required=True,
+                        help='Path to the text or binary g2o graph, as for bin/position_estimator')
+    parser.add_argument('--output', type=str, default=None, help='Path to the optimized g2o graph (default: <g2o>.out)')
+    parser.add_argument('--loss', type=str, default='none', choices=LOSSES, help='Robust loss of the edge residuals')
+    parser.add_argument('--loss-scale', type=float, default=1.0,
+                        help='Whitened residual norm at which the robust loss departs from least squares')
+    parser.add_argument('--method', type=str, default='lm', choices=METHODS,
+                        help='Levenberg-Marquardt (lm) or Gauss-Newton (gn)')
+    parser.add_argument('--linear-solver', type=str, default='auto', choices=LINEAR_SOLVERS,
+                        help='Linear solver of every cluster, see tools.pose_graph')
+    parser.add_argument('--max-iterations', type=int, default=100, help='Maximum number of iterations per cluster')
+    add_partition_arguments(parser)
+    args = parser.parse_args(argv)
+
+    vertex_ids, vertex_poses = read_g2o_vertices(args.g2o)
+    edges, information = read_g2o_edges(args.g2o)
+    if args.cluster_size is None:
+        args.cluster_size = 2000
+    ids, poses, _ = optimize_partitioned(edges, vertex_ids, vertex_poses, information, loss=args.loss,
+                                         loss_scale=args.loss_scale, method=args.method,
+                                         linear_solver=args.linear_solver, max_iterations=args.max_iterations,
+                                         **partition_options(args))
+    write_g2o(args.output or args.g2o + '.out', poses, edges, information, ids=ids)
+
+
+if __name__ == '__main__':
+    main()
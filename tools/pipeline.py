@@ -0,0 +1,191 @@
+import argparse
+import contextlib
+import logging
+import os
+
+import numpy as np
+
+from tools.cache import cache_key, content_digest, lookup_columns, store_columns
+from tools.instrumentation import Instrumentation, profile
+from tools.utils import (DEFAULT_INFORMATION, arkittog2o, body_frame_edges, set_pairs_as_edges, pair_edges, g2o_binary_filename,
+                         read_g2o_vertices, write_arposes, convert_ARposes_to_ply)
+from tools.solver import POSITION_ESTIMATOR, estimate_positions, has_pygopt, run_position_estimator
+
+
+BACKENDS = ['auto', 'pygopt', 'subprocess', 'numpy']
+
+
+def adjusted_arposes_filename(arposes_filename):
+    return os.path.splitext(arposes_filename)[0] + '.adj' + '.txt'
+
+
+def adjusted_ply_filename(arposes_filename):
+    return os.path.splitext(adjusted_arposes_filename(arposes_filename))[0] + '.ply'
+
+
+def adjust_session(arposes_filename, pairs_filename, window=1, stride=1, binary=False, backend='auto',
+                   metrics_filename=None, cache=True, loop_closure=None, partition=None,
+                   cycle_filter=None):
+    """
+    Correct the drift of one ARKit session.
+
+    Runs conversion to g2o, the pair constraints, the solver, the conversion
+    back to ARposes and the PLY export, as adjust_ARkit_poses.py does.
+    Per-stage timings and peak memory are appended as JSON lines to
+    metrics_filename when given, see tools.instrumentation.
+
+    Without a pairs file, loop-closure pairs are detected with
+    tools.loop_closure, using the loop_closure options.
+
+    With cycle_filter options (see tools.cycle_consistency.filter_edges),
+    the pair edges inconsistent on short cycles are rejected or down-weighted
+    before the optimization. pygopt does not read edge weights, only the
+    rejection applies to it.
+
+    With partition options (see tools.partition.optimize_partitioned) the
+    graph is optimized by overlapping clusters in parallel, with the NumPy
+    backend.
+
+    With cache=True the edges and optimized poses are cached under the
+    content of the inputs and the options (see tools.cache); an unchanged
+    session only rewrites its outputs from the cache.
+
+    Returns:
+    dict: seconds spent in each stage.
+    """
+    from tools.cycle_consistency import filter_edges
+    from tools.loop_closure import arposes_loop_closures
+    from tools.partition import optimize_partitioned
+    from tools.trajectory import Trajectory
+
+    timer = Instrumentation(metrics_filename, session=arposes_filename)
+    g2o_filename = os.path.splitext(arposes_filename)[0] + '.g2o'
+    output_arposes_filename = adjusted_arposes_filename(arposes_filename)
+
+    if partition:
+        if backend not in ('auto', 'numpy'):
+            raise ValueError("partitioned optimization needs the numpy backend, got {}".format(backend))
+        backend = 'numpy'
+    if backend == 'auto':
+        if has_pygopt():
+            backend = 'pygopt'
+        else:
+            backend = 'subprocess' if os.path.exists(POSITION_ESTIMATOR) else 'numpy'
+
+    session_key = None
+    if cache:
+        with timer.stage('cache'):
+            pairs_key = content_digest(pairs_filename) if pairs_filename else ['loop_closure', loop_closure or {}]
+            session_key = cache_key(content_digest(arposes_filename), pairs_key, window, stride, backend, partition,
+                                    cycle_filter)
+            cached = lookup_columns(arposes_filename, 'session', session_key)
+        if cached is not None:
+            with timer.stage('g2o_to_arposes'):
+                write_arposes(output_arposes_filename, cached['ids'], cached['vertex_poses'],
+                              Trajectory.from_arposes(arposes_filename))
+            with timer.stage('ply'):
+                convert_ARposes_to_ply(output_arposes_filename)
+            timer.emit({'event': 'session', 'backend': backend, 'cached': True,
+                        'seconds': sum(timer.timings.values()), 'timings': timer.timings})
+            logging.info("Adjusted {} from the cache".format(arposes_filename))
+            return timer.timings
+
+    # step 1: convert ARkit poses to g2o format
+    with timer.stage('arkittog2o'):
+        trajectory, edges = arkittog2o(arposes_filename, window, stride, cache)
+
+    # step 2: add pairs as edges
+    with timer.stage('pairs'):
+        num_odometry_edges = len(edges)
+        if pairs_filename:
+            edges = set_pairs_as_edges(trajectory, edges, pairs_filename)
+        else:
+            pairs = arposes_loop_closures(arposes_filename, **(loop_closure or {}))
+            edges = np.concatenate([edges, pair_edges(trajectory, pairs[:, 0], pairs[:, 1])])
+
+    information = DEFAULT_INFORMATION
+    if cycle_filter:
+        with timer.stage('cycle_filter'):
+            candidates = np.arange(len(edges)) >= num_odometry_edges
+            edges, information, _ = filter_edges(edges, candidates, information, np.arange(len(trajectory)),
+                                                 trajectory.poses, **cycle_filter)
+
+    if backend in ('pygopt', 'numpy'):
+        # step 3-5: optimize in-process and save the adjusted ARkit poses
+        with timer.stage('solver'):
+            if backend == 'pygopt':
+                ids, vertex_poses = estimate_positions(edges)
+            elif partition:
+                ids, vertex_poses, _ = optimize_partitioned(
+                    body_frame_edges(edges, trajectory.rotations), np.arange(len(trajectory)), trajectory.poses,
+                    information, **partition)
+            else:
+                from tools.pose_graph import optimize_pose_graph
+                ids, vertex_poses, _ = optimize_pose_graph(
+                    body_frame_edges(edges, trajectory.rotations), np.arange(len(trajectory)), trajectory.poses,
+                    information)
+        with timer.stage('g2o_to_arposes'):
+            write_arposes(output_arposes_filename, ids, vertex_poses, trajectory)
+    else:
+        # step 3: create and save g2o file
+        with timer.stage('write_g2o'):
+            trajectory.to_g2o(g2o_filename, edges, information, binary_sidecar=binary)
+        if binary:
+            g2o_filename = g2o_binary_filename(g2o_filename)
+
+        # step 4: run graph translation optimization
+        with timer.stage('solver'):
+            g2o_output_filename = run_position_estimator(g2o_filename)
+
+        # step 5: convert g2o back to ARkit poses
+        with timer.stage('g2o_to_arposes'):
+            ids, vertex_poses = read_g2o_vertices(g2o_output_filename)
+            write_arposes(output_arposes_filename, ids, vertex_poses, trajectory)
+
+    if session_key is not None:
+        with timer.stage('cache'):
+            store_columns(arposes_filename, 'session', session_key,
+                          {'edges': edges, 'ids': ids, 'vertex_poses': vertex_poses})
+
+    # step 6: convert ARkit poses to ply
+    with timer.stage('ply'):
+        convert_ARposes_to_ply(output_arposes_filename, cache=cache)
+
+    total = sum(timer.timings.values())
+    timer.emit({'event': 'session', 'backend': backend, 'cached': False, 'seconds': total, 'timings': timer.timings})
+    logging.info("Adjusted {} in {:.2f}s".format(arposes_filename, total))
+    return timer.timings
+
+
+def main(argv=None):
+    from tools.cycle_consistency import add_cycle_arguments, cycle_options
+    from tools.loop_closure import add_loop_closure_arguments, loop_closure_options
+    from tools.partition import add_partition_arguments, partition_options
+
+    parser = argparse.ArgumentParser(description='Correct the drift of an ARKit session with pairs from the point cloud')
+    parser.add_argument('--arposes', type=str, required=True, help='Path to ARKit data folder')
+    parser.add_argument('--pairs', type=str, default=None, help='Path to pairs.txt file (default: detect loop closures)')
+    parser.add_argument('--window', type=int, default=1, help='Number of successive poses each pose is connected to by odometry edges')
+    parser.add_argument('--stride', type=int, default=1, help='Frame step between poses connected by odometry edges')
+    parser.add_argument('--binary', action='store_true', help='Exchange the graph with the solver through the binary g2o format')
+    parser.add_argument('--backend', type=str, default='auto', choices=BACKENDS,
+                        help='Run the solver in-process through pygopt, as bin/position_estimator or with the NumPy pose-graph '
+                             'optimizer (auto: pygopt when built, else bin/position_estimator when present, else numpy)')
+    parser.add_argument('--metrics', type=str, default=None, help='Append per-stage timings and peak memory as JSON lines to this file')
+    parser.add_argument('--no-cache', action='store_true', help='Neither read nor write the .gopt_cache next to the inputs')
+    parser.add_argument('--profile', type=str, default=None, help='Profile the run and save the profile to this file')
+    parser.add_argument('--profiler', type=str, default='cprofile', choices=['cprofile', 'pyinstrument'],
+                        help='Profiler used with --profile')
+    add_loop_closure_arguments(parser)
+    add_cycle_arguments(parser)
+    add_partition_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with profile(args.profile, args.profiler) if args.profile else contextlib.nullcontext():
+        adjust_session(args.arposes, args.pairs, args.window, args.stride, args.binary, args.backend, args.metrics,
+                       not args.no_cache, loop_closure_options(args), partition_options(args),
+                       cycle_options(args))
+
+
+if __name__ == '__main__':
+    main()
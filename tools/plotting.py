@@ -0,0 +1,211 @@
+import argparse
+import logging
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from tools.ply import tracking_status_colors
+from tools.trajectory import Trajectory
+
+logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+
+DEFAULT_MAX_POINTS = 50000
+
+
+def get_pyplot(headless=None):
+    """
+    Import pyplot, selecting the offscreen Agg backend when headless.
+
+    headless=None picks Agg when no display is available.
+    """
+    import matplotlib
+    if headless is None:
+        headless = os.name != 'nt' and not os.environ.get('DISPLAY') and not os.environ.get('WAYLAND_DISPLAY')
+    if headless:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def read_arposes_table(file_path):
+    """Read an ARposes file as (N, 3) positions and the (N,) tracking status (None when absent)."""
+    trajectory = Trajectory.from_arposes(file_path)
+    return trajectory.positions, trajectory.tracking_status
+
+
+def read_anchors_table(file_path):
+    """Read the (N, 3) anchor positions of an Anchors file."""
+    data = pd.read_csv(file_path)
+    return data.iloc[:, 2:5].to_numpy(dtype=np.float64)
+
+
+def decimate(points, voxel_size=None, stride=1, max_points=None):
+    """
+    Indices of a display subset of the points.
+
+    Parameters:
+    points (np.ndarray): (N, 3) points.
+    voxel_size (float): keep the first point of every occupied voxel.
+    stride (int): keep every stride-th point.
+    max_points (int): further stride the subset down to at most this many points.
+
+    Returns:
+    np.ndarray: sorted indices of the kept points.
+    """
+    indices = np.arange(0, len(points), max(stride, 1))
+    if voxel_size:
+        voxels = np.floor(points[indices] / voxel_size).astype(np.int64)
+        _, first = np.unique(voxels, axis=0, return_index=True)
+        indices = indices[np.sort(first)]
+    if max_points and len(indices) > max_points:
+        indices = indices[::int(np.ceil(len(indices) / max_points))]
+    return indices
+
+
+def status_colors(status):
+    """(N, 3) RGB colors in [0, 1] from ARKit tracking status, as in the PLY export."""
+    colors = tracking_status_colors(status)
+    return np.column_stack([colors['red'], colors['green'], colors['blue']]) / 255.0
+
+
+def correction_magnitude(original, adjusted):
+    """Per-pose distance between the original and the optimized positions."""
+    if len(original) != len(adjusted):
+        raise ValueError("{} original and {} adjusted poses".format(len(original), len(adjusted)))
+    return np.linalg.norm(adjusted - original, axis=1)
+
+
+def plot_points(points, colors=None, values=None, title='3D Plot of AR Poses', output=None, show=False,
+                headless=None, marker_size=1):
+    """
+    Scatter points in 3D with equal axis ranges.
+
+    Parameters:
+    points (np.ndarray): (N, 3) points, already decimated.
+    colors (np.ndarray): optional (N, 3) RGB colors in [0, 1].
+    values (np.ndarray): optional (N,) values drawn with a colorbar.
+    output (str): save the figure to this path.
+    show (bool): open an interactive window.
+    """
+    plt = get_pyplot(headless)
+
+    # Calculate the range for each axis and find the center point
+    max_range = (points.max(axis=0) - points.min(axis=0)).max() / 2.0
+    mid = (points.max(axis=0) + points.min(axis=0)) * 0.5
+
+    fig = plt.figure(figsize=(12, 8))
+    ax = fig.add_subplot(111, projection='3d')
+
+    # Set the limits for each axis to the same range
+    ax.set_xlim(mid[0] - max_range, mid[0] + max_range)
+    ax.set_ylim(mid[1] - max_range, mid[1] + max_range)
+    ax.set_zlim(mid[2] - max_range, mid[2] + max_range)
+
+    if values is not None:
+        scatter = ax.scatter(points[:, 0], points[:, 1], points[:, 2], c=values, cmap='viridis', marker='o',
+                             s=marker_size)
+        fig.colorbar(scatter, ax=ax, label='Correction')
+    else:
+        ax.scatter(points[:, 0], points[:, 1], points[:, 2], c='blue' if colors is None else colors, marker='o',
+                   s=marker_size)
+    ax.set_title(title)
+    ax.set_xlabel('X Coordinate')
+    ax.set_ylabel('Y Coordinate')
+    ax.set_zlabel('Z Coordinate')
+
+    if output:
+        fig.savefig(output, dpi=100)
+    if show:
+        plt.show()
+    plt.close(fig)
+
+
+def render_arposes(arposes_filename, output=None, color_by='none', voxel_size=None, stride=1,
+                   max_points=DEFAULT_MAX_POINTS, show=False, headless=None):
+    """
+    Render the trajectory of an ARposes file.
+
+    color_by is 'none', 'status' (ARKit tracking status) or 'correction'
+    (distance to the optimized poses in the adjusted ARposes file, which is
+    also the trajectory drawn).
+    """
+    positions, status = read_arposes_table(arposes_filename)
+    colors = values = None
+    if color_by == 'correction':
+        from tools.pipeline import adjusted_arposes_filename
+        adjusted, _ = read_arposes_table(adjusted_arposes_filename(arposes_filename))
+        correction = correction_magnitude(positions, adjusted)
+        positions = adjusted
+    elif color_by == 'status' and status is None:
+        raise ValueError("{} has no tracking status column".format(arposes_filename))
+
+    indices = decimate(positions, voxel_size, stride, max_points)
+    if color_by == 'correction':
+        values = correction[indices]
+    elif color_by == 'status':
+        colors = status_colors(status[indices])
+
+    plot_points(positions[indices], colors, values, output=output, show=show, headless=headless)
+
+
+def _render_job(arposes_filename, output, options):
+    try:
+        render_arposes(arposes_filename, output, headless=True, **options)
+        return arposes_filename, None
+    except Exception as e:
+        return arposes_filename, "{}: {}\n{}".format(type(e).__name__, e, traceback.format_exc())
+
+
+def render_batch(jobs, workers=None, **options):
+    """
+    Render many (arposes, png) jobs to PNG across a process pool.
+
+    Returns:
+    dict: failed ARposes files mapped to their errors.
+    """
+    failures = dict()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_render_job, arposes, output, options) for arposes, output in jobs]
+        for future in as_completed(futures):
+            arposes, error = future.result()
+            if error:
+                logging.error("failed {}: {}".format(arposes, error))
+                failures[arposes] = error
+            else:
+                logging.info("rendered {}".format(arposes))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render ARKit trajectories to PNG')
+    parser.add_argument('arposes', type=str, nargs='+', help='ARposes files to render')
+    parser.add_argument('--output-dir', type=str, default=None, help='Folder of the PNG files (default: next to each ARposes file)')
+    parser.add_argument('--color-by', type=str, default='none', choices=['none', 'status', 'correction'],
+                        help='Color by tracking status or by the correction of the adjusted poses')
+    parser.add_argument('--voxel', type=float, default=None, help='Voxel size of the display decimation')
+    parser.add_argument('--stride', type=int, default=1, help='Display every stride-th pose')
+    parser.add_argument('--max-points', type=int, default=DEFAULT_MAX_POINTS, help='Maximum number of displayed poses')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: CPU count)')
+    args = parser.parse_args(argv)
+
+    jobs = list()
+    for arposes in args.arposes:
+        output = arposes + '.png'
+        if args.output_dir:
+            # Name after the session folder, so several ARposes.txt do not collide.
+            name = os.path.basename(os.path.dirname(os.path.abspath(arposes))) or 'session'
+            output = os.path.join(args.output_dir, name + '.png')
+        jobs.append((arposes, output))
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    failures = render_batch(jobs, args.workers, color_by=args.color_by, voxel_size=args.voxel, stride=args.stride,
+                            max_points=args.max_points)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,197 @@
+import argparse
+import itertools
+import logging
+
+import numpy as np
+
+# numpy dtype -> PLY scalar type
+PLY_TYPES = {
+    np.dtype('int8'): 'char',
+    np.dtype('uint8'): 'uchar',
+    np.dtype('int16'): 'short',
+    np.dtype('uint16'): 'ushort',
+    np.dtype('int32'): 'int',
+    np.dtype('uint32'): 'uint',
+    np.dtype('float32'): 'float',
+    np.dtype('float64'): 'double',
+}
+
+# PLY scalar type -> numpy dtype, with the sized type names also found in PLY files
+PLY_NAMES = dict({name: dtype for dtype, name in PLY_TYPES.items()},
+                 int8=np.dtype('int8'), uint8=np.dtype('uint8'), int16=np.dtype('int16'), uint16=np.dtype('uint16'),
+                 int32=np.dtype('int32'), uint32=np.dtype('uint32'), float32=np.dtype('float32'),
+                 float64=np.dtype('float64'))
+
+# printf formats of the PLY scalar types for ASCII output
+PLY_ASCII_FORMATS = {
+    'char': '%d', 'uchar': '%d', 'short': '%d', 'ushort': '%d', 'int': '%d', 'uint': '%d',
+    'float': '%.9g', 'double': '%.17g',
+}
+
+NORMAL_TRACKING_STATES = ('tracking', 'normal')
+NORMAL_TRACKING_COLOR = (0, 255, 0)
+LIMITED_TRACKING_COLOR = (255, 0, 0)
+
+
+def _ply_dtype(array):
+    # PLY has no 64-bit integers or booleans.
+    if array.dtype == np.bool_:
+        return np.dtype('uint8')
+    if array.dtype.kind in 'iu' and array.dtype.itemsize == 8:
+        return np.dtype('int32') if array.dtype.kind == 'i' else np.dtype('uint32')
+    if array.dtype not in PLY_TYPES:
+        raise TypeError("cannot store {} values in a PLY property".format(array.dtype))
+    return array.dtype
+
+
+def ply_vertices(points, properties=None, double=False):
+    """
+    Pack the points and optional per-vertex properties into one structured array.
+
+    Parameters:
+    points (np.ndarray): (N, 3) vertex positions, stored as float x, y, z.
+    properties (dict): property name -> (N,) array, written in insertion order.
+    double (bool): store the positions as double instead of float.
+
+    Returns:
+    np.ndarray: little-endian structured array with one field per PLY property.
+    """
+    points = np.asarray(points, dtype=np.float64 if double else np.float32).reshape(-1, 3)
+    columns = [('x', points[:, 0]), ('y', points[:, 1]), ('z', points[:, 2])]
+    for name, values in (properties or {}).items():
+        values = np.asarray(values)
+        if values.shape != (len(points),):
+            raise ValueError("property {} must have shape ({},), got {}".format(name, len(points), values.shape))
+        columns.append((name, values.astype(_ply_dtype(values))))
+
+    dtype = np.dtype([(name, values.dtype.newbyteorder('<')) for name, values in columns])
+    vertices = np.empty(len(points), dtype=dtype)
+    for name, values in columns:
+        vertices[name] = values
+    return vertices
+
+
+def ply_header(vertices, binary):
+    lines = ["ply",
+             "format {} 1.0".format('binary_little_endian' if binary else 'ascii'),
+             "element vertex {}".format(len(vertices))]
+    for name in vertices.dtype.names:
+        lines.append("property {} {}".format(PLY_TYPES[vertices.dtype[name].newbyteorder('=')], name))
+    lines.append("end_header")
+    return "\n".join(lines) + "\n"
+
+
+# Function to write PLY file
+def write_ply(filename, points, properties=None, binary=False, chunk_size=100000, double=False):
+    """
+    Write points and optional per-vertex properties (see ply_vertices) to a PLY file.
+
+    The file is ASCII by default; binary=True dumps the vertex array with a
+    single write in the binary_little_endian format. double=True keeps the
+    full precision of the positions.
+    """
+    vertices = ply_vertices(points, properties, double)
+    header = ply_header(vertices, binary)
+    logging.info("saving {} vertices to: {}".format(len(vertices), filename))
+
+    if binary:
+        with open(filename, 'wb') as f:
+            f.write(header.encode('ascii'))
+            vertices.tofile(f)
+        return
+
+    line_format = " ".join(PLY_ASCII_FORMATS[PLY_TYPES[vertices.dtype[name].newbyteorder('=')]]
+                           for name in vertices.dtype.names) + "\n"
+    with open(filename, 'w', buffering=1 << 20) as f:
+        f.write(header)
+        for start in range(0, len(vertices), chunk_size):
+            rows = vertices[start:start + chunk_size].tolist()
+            f.write((line_format * len(rows)) % tuple(itertools.chain.from_iterable(rows)))
+
+
+def _read_ply_header(f):
+    # Returns the format, the vertex count and the vertex dtype; the vertex
+    # element must come first and hold scalar properties only.
+    if f.readline().strip() != b'ply':
+        raise ValueError("{} is not a PLY file".format(f.name))
+    ply_format = None
+    elements = list()
+    fields = list()
+    for line in iter(f.readline, b''):
+        words = line.decode('ascii').split()
+        if not words or words[0] in ('comment', 'obj_info'):
+            continue
+        if words[0] == 'end_header':
+            break
+        if words[0] == 'format':
+            ply_format = words[1]
+        elif words[0] == 'element':
+            elements.append((words[1], int(words[2])))
+        elif words[0] == 'property' and len(elements) == 1:
+            if words[1] == 'list':
+                raise ValueError("list property {} is not supported".format(words[-1]))
+            fields.append((words[2], PLY_NAMES[words[1]].newbyteorder('<')))
+    if not elements or elements[0][0] != 'vertex':
+        raise ValueError("{} does not start with a vertex element".format(f.name))
+    if ply_format not in ('ascii', 'binary_little_endian'):
+        raise ValueError("unsupported PLY format {} in {}".format(ply_format, f.name))
+    return ply_format, elements[0][1], np.dtype(fields)
+
+
+def read_ply(filename, mmap=False):
+    """
+    Read the vertices of an ASCII or binary_little_endian PLY file, as written by write_ply.
+
+    Returns:
+    np.ndarray: structured array with one field per vertex property, a
+    read-only memory map for binary files with mmap=True.
+    """
+    with open(filename, 'rb') as f:
+        ply_format, count, dtype = _read_ply_header(f)
+        offset = f.tell()
+        if ply_format == 'ascii':
+            rows = np.loadtxt(f, ndmin=2, max_rows=count) if count else np.empty((0, len(dtype)))
+            vertices = np.empty(count, dtype=dtype)
+            for column, name in enumerate(dtype.names):
+                vertices[name] = rows[:, column]
+            return vertices
+        if not mmap or count == 0:
+            return np.fromfile(f, dtype=dtype, count=count)
+    return np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=(count,))
+
+
+def tracking_status_colors(tracking_status):
+    """
+    Color vertices by ARKit tracking status: green when tracking is normal, red otherwise.
+
+    Returns:
+    dict: red, green and blue uchar properties for write_ply.
+    """
+    status = np.char.lower(np.asarray(tracking_status).astype(str))
+    normal = np.isin(status, NORMAL_TRACKING_STATES)
+    colors = np.where(normal[:, None], NORMAL_TRACKING_COLOR, LIMITED_TRACKING_COLOR).astype(np.uint8)
+    return {'red': colors[:, 0], 'green': colors[:, 1], 'blue': colors[:, 2]}
+
+
+def add_ply_arguments(parser):
+    parser.add_argument('--binary', action='store_true', help='Write a binary_little_endian PLY file instead of ASCII')
+    parser.add_argument('--double', action='store_true', help='Store the vertex positions as double instead of float')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export the positions of an ARposes file to PLY')
+    parser.add_argument('--arposes', type=str, required=True, help='Path to ARKit data folder')
+    parser.add_argument('--colors', action='store_true', help='Color the vertices by tracking status')
+    parser.add_argument('--orientation', action='store_true', help='Store the orientation quaternion of each pose')
+    parser.add_argument('--timestamps', action='store_true', help='Store the timestamp of each pose')
+    add_ply_arguments(parser)
+    args = parser.parse_args(argv)
+
+    # Imported here: tools.utils depends on this module and on pandas.
+    from tools.utils import convert_ARposes_to_ply
+    convert_ARposes_to_ply(args.arposes, args.binary, args.colors, args.orientation, args.timestamps,
+                           double=args.double)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,391 @@
+import argparse
+import logging
+import time
+
+import numpy as np
+from scipy.sparse import coo_matrix, diags
+from scipy.sparse.csgraph import breadth_first_order, connected_components, reverse_cuthill_mckee
+from scipy.sparse.linalg import cg, splu
+from scipy.spatial.transform import Rotation as R
+
+from tools.instrumentation import emit
+from tools.utils import (DEFAULT_INFORMATION, edges_to_array, information_upper_triangle, read_g2o_edges,
+                         read_g2o_vertices, write_g2o)
+
+# The sparse Cholesky factorization of CHOLMOD is used when scikit-sparse is
+# installed, otherwise the normal equations are factorized with SuperLU.
+try:
+    from sksparse.cholmod import cholesky as cholmod_cholesky
+except ImportError:
+    cholmod_cholesky = None
+
+logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+
+LOSSES = ['none', 'huber', 'cauchy', 'soft_l1']
+LINEAR_SOLVERS = ['auto', 'cholesky', 'cg']
+# With linear_solver='auto', graphs whose normal equations would fill more
+# entries than this in a banded factorization are solved with CG instead.
+DIRECT_SOLVER_MAX_FILL = 20000000
+METHODS = ['lm', 'gn']
+
+
+def robust_loss(squared_norms, loss='none', scale=1.0):
+    """
+    Evaluate a robust loss on squared residual norms, as Ceres' loss functions.
+
+    Returns:
+    tuple of np.ndarray: rho(s) and its derivative rho'(s), the weight of
+    each residual in iteratively reweighted least squares.
+    """
+    s = np.asarray(squared_norms, dtype=np.float64)
+    b = scale ** 2
+    if loss == 'none':
+        return s, np.ones_like(s)
+    if loss == 'huber':
+        inlier = s <= b
+        root = np.sqrt(np.maximum(s, b))
+        return np.where(inlier, s, 2.0 * scale * root - b), np.where(inlier, 1.0, scale / root)
+    if loss == 'cauchy':
+        return b * np.log1p(s / b), 1.0 / (1.0 + s / b)
+    if loss == 'soft_l1':
+        root = np.sqrt(1.0 + s / b)
+        return 2.0 * b * (root - 1.0), 1.0 / root
+    raise ValueError("unknown loss {}, expected one of {}".format(loss, LOSSES))
+
+
+def _skew(vectors):
+    skew = np.zeros(vectors.shape[:-1] + (3, 3))
+    skew[..., 0, 1], skew[..., 0, 2] = -vectors[..., 2], vectors[..., 1]
+    skew[..., 1, 0], skew[..., 1, 2] = vectors[..., 2], -vectors[..., 0]
+    skew[..., 2, 0], skew[..., 2, 1] = -vectors[..., 1], vectors[..., 0]
+    return skew
+
+
+def left_jacobian_inverse(rotvecs):
+    """Inverse of the left Jacobian of SO(3) at (E, 3) rotation vectors; the right one is at -rotvecs."""
+    theta = np.linalg.norm(rotvecs, axis=-1)
+    skew = _skew(rotvecs)
+    small = theta < 1e-6
+    safe = np.where(small, 1.0, theta)
+    coefficient = np.where(small, 1.0 / 12.0,
+                           1.0 / safe ** 2 - (1.0 + np.cos(safe)) / (2.0 * safe * np.sin(safe)))
+    return np.eye(3) - 0.5 * skew + coefficient[:, None, None] * (skew @ skew)
+
+
+def whitening(information, num_edges):
+    """
+    Square roots L^T of the edge information matrices, such that L L^T = information.
+
+    All-zero matrices, as written by ViewGraph::WriteG2OFile, stand for unit
+    information.
+
+    Returns:
+    np.ndarray: (num_edges, 6, 6) upper-triangular matrices.
+    """
+    upper = information_upper_triangle(information, num_edges)
+    rows, cols = np.triu_indices(6)
+    matrices = np.zeros((num_edges, 6, 6))
+    matrices[:, rows, cols] = upper
+    matrices[:, cols, rows] = upper
+    matrices[~upper.any(axis=1)] = np.eye(6)
+    try:
+        return np.swapaxes(np.linalg.cholesky(matrices), 1, 2)
+    except np.linalg.LinAlgError:
+        raise ValueError("edge information matrices must be positive definite")
+
+
+def initialize_from_tree(num_nodes, src, dst, rotations, translations, roots, world_frame=False):
+    """
+    Chain the relative poses along a breadth-first spanning tree from each root.
+
+    As ViewGraph::InitializeGlobalRotationsFromMST, every node gets the pose
+    of its tree parent composed with the relative pose of the tree edge. The
+    edge translations are in the frame of their source, as in
+    optimize_pose_graph, or with world_frame=True the position differences
+    of relative_pose_edges.
+
+    Returns:
+    tuple of np.ndarray: (N, 3, 3) rotations and (N, 3) positions.
+    """
+    # index + 1 of the first edge between two nodes, negative against its direction
+    pairs, first = np.unique(np.column_stack([src, dst]), axis=0, return_index=True)
+    links = coo_matrix((np.concatenate([first + 1, -(first + 1)]),
+                        (np.concatenate([pairs[:, 0], pairs[:, 1]]), np.concatenate([pairs[:, 1], pairs[:, 0]]))),
+                       shape=(num_nodes, num_nodes)).tocsr()
+
+    node_rotations = np.broadcast_to(np.eye(3), (num_nodes, 3, 3)).copy()
+    node_positions = np.zeros((num_nodes, 3))
+    for root in roots:
+        order, predecessors = breadth_first_order(links, root, directed=False)
+        for node in order[1:]:
+            parent = predecessors[node]
+            edge = int(links[parent, node])
+            if edge > 0:
+                node_rotations[node] = rotations[edge - 1] @ node_rotations[parent]
+                translation = translations[edge - 1] if world_frame else \
+                    node_rotations[parent].T @ translations[edge - 1]
+                node_positions[node] = node_positions[parent] + translation
+            else:
+                node_rotations[node] = rotations[-edge - 1].T @ node_rotations[parent]
+                translation = translations[-edge - 1] if world_frame else \
+                    node_rotations[node].T @ translations[-edge - 1]
+                node_positions[node] = node_positions[parent] - translation
+    return node_rotations, node_positions
+
+
+def _residuals(node_rotations, node_positions, src, dst, rotations, translations, sqrt_information):
+    errors = rotations @ node_rotations[src] @ np.swapaxes(node_rotations[dst], 1, 2)
+    rotation_errors = R.from_matrix(errors).as_rotvec()
+    # the position difference seen from the source, R_src (p_dst - p_src)
+    relative_positions = np.einsum('eij,ej->ei', node_rotations[src], node_positions[dst] - node_positions[src])
+    residuals = np.concatenate([relative_positions - translations, rotation_errors], axis=1)
+    return np.einsum('eij,ej->ei', sqrt_information, residuals), rotation_errors, relative_positions
+
+
+def _normal_equations(num_nodes, src, dst, node_rotations, rotations, rotation_errors, relative_positions,
+                      sqrt_information, whitened, weights):
+    num_edges = len(src)
+    # Jacobian blocks of the [translation, rotation] residual with respect to
+    # the [position, rotation] update of the source and of the destination;
+    # rotating the source by exp(w) turns R_src (p_dst - p_src) by w.
+    jacobian_src = np.zeros((num_edges, 6, 6))
+    jacobian_dst = np.zeros((num_edges, 6, 6))
+    jacobian_src[:, :3, :3] = -node_rotations[src]
+    jacobian_dst[:, :3, :3] = node_rotations[src]
+    jacobian_src[:, :3, 3:] = -_skew(relative_positions)
+    jacobian_src[:, 3:, 3:] = left_jacobian_inverse(rotation_errors) @ rotations
+    jacobian_dst[:, 3:, 3:] = -left_jacobian_inverse(-rotation_errors)
+    jacobian_src = sqrt_information @ jacobian_src
+    jacobian_dst = sqrt_information @ jacobian_dst
+
+    weighted_src = weights[:, None, None] * jacobian_src
+    weighted_dst = weights[:, None, None] * jacobian_dst
+    blocks = [(src, src, np.swapaxes(weighted_src, 1, 2) @ jacobian_src),
+              (src, dst, np.swapaxes(weighted_src, 1, 2) @ jacobian_dst),
+              (dst, src, np.swapaxes(weighted_dst, 1, 2) @ jacobian_src),
+              (dst, dst, np.swapaxes(weighted_dst, 1, 2) @ jacobian_dst)]
+    offsets = np.arange(6)
+    rows = np.concatenate([(6 * a[:, None, None] + offsets[None, :, None]).repeat(6, axis=2).ravel()
+                           for a, _, _ in blocks])
+    cols = np.concatenate([(6 * b[:, None, None] + offsets[None, None, :]).repeat(6, axis=1).ravel()
+                           for _, b, _ in blocks])
+    values = np.concatenate([block.ravel() for _, _, block in blocks])
+    hessian = coo_matrix((values, (rows, cols)), shape=(6 * num_nodes, 6 * num_nodes)).tocsr()
+
+    gradient_src = np.einsum('eji,ej->ei', weighted_src, whitened)
+    gradient_dst = np.einsum('eji,ej->ei', weighted_dst, whitened)
+    indices = np.concatenate([(6 * src[:, None] + offsets).ravel(), (6 * dst[:, None] + offsets).ravel()])
+    gradient = np.bincount(indices, np.concatenate([gradient_src.ravel(), gradient_dst.ravel()]),
+                           minlength=6 * num_nodes)
+    return hessian, gradient
+
+
+def select_linear_solver(hessian):
+    """
+    Pick the direct solver for graphs of low bandwidth, like ARKit trajectories
+    and their loop closures, and CG for the well-connected others.
+
+    The bandwidth after a reverse Cuthill-McKee ordering bounds the fill of
+    the factorization, CG on the other hand needs many iterations on long
+    chains but few on well-connected graphs.
+    """
+    permutation = reverse_cuthill_mckee(hessian.tocsr(), symmetric_mode=True)
+    position = np.empty_like(permutation)
+    position[permutation] = np.arange(len(permutation))
+    structure = hessian.tocoo()
+    bandwidth = np.abs(position[structure.row] - position[structure.col]).max(initial=0)
+    return 'cholesky' if hessian.shape[0] * (bandwidth + 1) <= DIRECT_SOLVER_MAX_FILL else 'cg'
+
+
+def solve_normal_equations(hessian, rhs, linear_solver='cholesky'):
+    """Solve the sparse symmetric positive definite system hessian x = rhs."""
+    if linear_solver == 'cholesky':
+        if cholmod_cholesky is not None:
+            return cholmod_cholesky(hessian.tocsc())(rhs)
+        return splu(hessian.tocsc(), permc_spec='MMD_AT_PLUS_A').solve(rhs)
+    if linear_solver == 'cg':
+        diagonal = hessian.diagonal()
+        solution, _ = cg(hessian, rhs, rtol=1e-10, maxiter=10 * len(rhs),
+                         M=diags(1.0 / np.where(diagonal > 0, diagonal, 1.0)))
+        return solution
+    raise ValueError("unknown linear solver {}, expected one of {}".format(linear_solver, LINEAR_SOLVERS))
+
+
+def optimize_pose_graph(edges, ids=None, vertex_poses=None, information=DEFAULT_INFORMATION, loss='none',
+                        loss_scale=1.0, method='lm', linear_solver='auto', max_iterations=100,
+                        function_tolerance=1e-10, parameter_tolerance=1e-8, init='auto', verbose=False):
+    """
+    Optimize the vertex poses of a pose graph with sparse Gauss-Newton or Levenberg-Marquardt.
+
+    Edges are SE(3) relative poses, as read from g2o graphs by
+    bin/position_estimator: the rotation of dst is the edge rotation times
+    the rotation of src, and the edge translation is the position of dst
+    seen from src, R_src (p_dst - p_src). The vertex rotations thus map the
+    world to the camera, as the global rotations of ViewGraph; with the
+    camera-to-world rotations this is g2o's R_src^T (p_dst - p_src). The
+    world-frame translations of relative_pose_edges are rotated into this
+    frame by body_frame_edges. The residual of an edge is
+    whitened by its information matrix (translation block first, as in g2o)
+    and robustified by the loss, with iteratively reweighted least squares.
+    One vertex per connected component is held fixed.
+
+    Parameters:
+    edges (np.ndarray): edges of EDGE_DTYPE or (E, 9) rows.
+    ids (np.ndarray): (N,) ids of the vertex_poses.
+    vertex_poses (np.ndarray): (N, 7) initial poses as tx ty tz qx qy qz qw.
+    information: (6, 6), (E, 6, 6) or (E, 21) edge information, see information_upper_triangle.
+    loss (str): one of LOSSES, applied to the whitened squared residual norms.
+    loss_scale (float): residual norm at which the robust loss departs from least squares.
+    method (str): 'lm' (Levenberg-Marquardt) or 'gn' (Gauss-Newton).
+    linear_solver (str): 'cholesky' (sparse direct), 'cg' (conjugate
+        gradients) or 'auto' to choose by select_linear_solver.
+    function_tolerance (float): stop when the cost changes less than this, relatively.
+    parameter_tolerance (float): stop when the step is smaller than this, relative to the positions.
+    init (str): 'vertices' starts from the vertex poses, 'tree' chains the
+        edges along a spanning tree, 'auto' uses the vertices when all nodes
+        have one and they are not all equal.
+
+    Returns:
+    tuple: sorted (N,) node ids, (N, 7) optimized poses as tx ty tz qx qy qz
+    qw and a summary dict of the iterations and costs.
+    """
+    rows = edges_to_array(edges)
+    keep = rows[:, 0] != rows[:, 1]
+    rows = rows[keep]
+    edge_ids = rows[:, :2].astype(np.int64)
+    vertex_ids = np.empty(0, dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+    node_ids = np.unique(np.concatenate([vertex_ids, edge_ids.ravel()]))
+    num_nodes = len(node_ids)
+    src = np.searchsorted(node_ids, edge_ids[:, 0])
+    dst = np.searchsorted(node_ids, edge_ids[:, 1])
+
+    translations = rows[:, 2:5]
+    rotations = R.from_quat(rows[:, 5:9]).as_matrix()
+    sqrt_information = whitening(information, len(keep))[keep]
+
+    # gauge: the first node of every connected component
+    adjacency = coo_matrix((np.ones(len(src)), (src, dst)), shape=(num_nodes, num_nodes))
+    num_components, labels = connected_components(adjacency, directed=False)
+    _, roots = np.unique(labels, return_index=True)
+
+    has_vertices = vertex_poses is not None and len(vertex_ids) == num_nodes
+    if init == 'auto':
+        init = 'vertices' if has_vertices and np.ptp(np.asarray(vertex_poses), axis=0).any() else 'tree'
+    if init == 'vertices':
+        if not has_vertices:
+            raise ValueError("init='vertices' needs a vertex pose for each of the {} nodes".format(num_nodes))
+        poses = np.asarray(vertex_poses, dtype=np.float64)[np.argsort(vertex_ids)]
+        node_rotations = R.from_quat(poses[:, 3:]).as_matrix()
+        node_positions = poses[:, :3].copy()
+    elif init == 'tree':
+        node_rotations, node_positions = initialize_from_tree(num_nodes, src, dst, rotations, translations, roots)
+    else:
+        raise ValueError("unknown init {}, expected 'auto', 'vertices' or 'tree'".format(init))
+
+    free = np.ones((num_nodes, 6), dtype=bool)
+    free[roots] = False
+    free = free.ravel()
+
+    def evaluate(node_rotations, node_positions):
+        whitened, rotation_errors, relative_positions = _residuals(node_rotations, node_positions, src, dst,
+                                                                  rotations, translations, sqrt_information)
+        rho, weights = robust_loss(np.einsum('ei,ei->e', whitened, whitened), loss, loss_scale)
+        return 0.5 * rho.sum(), whitened, (rotation_errors, relative_positions), weights
+
+    cost, whitened, errors, weights = evaluate(node_rotations, node_positions)
+    summary = {'initial_cost': cost, 'iterations': 0, 'successful_iterations': 0, 'init': init,
+               'num_nodes': num_nodes, 'num_edges': len(rows), 'num_components': num_components}
+    damping, damping_growth = 1e-4, 2.0
+    if verbose:
+        print("iter      cost      cost_change  |step|    lambda")
+    start = time.perf_counter()
+    for iteration in range(max_iterations):
+        hessian, gradient = _normal_equations(num_nodes, src, dst, node_rotations, rotations, *errors,
+                                              sqrt_information, whitened, weights)
+        hessian = hessian[free][:, free]
+        gradient = gradient[free]
+        if linear_solver == 'auto':
+            linear_solver = select_linear_solver(hessian)
+            summary['linear_solver'] = linear_solver
+        if method == 'lm':
+            diagonal = np.maximum(hessian.diagonal(), 1e-6)
+            system = hessian + diags(damping * diagonal)
+        elif method == 'gn':
+            system = hessian
+        else:
+            raise ValueError("unknown method {}, expected one of {}".format(method, METHODS))
+        step = -solve_normal_equations(system.tocsr(), gradient, linear_solver)
+
+        update = np.zeros(6 * num_nodes)
+        update[free] = step
+        update = update.reshape(num_nodes, 6)
+        candidate_rotations = R.from_rotvec(update[:, 3:]).as_matrix() @ node_rotations
+        candidate_positions = node_positions + update[:, :3]
+        new_cost, new_whitened, new_errors, new_weights = evaluate(candidate_rotations, candidate_positions)
+
+        summary['iterations'] += 1
+        step_norm = np.linalg.norm(step)
+        if verbose:
+            print("{:4d} {: .6e} {: .4e} {: .4e} {: .4e}".format(iteration, cost, cost - new_cost, step_norm,
+                                                                 damping if method == 'lm' else 0.0))
+        if step_norm <= parameter_tolerance * (np.linalg.norm(node_positions) + parameter_tolerance):
+            break
+        if method == 'lm':
+            predicted = 0.5 * step @ (damping * diagonal * step - gradient)
+            gain = (cost - new_cost) / predicted if predicted > 0 else -1.0
+            if gain <= 0:
+                damping *= damping_growth
+                damping_growth *= 2.0
+                if damping > 1e16:
+                    break
+                continue
+            damping *= max(1.0 / 3.0, 1.0 - (2.0 * gain - 1.0) ** 3)
+            damping_growth = 2.0
+
+        converged = abs(cost - new_cost) <= function_tolerance * max(cost, 1e-300)
+        node_rotations, node_positions = candidate_rotations, candidate_positions
+        cost, whitened, errors, weights = new_cost, new_whitened, new_errors, new_weights
+        summary['successful_iterations'] += 1
+        if converged:
+            break
+
+    seconds = time.perf_counter() - start
+    summary.update(final_cost=cost, seconds=seconds)
+    if verbose:
+        print("Total time [PoseGraph]: {} ms.".format(1000.0 * seconds))
+    logging.info("Optimized {} nodes, {} edges in {} iterations: cost {:.6g} -> {:.6g}".format(
+        num_nodes, len(rows), summary['iterations'], summary['initial_cost'], cost))
+    emit(dict(summary, event='solver', backend='numpy', loss=loss, method=method))
+
+    poses = np.column_stack([node_positions, R.from_matrix(node_rotations).as_quat()])
+    return node_ids, poses, summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Optimize a g2o pose graph with the NumPy/SciPy backend')
+    parser.add_argument('--g2o_filename', '--g2o', dest='g2o', type=str, required=True,
+                        help='Path to the text or binary g2o graph, as for bin/position_estimator')
+    parser.add_argument('--output', type=str, default=None, help='Path to the optimized g2o graph (default: <g2o>.out)')
+    parser.add_argument('--loss', type=str, default='none', choices=LOSSES, help='Robust loss of the edge residuals')
+    parser.add_argument('--loss-scale', type=float, default=1.0,
+                        help='Whitened residual norm at which the robust loss departs from least squares')
+    parser.add_argument('--method', type=str, default='lm', choices=METHODS,
+                        help='Levenberg-Marquardt (lm) or Gauss-Newton (gn)')
+    parser.add_argument('--linear-solver', type=str, default='auto', choices=LINEAR_SOLVERS,
+                        help='Sparse Cholesky (CHOLMOD when scikit-sparse is installed, else SuperLU), '
+                             'conjugate gradients, or auto by the bandwidth of the graph')
+    parser.add_argument('--max-iterations', type=int, default=100, help='Maximum number of iterations')
+    parser.add_argument('--init', type=str, default='auto', choices=['auto', 'vertices', 'tree'],
+                        help='Initial poses: the g2o vertices, a spanning tree of the edges, or auto')
+    args = parser.parse_args(argv)
+
+    vertex_ids, vertex_poses = read_g2o_vertices(args.g2o)
+    edges, information = read_g2o_edges(args.g2o)
+    ids, poses, _ = optimize_pose_graph(edges, vertex_ids, vertex_poses, information, args.loss, args.loss_scale,
+                                        args.method, args.linear_solver, args.max_iterations, init=args.init,
+                                        verbose=True)
+    write_g2o(args.output or args.g2o + '.out', poses, edges, information, ids=ids)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import json
+import logging
+
+import numpy as np
+
+from tools.cache import cache_key, cached_columns, content_digest
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+
+# Bumped whenever the arrays parsed from an sfm_data.json change, see read_sfm_data_poses.
+SFM_DATA_LAYOUT_VERSION = 2
+
+
+def _iter_extrinsics(f):
+    # Stream the extrinsics when ijson is available, so the document is never fully loaded.
+    if ijson is not None:
+        return ijson.items(f, 'extrinsics.item', use_float=True)
+    return iter(json.load(f)['extrinsics'])
+
+
+def parse_sfm_data_extrinsics(sfm_data_file, capacity=1024):
+    """
+    Read the extrinsics of an openMVG sfm_data.json.
+
+    Parameters:
+    sfm_data_file (str): Path to the sfm_data.json file.
+    capacity (int): Initial number of preallocated poses, grown geometrically.
+
+    Returns:
+    tuple of np.ndarray: (N,) pose keys, (N, 3) centers and (N, 3, 3) rotations.
+    """
+    keys = np.empty(capacity, dtype=np.int64)
+    centers = np.empty((capacity, 3), dtype=np.float64)
+    rotations = np.empty((capacity, 3, 3), dtype=np.float64)
+
+    count = 0
+    with open(sfm_data_file, 'rb') as f:
+        for extrinsic in _iter_extrinsics(f):
+            if count == len(keys):
+                keys = np.resize(keys, 2 * count)
+                centers = np.resize(centers, (2 * count, 3))
+                rotations = np.resize(rotations, (2 * count, 3, 3))
+            value = extrinsic['value']
+            keys[count] = extrinsic['key']
+            centers[count] = value['center']
+            rotations[count] = value['rotation']
+            count += 1
+
+    return keys[:count].copy(), centers[:count].copy(), rotations[:count].copy()
+
+
+def read_sfm_data_poses(sfm_data_file, cache=True):
+    """
+    Read the camera poses of an sfm_data.json, cached in tools.cache.
+
+    The cache entry is keyed on the content of the JSON file, so it is
+    rebuilt whenever the file changes.
+
+    Parameters:
+    sfm_data_file (str): Path to the sfm_data.json file.
+    cache (bool): Read and write the cache.
+
+    Returns:
+    tuple of np.ndarray: (N,) pose keys, (N, 3) centers and (N, 3, 3) rotations.
+    """
+    def parse():
+        keys, centers, rotations = parse_sfm_data_extrinsics(sfm_data_file)
+        return {'keys': keys, 'centers': centers, 'rotations': rotations}
+
+    if not cache:
+        columns = parse()
+    else:
+        key = cache_key('sfm_data', SFM_DATA_LAYOUT_VERSION, content_digest(sfm_data_file))
+        columns = cached_columns(sfm_data_file, 'sfm_data', key, parse)
+    return columns['keys'], columns['centers'], columns['rotations']
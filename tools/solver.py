@@ -0,0 +1,97 @@
+import logging
+import re
+import subprocess
+import sys
+
+import numpy as np
+
+from tools.instrumentation import emit
+
+# The in-process solver is only available when GraphOptim was configured with
+# -DPYTHON_ENABLED=ON, which places the pygopt module next to this file.
+try:
+    from tools import pygopt
+except ImportError:
+    pygopt = None
+
+POSITION_ESTIMATOR = 'bin/position_estimator'
+ROTATION_ESTIMATOR = 'bin/rotation_estimator'
+
+# Per-iteration rows of the verbose solver tables (ConstrainedL1Solver,
+# IRLSRotationLocalRefiner, ...): the iteration index followed by numbers.
+SOLVER_ITERATION_ROW = re.compile(r'^\s+\d+(\s+[-+0-9.eE]+|\s+-?nan|\s+-?inf)+\s*$')
+# "Total time [LagrangeDual]: 12.5 ms." reported by the solvers' timers.
+SOLVER_TOTAL_TIME = re.compile(r'Total time \[(\w+)\]: ([-+0-9.eE]+) ms')
+
+
+def has_pygopt():
+    return pygopt is not None
+
+
+def estimate_positions(edges, verbose=True):
+    """
+    Run translation averaging on the edges in-process through pygopt.
+
+    Like bin/position_estimator only the edges enter the graph, so the result
+    matches the subprocess path without the g2o round trip.
+
+    Returns:
+    tuple of np.ndarray: sorted (N,) vertex ids and (N, 7) optimized poses
+    as tx ty tz qx qy qz qw.
+    """
+    if pygopt is None:
+        raise ImportError("pygopt is not built, configure GraphOptim with -DPYTHON_ENABLED=ON")
+    from tools.utils import edges_to_array
+
+    view_graph = pygopt.ViewGraph()
+    view_graph.add_edges(np.ascontiguousarray(edges_to_array(edges)))
+
+    options = pygopt.PositionEstimatorOptions()
+    options.verbose = verbose
+    logging.info("Running in-process translation averaging on {} nodes, {} edges".format(
+        view_graph.num_nodes(), view_graph.num_edges()))
+    view_graph.translation_averaging(options)
+    return view_graph.poses()
+
+
+def parse_solver_log(text):
+    """
+    Extract iteration counts and timer totals from the glog output of a solver.
+
+    Returns:
+    dict: 'iterations' (number of verbose iteration rows) and 'timers'
+    (milliseconds per solver stage).
+    """
+    iterations = 0
+    timers = dict()
+    for line in text.splitlines():
+        # Strip the glog prefix "I1018 02:00:00.000000 1234 file.cc:42] ".
+        message = line.split('] ', 1)[1] if '] ' in line else line
+        if SOLVER_ITERATION_ROW.match(message):
+            iterations += 1
+            continue
+        match = SOLVER_TOTAL_TIME.search(message)
+        if match:
+            timers[match.group(1)] = timers.get(match.group(1), 0.0) + float(match.group(2))
+    return {'iterations': iterations, 'timers': timers}
+
+
+def run_position_estimator(g2o_filename, executable=POSITION_ESTIMATOR):
+    """
+    Run bin/position_estimator on a g2o file and return the output filename.
+
+    The solver log is passed through to stderr; its iteration count and
+    timer totals are emitted as a 'solver' record to the active
+    instrumentation.
+    """
+    command = [executable, "--g2o_filename={}".format(g2o_filename)]
+    lines = list()
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True) as process:
+        for line in process.stdout:
+            sys.stderr.write(line)
+            lines.append(line)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+    emit(dict(parse_solver_log(''.join(lines)), event='solver', executable=executable))
+    return g2o_filename + '.out'
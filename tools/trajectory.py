@@ -0,0 +1,346 @@
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+from scipy.spatial.transform import Rotation as R, Slerp
+
+from tools.cache import cache_key, cached_columns, content_digest
+from tools.instrumentation import stage
+from tools.ply import read_ply, tracking_status_colors, write_ply
+from tools.sfm_data import read_sfm_data_poses
+
+logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+
+# Header of the ARposes files; quaternions are stored in (w, x, y, z) order.
+ARPOSES_COLUMNS = ['Timestamp', 'Loc.x', 'Loc.y', 'Loc.z', 'Quat.w', 'Quat.x', 'Quat.y', 'Quat.z', 'TrackingStatus']
+
+# Bumped whenever the arrays parsed from an ARposes file change, see from_arposes.
+ARPOSES_LAYOUT_VERSION = 2
+
+# Tracking status written for poses that have none.
+DEFAULT_TRACKING_STATUS = 'Tracking'
+
+
+def has_arposes_header(line):
+    """Whether the first line of an ARposes file is a header; files recorded without one start with a pose."""
+    try:
+        float(line.split(',', 1)[0])
+    except ValueError:
+        return True
+    return False
+
+
+def _float_array(values, shape):
+    # Float64 C-contiguous input, memory maps included, is kept without a copy.
+    return np.ascontiguousarray(values, dtype=np.float64).reshape(shape)
+
+
+def _apply(rotations, vectors):
+    # Rotation.apply refuses read-only buffers, such as memory-mapped positions.
+    return rotations.apply(vectors if vectors.flags.writeable else vectors.copy())
+
+
+def match_timestamps(timestamps, query, tolerance):
+    """
+    Nearest-neighbour match of query times into sorted timestamps.
+
+    Returns:
+    tuple of np.ndarray: index of the nearest timestamp for every query and
+    a mask of the queries matched within the tolerance.
+    """
+    right = np.clip(np.searchsorted(timestamps, query), 1, len(timestamps) - 1)
+    left = right - 1
+    nearest = np.where(query - timestamps[left] <= timestamps[right] - query, left, right)
+    return nearest, np.abs(timestamps[nearest] - query) <= tolerance
+
+
+class Trajectory:
+    """
+    Camera-to-world poses of a trajectory, one contiguous array per field.
+
+    timestamps (N,) are seconds, or the vertex ids / pose keys of poses read
+    from g2o and sfm_data files; positions (N, 3) and quats (N, 4), in scipy
+    (x, y, z, w) order, are float64. tracking_status (N,) holds the ARKit
+    tracking status strings, None when unknown. Arrays already in this
+    layout, memory maps included, are used without a copy.
+    """
+    __slots__ = ('timestamps', 'positions', 'quats', 'tracking_status')
+
+    def __init__(self, timestamps, positions, quats, tracking_status=None):
+        self.positions = _float_array(positions, (-1, 3))
+        self.quats = _float_array(quats, (-1, 4))
+        num_poses = len(self.positions)
+        if timestamps is None:
+            timestamps = np.arange(num_poses)
+        self.timestamps = _float_array(timestamps, (-1,))
+        if tracking_status is not None:
+            tracking_status = np.asarray(tracking_status)
+            if tracking_status.ndim == 0:
+                tracking_status = np.full(num_poses, tracking_status)
+        self.tracking_status = tracking_status
+
+        lengths = {len(self.timestamps), len(self.quats), num_poses}
+        if tracking_status is not None:
+            lengths.add(len(tracking_status))
+        if len(lengths) != 1:
+            raise ValueError("trajectory fields have different lengths: {}".format(sorted(lengths)))
+
+    @classmethod
+    def from_poses(cls, poses, timestamps=None, tracking_status=None):
+        """Trajectory of (N, 7) poses as tx ty tz qx qy qz qw, the g2o vertex layout."""
+        poses = np.asarray(poses, dtype=np.float64).reshape(-1, 7)
+        return cls(timestamps, poses[:, :3], poses[:, 3:], tracking_status)
+
+    @classmethod
+    def from_vertices(cls, ids, vertex_poses, reference=None):
+        """
+        Trajectory of (N, 7) vertex poses, in id order.
+
+        The timestamps and tracking status are taken from the reference
+        trajectory the vertices were built from (vertex id = pose index);
+        without it the vertex ids stand in for the timestamps.
+        """
+        order = np.argsort(ids, kind='stable')
+        ids = np.asarray(ids)[order]
+        vertex_poses = np.asarray(vertex_poses)[order]
+        if reference is None:
+            return cls.from_poses(vertex_poses, ids)
+        status = None if reference.tracking_status is None else reference.tracking_status[ids]
+        return cls.from_poses(vertex_poses, reference.timestamps[ids], status)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, index):
+        """Sub-trajectory of an index array, mask or slice; slices are views."""
+        if isinstance(index, (int, np.integer)):
+            index = [index]
+        status = None if self.tracking_status is None else self.tracking_status[index]
+        return Trajectory(self.timestamps[index], self.positions[index], self.quats[index], status)
+
+    @property
+    def rotations(self):
+        """Rotation of the N camera-to-world orientations."""
+        return R.from_quat(self.quats)
+
+    @property
+    def poses(self):
+        """(N, 7) poses as tx ty tz qx qy qz qw, the g2o vertex layout."""
+        return np.column_stack([self.positions, self.quats])
+
+    def _with_poses(self, positions, rotations):
+        return Trajectory(self.timestamps, positions, rotations.as_quat(), self.tracking_status)
+
+    def sorted(self):
+        """The trajectory in timestamp order, itself when already sorted."""
+        if np.all(self.timestamps[1:] >= self.timestamps[:-1]):
+            return self
+        return self[np.argsort(self.timestamps, kind='stable')]
+
+    def compose(self, other):
+        """
+        Pose-wise product self * other, T = [R_a R_b, R_a p_b + p_a].
+
+        A trajectory of one pose is broadcast over the other; the result
+        keeps the timestamps of self, or of other when self is broadcast.
+        """
+        rotations = self.rotations
+        positions = _apply(rotations, other.positions) + self.positions
+        stamped = self if len(self) >= len(other) else other
+        return stamped._with_poses(positions, rotations * other.rotations)
+
+    def inverse(self):
+        """Pose-wise inverse, T^-1 = [R^T, -R^T p]."""
+        inverse = self.rotations.inv()
+        return self._with_poses(-_apply(inverse, self.positions), inverse)
+
+    def relative(self, src, dst):
+        """
+        Relative poses T_src^-1 T_dst of the (src, dst) index pairs: the dst
+        poses in the camera frames of the src poses, stamped with the dst
+        timestamps. See edges for the relative poses of the g2o edges.
+        """
+        inverse = self.rotations[src].inv()
+        relative = self[dst]
+        return relative._with_poses(inverse.apply(relative.positions - self.positions[src]),
+                                    inverse * relative.rotations)
+
+    def edges(self, src, dst):
+        """Edges of EDGE_DTYPE between the (src, dst) poses, see tools.utils.relative_pose_edges."""
+        # Imported here: tools.utils depends on this module.
+        from tools.utils import relative_pose_edges
+        return relative_pose_edges(self.positions, self.rotations, src, dst)
+
+    def transform(self, rotation=None, translation=None, scale=1.0):
+        """
+        Apply the similarity p -> scale * rotation p + translation to the
+        whole trajectory, rotating the orientations along.
+
+        Parameters:
+        rotation (Rotation or np.ndarray): rotation, or (3, 3) rotation matrix.
+        translation (np.ndarray): (3,) translation.
+        scale (float): scale of the positions.
+        """
+        positions = scale * self.positions
+        rotations = self.rotations
+        if rotation is not None:
+            if not isinstance(rotation, R):
+                rotation = R.from_matrix(rotation)
+            positions = rotation.apply(positions)
+            rotations = rotation * rotations
+        if translation is not None:
+            positions = positions + translation
+        return self._with_poses(positions, rotations)
+
+    def interpolate(self, query, tolerance=0.01, interpolate=True):
+        """
+        Poses of a time-sorted trajectory at the query times.
+
+        With interpolate=False the nearest pose within the tolerance is used;
+        with interpolate=True positions are linearly interpolated and rotations
+        SLERPed between the neighbouring poses. Queries outside the pose time
+        range (beyond the tolerance) are not matched. The tracking status is
+        the one of the nearest pose.
+
+        Returns:
+        tuple: Trajectory at the query times and (M,) match mask.
+        """
+        query = np.asarray(query, dtype=np.float64)
+        timestamps = self.timestamps
+        nearest, matched = match_timestamps(timestamps, query, tolerance)
+        status = None if self.tracking_status is None else self.tracking_status[nearest]
+        if not interpolate:
+            return Trajectory(query, self.positions[nearest], self.quats[nearest], status), matched
+
+        inside = (query >= timestamps[0] - tolerance) & (query <= timestamps[-1] + tolerance)
+        clamped = np.clip(query, timestamps[0], timestamps[-1])
+        positions = np.column_stack([np.interp(clamped, timestamps, self.positions[:, k]) for k in range(3)])
+        rotations = Slerp(timestamps, self.rotations)(clamped)
+        return Trajectory(query, positions, rotations.as_quat(), status), inside
+
+    @classmethod
+    def from_arposes(cls, filename, cache=True, mmap=True):
+        """
+        Read an ARposes file, in file order.
+
+        The parsed arrays are cached next to the file, keyed on its content
+        (see tools.cache), so unchanged files are not parsed again and large
+        ones are memory-mapped instead of loaded. The header line is
+        optional, see has_arposes_header. Files without a tracking status
+        column give tracking_status=None.
+        """
+        def parse():
+            with stage('read_csv'):
+                with open(filename, 'r') as f:
+                    header = has_arposes_header(f.readline())
+                data = pd.read_csv(filename, header=0 if header else None)
+            values = data.iloc[:, :8].to_numpy(dtype=np.float64)
+            columns = {'timestamps': values[:, 0], 'positions': values[:, 1:4], 'quats': values[:, [5, 6, 7, 4]]}
+            if data.shape[1] > 8:
+                columns['tracking_status'] = data.iloc[:, 8].to_numpy().astype(str)
+            return columns
+
+        if not cache:
+            columns = parse()
+        else:
+            key = cache_key('trajectory', ARPOSES_LAYOUT_VERSION, content_digest(filename))
+            columns = cached_columns(filename, 'trajectory', key, parse, mmap)
+        return cls(columns['timestamps'], columns['positions'], columns['quats'], columns.get('tracking_status'))
+
+    def to_arposes(self, filename, append=False):
+        """Write an ARposes file; with append=True the rows are appended without a header."""
+        output = pd.DataFrame({
+            'Timestamp': self.timestamps,
+            'Loc.x': self.positions[:, 0],
+            'Loc.y': self.positions[:, 1],
+            'Loc.z': self.positions[:, 2],
+            'Quat.w': self.quats[:, 3],
+            'Quat.x': self.quats[:, 0],
+            'Quat.y': self.quats[:, 1],
+            'Quat.z': self.quats[:, 2],
+            'TrackingStatus': DEFAULT_TRACKING_STATUS if self.tracking_status is None else self.tracking_status,
+        }, columns=ARPOSES_COLUMNS)
+        output.to_csv(filename, index=False, mode='a' if append else 'w', header=not append)
+
+    @classmethod
+    def from_g2o(cls, filename, reference=None):
+        """Vertices of a text or binary g2o file, see from_vertices."""
+        from tools.utils import read_g2o_vertices
+        with stage('read_vertices'):
+            ids, vertex_poses = read_g2o_vertices(filename)
+        return cls.from_vertices(ids, vertex_poses, reference)
+
+    def to_g2o(self, filename, edges, information=None, binary_sidecar=False):
+        """Write the poses as vertices 0..N-1 of a g2o graph with the edges, see tools.utils.write_g2o."""
+        from tools.utils import DEFAULT_INFORMATION, write_g2o
+        write_g2o(filename, self.poses, edges, DEFAULT_INFORMATION if information is None else information,
+                  binary_sidecar=binary_sidecar)
+
+    @classmethod
+    def from_sfm_data(cls, filename, cache=True):
+        """
+        Camera poses of an openMVG sfm_data.json, keyed by pose key (see
+        tools.sfm_data.read_sfm_data_poses). openMVG stores world-to-camera
+        rotations, which are inverted here.
+        """
+        keys, centers, rotations = read_sfm_data_poses(filename, cache)
+        return cls(keys, centers, R.from_matrix(rotations).inv().as_quat())
+
+    def sfm_data_extrinsics(self, keys=None, world_to_camera=True):
+        """
+        The poses as openMVG extrinsics: one {"key", "value": {"rotation", "center"}} per pose.
+
+        keys default to the timestamps. With world_to_camera=False the
+        camera-to-world rotations are stored as they are.
+        """
+        keys = self.timestamps.astype(np.int64) if keys is None else keys
+        rotations = self.rotations.inv() if world_to_camera else self.rotations
+        rotation_matrices = rotations.as_matrix().tolist()
+        centers = self.positions.tolist()
+        return [{"key": key, "value": {"rotation": rotation_matrices[ind], "center": centers[ind]}}
+                for ind, key in enumerate(keys.tolist() if isinstance(keys, np.ndarray) else keys)]
+
+    def to_sfm_data(self, filename, sfm_data, keys=None, world_to_camera=True):
+        """Add the poses to the extrinsics of a loaded sfm_data document and write it, see sfm_data_extrinsics."""
+        sfm_data["extrinsics"].extend(self.sfm_data_extrinsics(keys, world_to_camera))
+        with open(filename, 'w') as f:
+            json.dump(sfm_data, f, separators=(',', ':'))
+            f.write("\n")
+
+    @classmethod
+    def from_ply(cls, filename, mmap=False):
+        """
+        Read the vertices of a PLY file written by to_ply.
+
+        Orientations default to identity and timestamps to the vertex
+        index when the file does not store them; the tracking status is not
+        recovered from the colors. Positions are stored as float32 in PLY.
+        """
+        vertices = read_ply(filename, mmap)
+        names = vertices.dtype.names
+        positions = np.column_stack([vertices['x'], vertices['y'], vertices['z']])
+        if all(name in names for name in ('qx', 'qy', 'qz', 'qw')):
+            quats = np.column_stack([vertices['qx'], vertices['qy'], vertices['qz'], vertices['qw']])
+        else:
+            quats = np.tile([0.0, 0.0, 0.0, 1.0], (len(vertices), 1))
+        return cls(vertices['timestamp'] if 'timestamp' in names else None, positions, quats)
+
+    def to_ply(self, filename, binary=False, colors=False, orientation=False, timestamps=False, double=False):
+        """
+        Write the positions to a PLY file, see tools.ply.write_ply.
+
+        Optional per-vertex properties: colors by tracking status, the
+        orientation quaternion (qw, qx, qy, qz) and the timestamp. double=True
+        stores the positions as double.
+        """
+        properties = dict()
+        if colors:
+            status = DEFAULT_TRACKING_STATUS if self.tracking_status is None else self.tracking_status
+            properties.update(tracking_status_colors(np.broadcast_to(status, len(self))))
+        if orientation:
+            properties.update({'qw': self.quats[:, 3], 'qx': self.quats[:, 0], 'qy': self.quats[:, 1],
+                               'qz': self.quats[:, 2]})
+        if timestamps:
+            properties['timestamp'] = self.timestamps
+        write_ply(filename, self.positions, properties, binary=binary, double=double)
@@ -1,127 +1,453 @@
 import numpy as np
-from scipy.spatial.transform import Rotation as R
-import pandas as pd
-import sys
-from tqdm import tqdm
 import argparse
+import itertools
 import logging
 import os
 
+from tools.instrumentation import stage
+
 # create logger
 logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
 
 
-# Function to write PLY file
-def write_g2o(filename, points, edges):
+# Edge record layout: source/target vertex ids followed by the relative
+# translation and the relative rotation as a scipy (x, y, z, w) quaternion.
+EDGE_DTYPE = np.dtype([('src', np.int64), ('dst', np.int64),
+                       ('tx', np.float64), ('ty', np.float64), ('tz', np.float64),
+                       ('qx', np.float64), ('qy', np.float64), ('qz', np.float64), ('qw', np.float64)])
+
+
+# Information matrix of an edge when none is given: 100 on the diagonal.
+DEFAULT_INFORMATION = 100.0 * np.eye(6)
+
+# Compact binary g2o layout (little-endian), shared with
+# gopt::graph::ViewGraph::ReadG2OBinaryFile:
+#   header:  char[4] magic, uint32 version, uint64 num_vertices, uint64 num_edges
+#   vertex:  int64 id, float64 tx ty tz qx qy qz qw
+#   edge:    int64 src, int64 dst, float64 tx ty tz qx qy qz qw, float64 I11..I66
+G2O_BINARY_MAGIC = b'G2OB'
+G2O_BINARY_VERSION = 1
+G2O_BINARY_HEADER_DTYPE = np.dtype([('magic', 'S4'), ('version', '<u4'),
+                                    ('num_vertices', '<u8'), ('num_edges', '<u8')])
+G2O_BINARY_VERTEX_DTYPE = np.dtype([('id', '<i8'), ('pose', '<f8', (7,))])
+G2O_BINARY_EDGE_DTYPE = np.dtype([('src', '<i8'), ('dst', '<i8'),
+                                  ('pose', '<f8', (7,)), ('information', '<f8', (21,))])
+
+
+def information_upper_triangle(information, num_edges):
+    """
+    Flatten edge information matrices to the 21 upper-triangular g2o entries.
+
+    Parameters:
+    information (np.ndarray): a (6, 6) matrix shared by all edges, one
+        (6, 6) matrix per edge as a (num_edges, 6, 6) array, or already
+        flattened (num_edges, 21) entries.
+
+    Returns:
+    np.ndarray: (num_edges, 21) array in I11 I12 ... I16 I22 ... I66 order.
+    """
+    information = np.asarray(information, dtype=np.float64)
+    if information.shape == (num_edges, 21):
+        return information
+    if information.shape == (6, 6):
+        information = np.broadcast_to(information, (num_edges, 6, 6))
+    elif information.shape != (num_edges, 6, 6):
+        raise ValueError("information must be (6, 6), ({0}, 6, 6) or ({0}, 21), got {1}".format(num_edges, information.shape))
+
+    rows, cols = np.triu_indices(6)
+    return information[:, rows, cols]
+
+
+def edges_to_array(edges):
+    """Return the edges as an (E, 9) float array: src, dst, tx, ty, tz, qx, qy, qz, qw."""
+    if edges.dtype.names:
+        return np.column_stack([edges[name] for name in EDGE_DTYPE.names]).astype(np.float64)
+    return np.asarray(edges, dtype=np.float64).reshape(-1, 9)
+
+
+def edges_from_array(rows):
+    """Inverse of edges_to_array: (E, 9) rows to a structured array of EDGE_DTYPE."""
+    rows = np.asarray(rows, dtype=np.float64).reshape(-1, 9)
+    edges = np.empty(len(rows), dtype=EDGE_DTYPE)
+    for column, name in enumerate(EDGE_DTYPE.names):
+        edges[name] = rows[:, column]
+    return edges
+
+
+def g2o_binary_filename(filename):
+    return os.path.splitext(filename)[0] + '.g2ob'
+
+
+def _write_rows(f, row_format, rows, chunk_size):
+    # Format whole chunks of rows with a single % operation.
+    line_format = row_format + '\n'
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        f.write((line_format * len(chunk)) % tuple(chunk.ravel().tolist()))
+
+
+def write_g2o(filename, points, edges, information=DEFAULT_INFORMATION, binary_sidecar=False, chunk_size=10000,
+              ids=None):
     logging.info("saving g2o graph to: {}".format(filename))
-    with open(filename, 'w') as f:
-        for ind, point in enumerate(points):
-            f.write("VERTEX_SE3:QUAT {} {} {} {} {} {} {} {}\n".format(ind, point[0], point[1], point[2], point[3], point[4], point[5], point[6]))
-        for edge in edges:
-            f.write("EDGE_SE3:QUAT {} {} {} {} {} {} {} {} {} 100 0 0 0 0 0 100 0 0 0 0 100 0 0 0 100 0 0 100 0 100\n".format(edge[0], edge[1], edge[2], edge[3], edge[4], edge[5], edge[6], edge[7], edge[8]))
-
-# Function to write PLY file
-def write_ply(filename, points):
-    with open(filename, 'w') as f:
-        f.write("ply\n")
-        f.write("format ascii 1.0\n")
-        f.write("element vertex {}\n".format(len(points)))
-        f.write("property float x\n")
-        f.write("property float y\n")
-        f.write("property float z\n")
-        f.write("end_header\n")
-        for point in points:
-            f.write("{} {} {}\n".format(point[0], point[1], point[2]))
-
-
-def arkittog2o(file_path):
-    poses = pd.read_csv(file_path)
-    poses.columns = ['Timestamp', 'X', 'Y', 'Z', 'QW', 'QX', 'QY', 'QZ', 'TrackingStatus']
-
-    edges = list()
-    logging.info("Converting AR kit to g2o") 
-    for ind in tqdm(range(0, len(poses)-1), desc="Converted: "):
-        r1 = R.from_quat(poses[['QX', 'QY', 'QZ', 'QW']].values[ind])
-        r2 = R.from_quat(poses[['QX', 'QY', 'QZ', 'QW']].values[ind+1])
-        r1 = r1.as_matrix()
-        r2 = r2.as_matrix()
-        rot_rel = r2 * r1.T
-        q_rel = R.from_matrix(rot_rel).as_quat()
-
-        t1 = poses[['X','Y','Z']].values[ind]
-        t2 = poses[['X','Y','Z']].values[ind+1]
-        t_rel = t2-t1
-        edges.append([ind, ind+1,t_rel[0],t_rel[1],t_rel[2],q_rel[0],q_rel[1],q_rel[2],q_rel[3]])
-
-    return poses, edges
-
-def set_pairs_as_edges(poses, edges, pairs_file_path):
-        
-    pairs = pd.read_csv(pairs_file_path)
-    pairs.columns = ['pose1','pose2']
-    pair1 = pairs['pose1'].values
-    pair2 = pairs['pose2'].values
+    points = np.asarray(points, dtype=np.float64)
+    edges = edges_to_array(edges)
+    upper = information_upper_triangle(information, len(edges))
+
+    vertex_rows = np.column_stack([np.arange(len(points)) if ids is None else ids, points])
+    edge_rows = np.column_stack([edges, upper])
+    with stage('text'), open(filename, 'w', buffering=1 << 20) as f:
+        _write_rows(f, "VERTEX_SE3:QUAT %d" + " %.17g" * 7, vertex_rows, chunk_size)
+        _write_rows(f, "EDGE_SE3:QUAT %d %d" + " %.17g" * 28, edge_rows, chunk_size)
+
+    if binary_sidecar:
+        with stage('binary'):
+            write_g2o_binary(g2o_binary_filename(filename), points, edges, information, ids)
+
+
+def write_g2o_binary(filename, points, edges, information=DEFAULT_INFORMATION, ids=None):
+    logging.info("saving binary g2o graph to: {}".format(filename))
+    points = np.asarray(points, dtype=np.float64)
+    edges = edges_to_array(edges)
 
-    logging.info("Adding pairs as edges")
+    header = np.zeros(1, dtype=G2O_BINARY_HEADER_DTYPE)
+    header['magic'] = G2O_BINARY_MAGIC
+    header['version'] = G2O_BINARY_VERSION
+    header['num_vertices'] = len(points)
+    header['num_edges'] = len(edges)
 
-    for ind in tqdm(range(0, len(pairs)), desc="Pairs added: "):
-        ind1 = pair1[ind]
-        ind2 = pair2[ind]
-        r1 = R.from_quat(poses[['QX', 'QY', 'QZ', 'QW']].values[ind1])
-        r2 = R.from_quat(poses[['QX', 'QY', 'QZ', 'QW']].values[ind2])
-        r1 = r1.as_matrix()
-        r2 = r2.as_matrix()
-        rot_rel = r2 * r1.T
-        q_rel = R.from_matrix(rot_rel).as_quat()
+    vertices = np.empty(len(points), dtype=G2O_BINARY_VERTEX_DTYPE)
+    vertices['id'] = np.arange(len(points)) if ids is None else ids
+    vertices['pose'] = points
 
-        edges.append([ind1, ind2,0,0,0,q_rel[0],q_rel[1],q_rel[2],q_rel[3]])
+    binary_edges = np.empty(len(edges), dtype=G2O_BINARY_EDGE_DTYPE)
+    binary_edges['src'] = edges[:, 0]
+    binary_edges['dst'] = edges[:, 1]
+    binary_edges['pose'] = edges[:, 2:]
+    binary_edges['information'] = information_upper_triangle(information, len(edges))
 
+    with open(filename, 'wb') as f:
+        f.write(header.tobytes())
+        f.write(vertices.tobytes())
+        f.write(binary_edges.tobytes())
+
+
+def is_g2o_binary(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(G2O_BINARY_MAGIC)) == G2O_BINARY_MAGIC
+
+
+def _memmap_records(filename, dtype, offset, count):
+    # np.memmap refuses empty mappings.
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=(count,))
+
+
+def read_g2o_binary(filename, mmap=False):
+    """
+    Read a binary g2o file written by write_g2o_binary or ViewGraph::WriteG2OBinaryFile.
+
+    Returns:
+    tuple of np.ndarray: vertices of G2O_BINARY_VERTEX_DTYPE and edges of
+    G2O_BINARY_EDGE_DTYPE. With mmap=True both are read-only memory maps.
+    """
+    header = np.fromfile(filename, dtype=G2O_BINARY_HEADER_DTYPE, count=1)
+    if len(header) != 1 or header['magic'][0] != G2O_BINARY_MAGIC:
+        raise ValueError("{} is not a binary g2o file".format(filename))
+    if header['version'][0] != G2O_BINARY_VERSION:
+        raise ValueError("unsupported binary g2o version {} in {}".format(header['version'][0], filename))
+
+    num_vertices = int(header['num_vertices'][0])
+    num_edges = int(header['num_edges'][0])
+    vertices_offset = G2O_BINARY_HEADER_DTYPE.itemsize
+    edges_offset = vertices_offset + num_vertices * G2O_BINARY_VERTEX_DTYPE.itemsize
+
+    if mmap:
+        vertices = _memmap_records(filename, G2O_BINARY_VERTEX_DTYPE, vertices_offset, num_vertices)
+        edges = _memmap_records(filename, G2O_BINARY_EDGE_DTYPE, edges_offset, num_edges)
+        return vertices, edges
+
+    with open(filename, 'rb') as f:
+        f.seek(vertices_offset)
+        vertices = np.fromfile(f, dtype=G2O_BINARY_VERTEX_DTYPE, count=num_vertices)
+        edges = np.fromfile(f, dtype=G2O_BINARY_EDGE_DTYPE, count=num_edges)
+    return vertices, edges
+
+
+def odometry_edge_indices(num_poses, window=1, stride=1):
+    """
+    Build the vertex index pairs of the odometry edges of a trajectory.
+
+    Every pose i is connected to the poses i + k * stride for k = 1..window,
+    so window=1, stride=1 gives the plain consecutive edges.
+
+    Returns:
+    tuple of np.ndarray: source and target vertex indices.
+    """
+    if window < 1 or stride < 1:
+        raise ValueError("window and stride must be positive, got window={} stride={}".format(window, stride))
+
+    src = list()
+    dst = list()
+    for k in range(1, window + 1):
+        step = k * stride
+        if step >= num_poses:
+            break
+        ind = np.arange(num_poses - step, dtype=np.int64)
+        src.append(ind)
+        dst.append(ind + step)
+
+    if not src:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(src), np.concatenate(dst)
+
+
+def relative_pose_edges(positions, rotations, src, dst):
+    """
+    Compute the relative poses between all (src, dst) vertex pairs at once.
+
+    Parameters:
+    positions (np.ndarray): (N, 3) vertex positions.
+    rotations (Rotation): N stacked vertex rotations.
+    src, dst (np.ndarray): vertex indices of the edges.
+
+    Returns:
+    np.ndarray: edges as a structured array of EDGE_DTYPE.
+    """
+    src = np.asarray(src, dtype=np.int64)
+    dst = np.asarray(dst, dtype=np.int64)
+
+    q_rel = (rotations[dst] * rotations[src].inv()).as_quat()
+    t_rel = positions[dst] - positions[src]
+
+    edges = np.empty(len(src), dtype=EDGE_DTYPE)
+    edges['src'] = src
+    edges['dst'] = dst
+    edges['tx'], edges['ty'], edges['tz'] = t_rel.T
+    edges['qx'], edges['qy'], edges['qz'], edges['qw'] = q_rel.T
     return edges
 
-def convert_ARposes_to_ply(file_path):
-    
+
+def body_frame_edges(edges, rotations):
+    """
+    Rotate the world-frame translations of relative_pose_edges into the frame
+    of their source vertex, R_src (p_dst - p_src), as tools.pose_graph expects.
+
+    Parameters:
+    edges (np.ndarray): edges of EDGE_DTYPE.
+    rotations (Rotation): N stacked vertex rotations, indexed by the edge src.
+
+    Returns:
+    np.ndarray: a copy of the edges with rotated translations.
+    """
+    edges = np.array(edges, dtype=EDGE_DTYPE)
+    translations = np.column_stack([edges['tx'], edges['ty'], edges['tz']])
+    edges['tx'], edges['ty'], edges['tz'] = rotations[edges['src']].apply(translations).T
+    return edges
+
+
+def arkittog2o(file_path, window=1, stride=1, cache=True):
+    """
+    Read an ARposes file and build its odometry edges, see odometry_edge_indices.
+
+    Returns:
+    tuple: the Trajectory of the poses and its edges of EDGE_DTYPE.
+    """
+    from tools.trajectory import Trajectory
+
+    trajectory = Trajectory.from_arposes(file_path, cache)
+
+    logging.info("Converting AR kit to g2o")
+    with stage('edges'):
+        src, dst = odometry_edge_indices(len(trajectory), window, stride)
+        edges = trajectory.edges(src, dst)
+    logging.info("Converted {} odometry edges".format(len(edges)))
+
+    return trajectory, edges
+
+def pair_edges(trajectory, pair1, pair2):
+    """
+    Build loop-closure edges between poses observed at the same location.
+
+    The relative rotations of all pairs are computed in a single Rotation
+    batch; the relative translation of a pair is zero.
+
+    Parameters:
+    trajectory (Trajectory): ARKit poses as returned by arkittog2o.
+    pair1, pair2 (np.ndarray): pose indices of the pairs.
+
+    Returns:
+    np.ndarray: edges as a structured array of EDGE_DTYPE.
+    """
+    pair1 = np.asarray(pair1, dtype=np.int64)
+    pair2 = np.asarray(pair2, dtype=np.int64)
+
+    num_poses = len(trajectory)
+    invalid = (pair1 < 0) | (pair1 >= num_poses) | (pair2 < 0) | (pair2 >= num_poses)
+    if invalid.any():
+        rows = np.flatnonzero(invalid)
+        raise ValueError("{} pairs reference poses outside [0, {}), first at row {}: ({}, {})".format(
+            len(rows), num_poses, rows[0], pair1[rows[0]], pair2[rows[0]]))
+
+    edges = relative_pose_edges(np.zeros((num_poses, 3)), trajectory.rotations, pair1, pair2)
+    return edges
+
+def set_pairs_as_edges(trajectory, edges, pairs_file_path):
+    import pandas as pd
+
+    pairs = pd.read_csv(pairs_file_path)
+    pairs.columns = ['pose1','pose2']
+
+    logging.info("Adding {} pairs as edges".format(len(pairs)))
+    new_edges = pair_edges(trajectory, pairs['pose1'].values, pairs['pose2'].values)
+
+    return np.concatenate([edges, new_edges])
+
+def convert_ARposes_to_ply(file_path, binary=False, colors=False, orientation=False, timestamps=False, cache=True,
+                           double=False):
+    """
+    Export the positions of an ARposes file to a PLY file next to it,
+    see Trajectory.to_ply for the optional properties.
+    """
+    from tools.trajectory import Trajectory
+
     # get file_path without extension
     ply_filename = os.path.splitext(file_path)[0] + '.ply'
     logging.info("Converting ARposes to ply. Output file: {}".format(ply_filename))
 
-    data = pd.read_csv(file_path)
-    data.columns = ['Timestamp', 'X', 'Y', 'Z', 'QW', 'QX', 'QY', 'QZ', 'TrackingStatus']
+    trajectory = Trajectory.from_arposes(file_path, cache)
 
     # Export to PLY
-    write_ply(ply_filename, data[['X', 'Y', 'Z']].values)
+    with stage('write_ply'):
+        trajectory.to_ply(ply_filename, binary, colors, orientation, timestamps, double)
 
-def convert_g2o_to_arposes(gto_filename, arposes_filename):
-    
-    logging.info("Converting g2o to ARkit poses")
-    f_out = open(arposes_filename, 'w')
-    f_out.write("Timestamp,Loc.x,Loc.y,Loc.z,Quat.w,Quat.x,Quat.y,Quat.z,TrackingStatus\n")
-
-    with open(gto_filename, 'r') as f:
-        Lines = f.readlines()
-        count = 0
-        for line in tqdm(Lines):
-            line_list = line.strip().split(' ')
-            if(line_list[0] != "VERTEX_SE3:QUAT"):
+
+G2O_VERTEX_TAG = "VERTEX_SE3:QUAT"
+G2O_EDGE_TAG = "EDGE_SE3:QUAT"
+
+
+def iter_g2o_vertices(filename, batch_size=100000):
+    """
+    Stream the VERTEX_SE3:QUAT records of a g2o text file in fixed-size batches.
+
+    Reading stops at the first record that is not a vertex, vertices come
+    before edges in the files written by write_g2o and ViewGraph.
+
+    Yields:
+    tuple of np.ndarray: (B,) vertex ids and (B, 7) poses as tx ty tz qx qy qz qw.
+    """
+    with open(filename, 'r') as f:
+        while True:
+            lines = list(itertools.islice(f, batch_size))
+            if not lines:
+                return
+
+            stop = None
+            if not lines[-1].startswith(G2O_VERTEX_TAG):
+                stop = next(ind for ind, line in enumerate(lines) if not line.startswith(G2O_VERTEX_TAG))
+                lines = lines[:stop]
+
+            if lines:
+                block = np.loadtxt(lines, usecols=range(1, 9), ndmin=2)
+                yield block[:, 0].astype(np.int64), block[:, 1:]
+
+            if stop is not None:
                 logging.info("Hit line that is not VERTEX_SE3:QUAT")
-                break
+                return
+
+
+def read_g2o_vertices(filename, batch_size=100000):
+    """
+    Read all vertices of a text or binary g2o file.
+
+    Returns:
+    tuple of np.ndarray: (N,) vertex ids and (N, 7) poses as tx ty tz qx qy qz qw.
+    """
+    if is_g2o_binary(filename):
+        vertices, _ = read_g2o_binary(filename)
+        return vertices['id'].astype(np.int64), vertices['pose'].astype(np.float64)
+
+    # Count the vertices first, so the batches are parsed straight into the output.
+    with open(filename, 'r') as f:
+        num_vertices = sum(1 for _ in itertools.takewhile(lambda line: line.startswith(G2O_VERTEX_TAG), f))
+
+    ids = np.empty(num_vertices, dtype=np.int64)
+    vertex_poses = np.empty((num_vertices, 7))
+    start = 0
+    for batch_ids, batch_poses in iter_g2o_vertices(filename, batch_size):
+        ids[start:start + len(batch_ids)] = batch_ids
+        vertex_poses[start:start + len(batch_ids)] = batch_poses
+        start += len(batch_ids)
+    return ids, vertex_poses
+
+
+def read_g2o_edges(filename):
+    """
+    Read all edges of a text or binary g2o file.
 
-            f_out.write(str(line_list[1]) + "," + str(line_list[2]) + "," + str(line_list[3]) + "," + str(line_list[4]) + "," + str(line_list[8]) + "," + str(line_list[5]) + "," + str(line_list[6]) + "," + str(line_list[7]) + ",Tracking\n")
-    return
+    Returns:
+    tuple of np.ndarray: edges of EDGE_DTYPE and their (E, 21) upper-triangle
+    information, as taken by write_g2o.
+    """
+    if is_g2o_binary(filename):
+        _, edges = read_g2o_binary(filename)
+        rows = np.column_stack([edges['src'], edges['dst'], edges['pose']])
+        return edges_from_array(rows), edges['information'].astype(np.float64)
 
+    with open(filename, 'r') as f:
+        lines = [line for line in f if line.startswith(G2O_EDGE_TAG)]
+    if not lines:
+        return np.empty(0, dtype=EDGE_DTYPE), np.empty((0, 21))
+    rows = np.loadtxt(lines, usecols=range(1, 31), ndmin=2)
+    return edges_from_array(rows[:, :9]), rows[:, 9:]
 
-if __name__ == "__main__":
+
+def convert_g2o_to_arposes(gto_filename, arposes_filename, poses=None):
+    """
+    Convert the vertices of an optimized g2o graph back to an ARposes file,
+    see write_arposes.
+    """
+    from tools.trajectory import Trajectory
+
+    logging.info("Converting g2o to ARkit poses")
+    trajectory = Trajectory.from_g2o(gto_filename, poses)
+    with stage('write_arposes'):
+        trajectory.to_arposes(arposes_filename)
+
+
+def write_arposes(arposes_filename, ids, vertex_poses, poses=None, append=False):
+    """
+    Write (N, 7) vertex poses (tx ty tz qx qy qz qw) as an ARposes file.
+
+    Vertices are written in id order. When the input Trajectory (as returned
+    by arkittog2o) is given, its timestamps and tracking status are carried
+    over to the output; otherwise the vertex id stands in for the timestamp.
+    With append=True the rows are appended to the file without a header.
+    """
+    from tools.trajectory import Trajectory
+
+    if poses is None:
+        logging.warning("No input poses given, writing vertex ids as timestamps")
+    Trajectory.from_vertices(ids, vertex_poses, poses).to_arposes(arposes_filename, append)
+
+
+def main(argv=None):
     parser = argparse.ArgumentParser(description='Convert ARKit poses to g2o format')
     parser.add_argument('--arposes', type=str, required=True, help='Path to ARKit data folder')
     parser.add_argument('--pairs', type=str, required=True, help='Path to pairs.txt file')
     parser.add_argument('--g2o', type=str, required=True, help='Path to output g2o file')
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     arposes_filename = args.arposes
     pairs_filename = args.pairs
-    gto_filename = args.gto
+    gto_filename = args.g2o
 
-    poses, edges = arkittog2o(arposes_filename, pairs_filename, gto_filename)
-    edges = set_pairs_as_edges(poses, edges, pairs_filename)
+    trajectory, edges = arkittog2o(arposes_filename)
+    edges = set_pairs_as_edges(trajectory, edges, pairs_filename)
     
-    # Export to PLY
-    write_g2o(gto_filename, poses[['X', 'Y', 'Z', 'QX', 'QY', 'QZ', 'QW']].values, edges)
\ No newline at end of file
+    # Export to g2o
+    trajectory.to_g2o(gto_filename, edges)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,38 +1,188 @@
+import argparse
+import logging
 import os
-import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
-import moviepy.editor as moviepy
+import numpy as np
 from tqdm import tqdm
 
-if len(sys.argv) < 1:
-    print ("Please provide arkit data folder")
-    sys.exit(1)
-# Reading the data
-data_path = sys.argv[1]
-video_file_name = sys.argv[2]
+logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+
+FRAME_FILENAME = "frame%d.{}"
+
+
+def open_video(video_path):
+    """
+    Open a video for decoding, directly through OpenCV when it can read the
+    container and through a one-off MP4 transcode with moviepy otherwise.
+    """
+    vidcap = cv2.VideoCapture(video_path)
+    if vidcap.isOpened() and int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT)) > 0:
+        return vidcap
+    vidcap.release()
+
+    mp4_path = os.path.splitext(video_path)[0] + '.mp4'
+    if not os.path.exists(mp4_path):
+        import moviepy.editor as moviepy
+        logging.info("OpenCV cannot read {}, transcoding to {}".format(video_path, mp4_path))
+        clip = moviepy.VideoFileClip(video_path)
+        clip.write_videofile(mp4_path)
+    return cv2.VideoCapture(mp4_path)
+
+
+def read_frame_timestamps(frames_path):
+    """Timestamps of the video frames from an ARKit Frames.txt (first column, one line per frame)."""
+    return np.loadtxt(frames_path, delimiter=',', usecols=0, ndmin=1)
+
+
+def frames_at_timestamps(frame_timestamps, timestamps):
+    """Indices of the frames nearest to each timestamp (frame_timestamps must be sorted)."""
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    right = np.clip(np.searchsorted(frame_timestamps, timestamps), 1, len(frame_timestamps) - 1)
+    left = right - 1
+    nearest = np.where(timestamps - frame_timestamps[left] <= frame_timestamps[right] - timestamps, left, right)
+    return np.unique(nearest)
+
+
+def write_image(image_path, image, params=()):
+    """
+    Encode an image and write it atomically: it is written to a temporary
+    file first and renamed, so an interrupted run never leaves a truncated
+    image behind.
+    """
+    success, encoded = cv2.imencode(os.path.splitext(image_path)[1], image, list(params))
+    if not success:
+        raise IOError("could not encode {}".format(image_path))
+    tmp_path = "{}.tmp-{}".format(image_path, threading.get_ident())
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(encoded.tobytes())
+        os.replace(tmp_path, image_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def select_frames(num_frames, stride=1, frame_indices=None):
+    """Sorted frame indices to extract: every stride-th frame or the given indices."""
+    if frame_indices is None:
+        return np.arange(0, num_frames, stride)
+    frame_indices = np.unique(np.asarray(frame_indices, dtype=np.int64))
+    return frame_indices[(frame_indices >= 0) & (frame_indices < num_frames)]
+
+
+def extract_frames(video_path, output_folder, frame_indices=None, stride=1, ext='jpg', quality=95, workers=4,
+                   resume=True):
+    """
+    Decode a video and write the selected frames as images.
+
+    Frames are decoded on the calling thread; skipped frames are only grabbed,
+    not decoded. Encoding and writing run on a pool of worker threads with a
+    bounded number of frames in flight. With resume=True frames whose image
+    already exists are not written again; images are renamed into place once
+    complete (see write_image), so an existing image is never truncated.
+    Encoding and write errors are raised.
+
+    Returns:
+    int: number of frames written.
+    """
+    vidcap = open_video(video_path)
+    num_frames = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT))
+    selected = select_frames(num_frames, stride, frame_indices)
+
+    if not os.path.isdir(output_folder):
+        os.makedirs(output_folder)
+
+    filename_format = os.path.join(output_folder, FRAME_FILENAME.format(ext))
+    if resume:
+        done = np.array([os.path.exists(filename_format % ind) for ind in selected], dtype=bool)
+        logging.info("Skipping {} already extracted frames".format(done.sum()))
+        selected = selected[~done]
+    if len(selected) == 0:
+        vidcap.release()
+        return 0
+
+    if ext.lower() in ('jpg', 'jpeg'):
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    elif ext.lower() == 'png':
+        params = [cv2.IMWRITE_PNG_COMPRESSION, 3]
+    else:
+        params = []
+
+    in_flight = threading.BoundedSemaphore(2 * workers)
+
+    def write(image_path, image):
+        try:
+            write_image(image_path, image, params)
+        finally:
+            in_flight.release()
+
+    written = 0
+    pending = deque()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            frame = 0
+            for target in tqdm(selected, desc="Extracted: "):
+                while frame < target:
+                    if not vidcap.grab():
+                        break
+                    frame += 1
+                success, image = vidcap.read()
+                frame += 1
+                if image is None or not success:
+                    logging.warning("Failed reading frame {}".format(target))
+                    break
+
+                # Raise the errors of the completed writes as they come in.
+                while pending and pending[0].done():
+                    pending.popleft().result()
+                    written += 1
+
+                in_flight.acquire()
+                pending.append(executor.submit(write, filename_format % target, image))
+
+            while pending:
+                pending.popleft().result()
+                written += 1
+    finally:
+        vidcap.release()
+    return written
 
-video_path = data_path + "/" + video_file_name
-output_folder = data_path + "/images"
 
-ext = video_file_name.split('.')[1]
-if ext.lower() != 'mp4':
-    clip = moviepy.VideoFileClip(video_path)
-    clip.write_videofile(video_path.split('.')[0] + '.mp4')
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Extract frames from an ARKit video')
+    parser.add_argument('data_path', type=str, help='Path to ARKit data folder')
+    parser.add_argument('video_file_name', type=str, help='Video file name inside the data folder')
+    parser.add_argument('--output', type=str, help='Output folder (default: <data_path>/images)')
+    parser.add_argument('--stride', type=int, default=1, help='Extract every stride-th frame')
+    parser.add_argument('--frames', type=str, help='File with the frame indices to extract, one per line')
+    parser.add_argument('--timestamps', type=str, help='File with the timestamps to extract, one per line (first column)')
+    parser.add_argument('--frames-txt', type=str, help='Frames.txt mapping frames to timestamps (default: <data_path>/Frames.txt)')
+    parser.add_argument('--ext', type=str, default='jpg', help='Image format: jpg or png')
+    parser.add_argument('--quality', type=int, default=95, help='JPEG quality')
+    parser.add_argument('--workers', type=int, default=4, help='Number of encoding threads')
+    parser.add_argument('--no-resume', action='store_true', help='Write frames again even if their image exists')
+    args = parser.parse_args(argv)
 
+    video_path = os.path.join(args.data_path, args.video_file_name)
+    output_folder = args.output or os.path.join(args.data_path, "images")
 
-vidcap = cv2.VideoCapture(video_path.split('.')[0] + '.mp4')
+    frame_indices = None
+    if args.frames:
+        frame_indices = np.loadtxt(args.frames, dtype=np.int64, ndmin=1)
+    elif args.timestamps:
+        frames_txt = args.frames_txt or os.path.join(args.data_path, "Frames.txt")
+        timestamps = np.loadtxt(args.timestamps, delimiter=',', usecols=0, ndmin=1)
+        frame_indices = frames_at_timestamps(read_frame_timestamps(frames_txt), timestamps)
 
-if not os.path.isdir(output_folder):
-    os.makedirs(output_folder) 
+    written = extract_frames(video_path, output_folder, frame_indices, args.stride, args.ext, args.quality,
+                             args.workers, not args.no_resume)
+    logging.info("Wrote {} frames to: {}".format(written, output_folder))
 
-length = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT))
-#success,image = vidcap.read()
 
-for count in tqdm(range(length)):
-  success,image = vidcap.read()
-  if image is None or not success:
-    print("Failed reading: ", "frame%d.jpg" % count, "\n")
-    break
-  image_path = os.path.join(output_folder, "frame%d.jpg" % count)
-  cv2.imwrite(image_path, image)     # save frame as JPEG file
-  
\ No newline at end of file
+if __name__ == '__main__':
+    main()
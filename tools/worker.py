@@ -0,0 +1,121 @@
+import argparse
+import contextlib
+import importlib
+import json
+import logging
+import os
+import signal
+import socketserver
+import sys
+import time
+import traceback
+
+from tools.cli import run_command
+
+logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+
+# Modules imported when the worker starts, so jobs do not pay for them.
+DEFAULT_PRELOAD = ['numpy', 'pandas', 'scipy.spatial.transform', 'tools.pipeline', 'tools.trajectory', 'tools.pose_graph']
+
+
+def run_job(request):
+    """
+    Run one job request in this process.
+
+    A request is a dict with the 'command' and its 'args' list, optionally an
+    'id' echoed in the response and a 'cwd' to run in. Anything the command
+    prints goes to stderr, so stdout only carries responses.
+
+    Returns:
+    dict: the response with the 'status' ('ok' or 'failed'), 'returncode',
+    'seconds' and, on failure, the 'error'.
+    """
+    response = {'id': request.get('id'), 'command': request.get('command')}
+    start = time.perf_counter()
+    cwd = os.getcwd()
+    try:
+        if request.get('cwd'):
+            os.chdir(request['cwd'])
+        with contextlib.redirect_stdout(sys.stderr):
+            response['returncode'] = run_command(request['command'], [str(arg) for arg in request.get('args', [])])
+    except SystemExit as e:
+        # argparse errors and --help exit
+        response['returncode'] = e.code if isinstance(e.code, int) else 1
+    except Exception as e:
+        response['returncode'] = 1
+        response['error'] = "{}: {}".format(type(e).__name__, e)
+        response['traceback'] = traceback.format_exc()
+    finally:
+        os.chdir(cwd)
+    response['status'] = 'ok' if response['returncode'] == 0 else 'failed'
+    response['seconds'] = time.perf_counter() - start
+    return response
+
+
+def handle_line(line):
+    """Run the JSON request on one line and return the JSON response line."""
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict) or 'command' not in request:
+            raise ValueError("a request is a JSON object with a 'command'")
+    except ValueError as e:
+        response = {'status': 'failed', 'returncode': 1, 'error': "invalid request: {}".format(e)}
+    else:
+        response = run_job(request)
+    return json.dumps(response) + '\n'
+
+
+def serve_stdin(input_stream=None, output_stream=None):
+    """Run one JSON request per line of stdin, answering on stdout, until EOF."""
+    input_stream = input_stream or sys.stdin
+    output_stream = output_stream or sys.stdout
+    for line in input_stream:
+        if line.strip():
+            output_stream.write(handle_line(line))
+            output_stream.flush()
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            line = line.decode('utf-8')
+            if line.strip():
+                self.wfile.write(handle_line(line).encode('utf-8'))
+                self.wfile.flush()
+
+
+def serve_socket(socket_path):
+    """
+    Serve JSON line requests on a Unix domain socket.
+
+    Connections are handled one at a time, since the jobs share this
+    process' working directory and stdout.
+    """
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    # Exit through the finally clause below on kill, removing the socket.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    with socketserver.UnixStreamServer(socket_path, _JobHandler) as server:
+        logging.info("Worker listening on: {}".format(socket_path))
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(socket_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Keep the tools loaded and run JSON line jobs from stdin or a socket')
+    parser.add_argument('--socket', type=str, default=None, help='Serve on this Unix domain socket instead of stdin')
+    parser.add_argument('--preload', type=str, nargs='*', default=DEFAULT_PRELOAD, help='Modules to import at startup')
+    args = parser.parse_args(argv)
+
+    for module in args.preload:
+        importlib.import_module(module)
+    logging.info("Worker ready, preloaded: {}".format(', '.join(args.preload)))
+
+    if args.socket:
+        serve_socket(args.socket)
+    else:
+        serve_stdin()
+    return 0